@@ -1,35 +1,51 @@
 #!/bin/bash
 
-# Fixed location
+# Fixed location; SERVICE_PROVIDER_LOCATION and DEVICE_LOCATION override
+# the addresses, e.g. for bench_attestation.py on localhost
 # service_provider_location="$PWD/../SP"
-service_provider_location="20.85.126.165:8080/cgi-bin/server.py"
+service_provider_location="${SERVICE_PROVIDER_LOCATION:-20.85.126.165:8080/cgi-bin/server.py}"
 
 # PCA location
 privacy_ca_location=""
 
 # Location for node 1, node 2, etc.
 #device_location="$PWD"
-device_location="20.85.126.165:8080/cgi-bin/client.py"
+device_location="${DEVICE_LOCATION:-20.85.126.165:8080/cgi-bin/client.py}"
+
+# Envelope encryption of the service content (RSA-wrapped AES key, AES-GCM content)
+envelope="python3 $(dirname "$0")/../envelope.py"
+
+# Where -k hands over the released key instead of key.txt, e.g. a FIFO of decrypt.py
+key_output=""
 
 # State
 event_file_found=0
 device_registration_request=0
 device_service_request=0
 
+# Wait up to $1 seconds for file $2. The uploads are renamed into place when complete, so
+# inotifywait wakes up as soon as the file arrives (moved_to, or close_write for files
+# written in place). Without inotify-tools the directory is polled every poll_interval.
+poll_interval=0.1
 wait_loop() {
-    counter=1
-    until [ $counter -gt $1 ]
+    local deadline=$((SECONDS + $1))
+    local started=$EPOCHREALTIME
+    until test -f $2
     do
-       test -f $2
-       if [ $? == 0 ];then
-          event_file_found=1
-          break
+       if [ $SECONDS -ge $deadline ];then
+          trace wait $2 $started
+          return
+       fi
+       echo -ne "Waiting $1 seconds: $(($1 - deadline + SECONDS))"'\r'
+       if command -v inotifywait > /dev/null;then
+          # The timeout covers a file arriving between the test and the watch being set up
+          inotifywait -qq -t 1 -e moved_to -e close_write "$(dirname $2)" 2> /dev/null
        else
-          echo -ne "Waiting $1 seconds: $counter"'\r'
+          sleep $poll_interval
        fi
-       ((counter++))
-       sleep 1
     done
+    trace wait $2 $started
+    event_file_found=1
 }
 
 LOG_ERROR() {
@@ -42,11 +58,43 @@ LOG_INFO() {
     echo -e "\033[93mPASS: \e[97m${messagestring}\e[0m"
 }
 
+# With ATTEST_TRACE=FILE every wait, upload and tool call appends "<kind> <name> <start> <end>"
+# (epoch seconds) to FILE, for bench_attestation.py
+trace() {
+    if [ -n "$ATTEST_TRACE" ];then
+        echo "$1 $2 $3 $EPOCHREALTIME" >> "$ATTEST_TRACE"
+    fi
+}
+
+if [ -n "$ATTEST_TRACE" ];then
+    for traced_command in tpm2 tpm2_createek tpm2_createak tpm2_readpublic tpm2_startauthsession tpm2_policysecret tpm2_activatecredential tpm2_flushcontext tpm2_pcrreset tpm2_pcrextend tpm2_quote tpm2_create tpm2_sign openssl python3; do
+        eval "$traced_command() {
+            local started=\$EPOCHREALTIME
+            command $traced_command \"\$@\"
+            local status=\$?
+            trace tool $traced_command \$started
+            return \$status
+        }"
+    done
+fi
+
 remote_cp() {
+    local started=$EPOCHREALTIME
     dest_name=${2##*/}
 	remote_host=${2%/${dest_name}}
 	
-	curl -X POST -F "file=@${1}" -F "destname=${dest_name}" ${remote_host}     
+	checksum=$(sha256sum ${1} | cut -d' ' -f1)
+	
+	# The receiver stores the file only when the checksum matches; a rejected upload
+	# (checksum mismatch, too large) fails here with the service's reason and the caller stops
+	# instead of leaving the other side waiting
+	response=$(curl -sS --fail-with-body -X POST -F "file=@${1}" -F "destname=${dest_name}" -F "sha256=${checksum}" ${remote_host})
+	local curl_status=$?
+	trace upload ${dest_name} $started
+	if [ $curl_status != 0 ] || [ "${response}" != "Success" ];then
+	    LOG_ERROR "Upload of ${1} to ${2} failed. ${response}"
+	    return 1
+	fi
 }
 
 await_and_compelete_credential_challenge() {
@@ -82,7 +130,7 @@ device_registration() {
 
     # Send device location to service-provider
     echo "device_location: $device_location" > d_s_registration.txt
-    remote_cp d_s_registration.txt $service_provider_location/.	
+    remote_cp d_s_registration.txt $service_provider_location/. || return 1
     rm -f d_s_registration.txt
 
     # Wait for PCA location information from service provider
@@ -128,18 +176,18 @@ device_registration() {
     touch fake_ek_certificate.txt
 	chmod a+w rsa_ak.pub
 
-    remote_cp rsa_ek.pub $privacy_ca_location/.
-    remote_cp rsa_ak.name $privacy_ca_location/.
+    remote_cp rsa_ek.pub $privacy_ca_location/. || return 1
+    remote_cp rsa_ak.name $privacy_ca_location/. || return 1
 	
     touch d_p_device_ready.txt
-    remote_cp d_p_device_ready.txt $privacy_ca_location/.
+    remote_cp d_p_device_ready.txt $privacy_ca_location/. || return 1
     rm -f d_p_device_ready.txt
 	
     registration_status_string="Credential activation challenge."
     await_and_compelete_credential_challenge
     if [ $? == 0 ];then
         LOG_INFO "$registration_status_string"
-        remote_cp actcred.out $privacy_ca_location/.
+        remote_cp actcred.out $privacy_ca_location/. || return 1
         rm -f actcred.out
         return 0
     else
@@ -165,7 +213,7 @@ request_device_registration () {
     LOG_INFO "$device_registration_status_string"
     event_file_found=0
     remote_cp p_d_registration_token.txt \
-    $service_provider_location/d_s_registration_token.txt
+    $service_provider_location/d_s_registration_token.txt || return 1
     rm -f p_d_registration_token.txt
 
     return 0
@@ -188,9 +236,9 @@ process_device_anonymous_identity_challenge() {
       return 1
    else
       echo "device_location: $device_location" > d_s_service.txt
-      remote_cp d_s_service.txt $service_provider_location/.
+      remote_cp d_s_service.txt $service_provider_location/. || return 1
       rm -f d_s_service.txt
-      remote_cp $device_service_aik $service_provider_location/d_s_service_aik.pub
+      remote_cp $device_service_aik $service_provider_location/d_s_service_aik.pub || return 1
    fi
 
    identity_challenge_status_string="Privacy-CA information receipt from Service-Provider."
@@ -218,18 +266,18 @@ process_device_anonymous_identity_challenge() {
     event_file_found=0
     rm -f p_d_pca_ready.txt
 
-    remote_cp rsa_ek.pub $privacy_ca_location/.
-    remote_cp rsa_ak.name $privacy_ca_location/.
+    remote_cp rsa_ek.pub $privacy_ca_location/. || return 1
+    remote_cp rsa_ak.name $privacy_ca_location/. || return 1
 	
     touch d_p_device_ready.txt
-    remote_cp d_p_device_ready.txt $privacy_ca_location/.
+    remote_cp d_p_device_ready.txt $privacy_ca_location/. || return 1
     rm -f d_p_device_ready.txt
 
     identity_challenge_status_string="Credential activation challenge."
     await_and_compelete_credential_challenge
     if [ $? == 0 ];then
         LOG_INFO "$identity_challenge_status_string"
-        remote_cp actcred.out $privacy_ca_location/.
+        remote_cp actcred.out $privacy_ca_location/. || return 1
         rm -f actcred.out
     else
         LOG_ERROR "$identity_challenge_status_string"
@@ -246,7 +294,7 @@ process_device_anonymous_identity_challenge() {
     LOG_INFO "$identity_challenge_status_string"
     event_file_found=0
     remote_cp p_d_service_token.txt \
-    $service_provider_location/d_s_service_token.txt
+    $service_provider_location/d_s_service_token.txt || return 1
     rm -f p_d_service_token.txt
 
    return 0
@@ -287,9 +335,9 @@ process_device_software_state_validation_request() {
 
     #cp attestation_quote.dat attestation_quote.signature pcr.bin \
     #$service_provider_location/.
-	remote_cp attestation_quote.dat $service_provider_location/.
-	remote_cp pcr.bin $service_provider_location/.
-	remote_cp attestation_quote.signature $service_provider_location/.
+	remote_cp attestation_quote.dat $service_provider_location/. || return 1
+	remote_cp pcr.bin $service_provider_location/. || return 1
+	remote_cp attestation_quote.signature $service_provider_location/. || return 1
 	
     return 0
 }
@@ -297,7 +345,8 @@ process_device_software_state_validation_request() {
 process_encrypted_service_data_content() {
 
     service_data_status_string="Encrypted service-data-content receipt from Service-Provider"
-    max_wait=6
+    # Long enough for a data file sent ahead of the content; returns as soon as it arrives
+    max_wait=60
     wait_loop $max_wait s_d_service_content.encrypted
     if [ $event_file_found == 0 ];then
         LOG_ERROR "$service_data_status_string"
@@ -306,16 +355,57 @@ process_encrypted_service_data_content() {
     LOG_INFO "$service_data_status_string"
     event_file_found=0
 
+    # With -k the unwrapped AES key and the content stay in tmpfs until they are handed
+    # over, nothing of them is written to the device's storage
+    secrets=.
+    if [ -n "$key_output" ];then
+        secrets=`mktemp -d -p /dev/shm 2> /dev/null || mktemp -d`
+    fi
+
+    # The TPM unwraps the AES key, which decrypts the content
     service_data_status_string="Decryption of service-data-content receipt from Service-Provider"
-    tpm2 rsadecrypt -c service_content_key.ctx -o s_d_service_content.decrypted \
-    s_d_service_content.encrypted -Q
-    if [ $? == 1 ];then
+    (umask 077 && tpm2 rsadecrypt -c service_content_key.ctx -o $secrets/service_content.key \
+    s_d_service_content.key -Q) && \
+    $envelope open --key-file $secrets/service_content.key \
+    s_d_service_content.encrypted $secrets/s_d_service_content.decrypted
+    if [ $? != 0 ];then
         LOG_ERROR "$service_data_status_string"
-        rm -f s_d_service_content.encrypted
+        rm -f s_d_service_content.* s_d_service_data.encrypted \
+        $secrets/service_content.key $secrets/s_d_service_content.decrypted
+        [ "$secrets" != . ] && rmdir "$secrets"
         return 1
     fi
     LOG_INFO "$service_data_status_string"
 
+    if [ -n "$key_output" ];then
+        # One `name: base64` line per key; content_key opens a data envelope
+        {
+            echo "service_content: `base64 -w0 $secrets/s_d_service_content.decrypted`"
+            if [ -f s_d_service_data.encrypted ];then
+                echo "content_key: `base64 -w0 $secrets/service_content.key`"
+            fi
+        } > "$key_output"
+        if [ -f s_d_service_data.encrypted ];then
+            mv s_d_service_data.encrypted service_data.envelope
+            chown "${SUDO_USER:-$USER}" service_data.envelope
+            LOG_INFO "Service-data received for decrypt.py"
+        fi
+        rm -rf "$secrets"
+        rm -f s_d_service_content.*
+        LOG_INFO "Service-content handed over through $key_output"
+        return 0
+    fi
+
+    # A data file stays encrypted; decrypt.py streams it into the pipeline with the key.
+    # Both go to the user running decrypt.py, as this script runs under sudo.
+    if [ -f s_d_service_data.encrypted ];then
+        mv s_d_service_data.encrypted service_data.envelope
+        chown "${SUDO_USER:-$USER}" service_content.key service_data.envelope
+        LOG_INFO "Service-data received for decrypt.py"
+    else
+        rm -f service_content.key
+    fi
+
 	cp s_d_service_content.decrypted key.txt
 	chmod a+r key.txt
     SERVICE_CONTENT=`cat s_d_service_content.decrypted`
@@ -339,7 +429,7 @@ process_generate_service_content_key() {
         -f pem \
         -o d_s_service_content_key.pub \
         -Q
-    remote_cp d_s_service_content_key.pub $service_provider_location/.
+    remote_cp d_s_service_content_key.pub $service_provider_location/. || return 1
 
     tpm2_sign \
         -c rsa_ak.ctx \
@@ -348,7 +438,7 @@ process_generate_service_content_key() {
         -f plain \
         -o d_s_service_content_key_pub.sig \
         d_s_service_content_key.pub
-    remote_cp d_s_service_content_key_pub.sig $service_provider_location/.
+    remote_cp d_s_service_content_key_pub.sig $service_provider_location/. || return 1
 
     return 0
 }
@@ -401,10 +491,11 @@ request_device_service() {
 #fi
 
 
-while getopts ":hrt:" opt; do
+while getopts ":hrt:k:" opt; do
   case ${opt} in
     h )
       echo "Pass 'r' for registration or 't' for service request"
+      echo "With 't', 'k PATH' writes the released key to PATH (e.g. a FIFO) instead of key.txt"
       ;;
     r )
       device_registration_request=1
@@ -413,6 +504,9 @@ while getopts ":hrt:" opt; do
       device_service_request=1
       device_service_aik=$OPTARG
       ;;
+    k )
+      key_output=$OPTARG
+      ;;
   esac
 done
 shift $(( OPTIND - 1 ))
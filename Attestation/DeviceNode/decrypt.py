@@ -1,6 +1,7 @@
 
 from Cryptodome.Cipher import AES
 from Cryptodome.Random import get_random_bytes
+import argparse
 import base64
 import subprocess
 import os
@@ -22,13 +23,62 @@ def decrypt_aes(encrypted_data, key):
     return unpad(decrypted_data)
 
 
-def encrypt_aes(encrypted_data):
+# Chunks are read and decrypted this many bytes at a time (a multiple of the AES block size)
+CHUNK_SIZE = 1024 * 1024
+
+
+# Decrypt an IV-prefixed AES-CBC stream chunk by chunk. The cipher object carries the CBC
+# state between chunks and the last block is held back until the end so that only the
+# final block is unpadded.
+def iter_decrypted_chunks(file, key, chunk_size=CHUNK_SIZE):
     key = key[:32].ljust(32, b'\0')
-    iv = encrypted_data[:16]  # Extract the IV
-    encrypted_data = encrypted_data[16:]
+    iv = file.read(AES.block_size)  # Extract the IV
+    if len(iv) != AES.block_size:
+        raise ValueError('encrypted data is shorter than the IV')
     cipher = AES.new(key, AES.MODE_CBC, iv)
-    decrypted_data = cipher.encrypt(encrypted_data)
-    return unpad(decrypted_data)
+    pending = b''  # bytes read past the last whole block
+    last_block = b''
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        chunk = pending + chunk
+        aligned = len(chunk) - len(chunk) % AES.block_size
+        pending = chunk[aligned:]
+        if aligned == 0:
+            continue
+        decrypted = last_block + cipher.decrypt(chunk[:aligned])
+        last_block = decrypted[-AES.block_size:]
+        if len(decrypted) > AES.block_size:
+            yield decrypted[:-AES.block_size]
+    if pending or not last_block:
+        raise ValueError('encrypted data is not a whole number of AES blocks')
+    yield unpad(last_block)
+
+
+# Decrypt input_path into output_path in constant memory; returns the decrypted size
+def decrypt_aes_stream(input_path, output_path, key, chunk_size=CHUNK_SIZE):
+    written = 0
+    with open(input_path, 'rb') as encrypted_file, open(output_path, 'wb') as decrypted_file:
+        for chunk in iter_decrypted_chunks(encrypted_file, key, chunk_size):
+            decrypted_file.write(chunk)
+            written += len(chunk)
+    return written
+
+
+# PKCS#7 padding, the inverse of unpad
+def pad(data):
+    padding_length = AES.block_size - len(data) % AES.block_size
+    return data + bytes([padding_length]) * padding_length
+
+
+# IV-prefixed AES-CBC encryption in the format decrypt_aes reads (e.g. train.bin)
+def encrypt_aes(unencrypted_data, key):
+    key = key[:32].ljust(32, b'\0')
+    iv = get_random_bytes(AES.block_size)  # Fresh IV, stored in front of the ciphertext
+    cipher = AES.new(key, AES.MODE_CBC, iv)
+    encrypted_data = cipher.encrypt(pad(unencrypted_data))
+    return iv + encrypted_data
 
 def read_binary_file(file_path):
     with open(file_path, 'rb') as file:
@@ -40,25 +90,88 @@ def write_binary_file(file_path, data):
 
 
 
-# Example usage
-# key = b'functionremainsunchangedasitwillcorrectly'  # Your encryption key
-subprocess.run(["sudo", os.path.join(os.getcwd(), "DeviceNode.sh"), "-t", "rsa_ak.pub"])
-f = open(os.path.join(os.getcwd(), "key.txt"))
-stringkey = f.read()
-f.close()
-os.remove("key.txt")
-key = bytes(stringkey, 'utf-8')
-# print(key)
-input_file_path = 'train.zip'  # Path to the input binary file
-encrypted_file_path = 'train.bin'  # Path to the output encrypted file
-decrypted_file_path = 'decrypted_file.zip'  # Path to the output decrypted file
-
-
-
-# Read the encrypted data from the encrypted file
-encrypted_data_from_file = read_binary_file(encrypted_file_path)
-# Decrypt the data and write it to the decrypted file
-decrypted_data = decrypt_aes(encrypted_data_from_file, key)
-write_binary_file(decrypted_file_path, decrypted_data)
-
-print('decryption completed successfully.')
+# Environment variables Data_analysis.py reads its input paths from, and the dataset members
+ANALYSIS_INPUTS = {'ADS_FILE_PATH': 'train_data_ads.csv', 'FEEDS_FILE_PATH': 'train_data_feeds.csv'}
+
+
+# Unzip the decrypted dataset into in-memory files and run the analysis script on them as
+# /dev/fd/N, so neither the zip nor the CSVs touch the disk; returns the exit status
+def run_analysis(chunks, script):
+    from stream_extract import extract_zip_memfds
+    fds = extract_zip_memfds(chunks)
+    try:
+        by_name = {os.path.basename(name): fd for name, fd in fds.items()}
+        env = dict(os.environ)
+        for variable, member in ANALYSIS_INPUTS.items():
+            if member not in by_name:
+                raise ValueError(f'{member} is not in the decrypted dataset')
+            env[variable] = f'/dev/fd/{by_name[member]}'
+        return subprocess.run([sys.executable, script], env=env, pass_fds=list(fds.values())).returncode
+    finally:
+        for fd in fds.values():
+            os.close(fd)
+
+
+if __name__ == "__main__":
+    # Example usage
+    # key = b'functionremainsunchangedasitwillcorrectly'  # Your encryption key
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.dirname(here))  # envelope.py
+    sys.path.insert(0, os.path.dirname(os.path.dirname(here)))  # stream_extract.py
+    from envelope import iter_open_stream, open_stream
+    from key_agent import fetch_keys, handshake_keys
+
+    parser = argparse.ArgumentParser(description='Attest, then decrypt the dataset.')
+    parser.add_argument('--run-analysis', metavar='SCRIPT',
+                        help='decrypt into memory and run SCRIPT (e.g. Data_analysis.py) on it '
+                             'instead of writing decrypted_file.zip')
+    args = parser.parse_args()
+
+    # A running key_agent.py hands out the key of its last attestation in milliseconds;
+    # without it the whole handshake runs here. Either way the key comes over a socket or
+    # pipe, it is never stored in a file.
+    from_agent = True
+    try:
+        key, content_key = fetch_keys()
+    except (OSError, RuntimeError, ValueError) as error:
+        print(f'Key agent not used ({error}), attesting directly')
+        from_agent = False
+        key, content_key = handshake_keys(['sudo', os.path.join(os.getcwd(), "DeviceNode.sh"), "-t", "rsa_ak.pub"],
+                                          os.getcwd())
+    # print(key)
+    input_file_path = 'train.zip'  # Path to the input binary file
+    encrypted_file_path = 'train.bin'  # Path to the output encrypted file
+    decrypted_file_path = 'decrypted_file.zip'  # Path to the output decrypted file
+
+    envelope_path = 'service_data.envelope'  # Dataset released in the attestation round, if any
+
+    if content_key is not None and not os.path.exists(envelope_path):
+        sys.exit(f'{envelope_path} is gone but the key agent still holds its key; '
+                 'run key_agent.py --flush to attest again')
+    if os.path.exists(envelope_path):
+        # Decrypted straight from the envelope, there is no separate train.bin
+        if content_key is None:
+            sys.exit(f'{envelope_path} exists but the attestation released no key for it')
+        with open(envelope_path, 'rb') as envelope_file:
+            if args.run_analysis:
+                status = run_analysis(iter_open_stream(envelope_file, content_key), args.run_analysis)
+            else:
+                with open(decrypted_file_path, 'wb') as decrypted_file:
+                    open_stream(envelope_file, decrypted_file, content_key)
+        # The agent answers later runs with the same content key and no new envelope, so the
+        # envelope stays until the next handshake replaces both; a direct handshake's key is gone
+        if not from_agent:
+            os.remove(envelope_path)
+    else:
+        # Decrypt the encrypted file chunk by chunk
+        with open(encrypted_file_path, 'rb') as encrypted_file:
+            if args.run_analysis:
+                status = run_analysis(iter_decrypted_chunks(encrypted_file, key), args.run_analysis)
+            else:
+                with open(decrypted_file_path, 'wb') as decrypted_file:
+                    for chunk in iter_decrypted_chunks(encrypted_file, key):
+                        decrypted_file.write(chunk)
+
+    print('decryption completed successfully.')
+    if args.run_analysis:
+        sys.exit(status)
@@ -0,0 +1,274 @@
+#Device-side key agent: attest once, then hand out the released key over a local socket.
+#
+#    python3 key_agent.py --ttl 900 &
+#    python3 decrypt.py           # asks the agent, falls back to DeviceNode.sh without it
+#
+#The first key request runs the full handshake (`sudo DeviceNode.sh -t rsa_ak.pub -k FIFO`),
+#which hands the released key over through a private FIFO, and keeps it in memory only. Later
+#requests are answered from memory while the key is younger than --ttl and PCR 16, into
+#which the handshake extends the code hash, still holds the value it had after the
+#handshake; a changed PCR (different code, another extend or reset, a reboot) or an
+#expired key makes the next request attest again. Concurrent requests share one
+#handshake. PCR 16 is read through sudo like the handshake, since tpm2_pcrread needs the
+#same access to the TPM; the agent refuses to start when it cannot read it, as no cached
+#key could ever be checked. The socket is only accessible to the agent's user and
+#connections from other users are refused.
+#
+#Protocol: one request line per connection, GET, STATUS or FLUSH; the answer is one JSON
+#line, e.g. {"key": "<base64>", "cached": true, "expires_in": 812.4} or {"error": "..."}. When
+#the handshake also released a data envelope, "content_key" holds the key that opens it.
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOCKET_PATH = os.environ.get('KEY_AGENT_SOCKET', os.path.join(HERE, 'key_agent.sock'))
+HANDSHAKE = ['sudo', os.path.join(HERE, 'DeviceNode.sh'), '-t', 'rsa_ak.pub']
+PCR_COMMAND = ['sudo', 'tpm2_pcrread', 'sha256:16']
+TTL_SECONDS = 900
+
+
+# FIFO in a private tmpfs directory for DeviceNode.sh -k. It is opened read-write and
+# non-blocking, so the handshake's write never waits for a reader and the keys sit in
+# the pipe buffer until read_keys; they never reach the disk.
+@contextmanager
+def key_pipe():
+    directory = tempfile.mkdtemp(prefix='key_agent_', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+    path = os.path.join(directory, 'keys')
+    try:
+        os.mkfifo(path, 0o600)
+        fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+        try:
+            yield path, fd
+        finally:
+            os.close(fd)
+    finally:
+        shutil.rmtree(directory)
+
+
+# (key, content key or None) from the `name: base64` lines DeviceNode.sh -k wrote to fd
+def read_keys(fd):
+    data = b''
+    while True:
+        try:
+            block = os.read(fd, 65536)
+        except BlockingIOError:
+            break
+        if not block:
+            break
+        data += block
+    fields = {}
+    for line in data.decode('ascii', 'replace').splitlines():
+        name, _, value = line.partition(':')
+        fields[name.strip()] = base64.b64decode(value.strip())
+    if 'service_content' not in fields:
+        raise RuntimeError('the handshake released no key')
+    return fields['service_content'], fields.get('content_key')
+
+
+# Run the handshake here, without an agent; returns (key, content key or None)
+def handshake_keys(handshake=HANDSHAKE, workdir=HERE):
+    with key_pipe() as (path, fd):
+        status = subprocess.run(handshake + ['-k', path], cwd=workdir).returncode
+        if status != 0:
+            raise RuntimeError(f'attestation failed with exit status {status}')
+        return read_keys(fd)
+
+
+# Exit status and output of command; the output is only captured when capture is set
+async def run(command, cwd=HERE, capture=True):
+    process = await asyncio.create_subprocess_exec(*command, cwd=cwd,
+                                                   stdout=asyncio.subprocess.PIPE if capture else None)
+    stdout, _ = await process.communicate()
+    return process.returncode, stdout
+
+
+class KeyAgent:
+    def __init__(self, ttl=TTL_SECONDS, handshake=HANDSHAKE, pcr_command=PCR_COMMAND, workdir=HERE):
+        self.ttl = ttl
+        self.handshake = handshake
+        self.pcr_command = pcr_command
+        self.workdir = workdir
+        self.key = None
+        self.content_key = None
+        self.released = 0.0
+        self.pcr_state = None
+        self.lock = asyncio.Lock()
+        self.handshakes = 0
+
+    # tpm2_pcrread output for PCR 16, or None when it cannot be read
+    async def read_pcr(self):
+        try:
+            status, output = await run(self.pcr_command, self.workdir)
+        except OSError:
+            return None
+        return output if status == 0 else None
+
+    def forget(self):
+        for key in (self.key, self.content_key):
+            if key is not None:
+                key[:] = bytes(len(key))  # Overwrite the copy we hold
+        self.key = None
+        self.content_key = None
+        self.pcr_state = None
+
+    # Reason the cached key cannot be used, or None when it can
+    async def invalid_reason(self):
+        if self.key is None:
+            return 'no key'
+        if time.monotonic() - self.released > self.ttl:
+            return 'expired'
+        current = await self.read_pcr()
+        if current is None:
+            return 'PCR 16 unreadable'
+        if current != self.pcr_state:
+            return 'PCR 16 changed'
+        return None
+
+    async def attest(self):
+        with key_pipe() as (path, fd):
+            status, _ = await run(self.handshake + ['-k', path], self.workdir, capture=False)
+            if status != 0:
+                raise RuntimeError(f'attestation failed with exit status {status}')
+            key, content_key = read_keys(fd)
+        self.forget()
+        self.key = bytearray(key)
+        self.content_key = bytearray(content_key) if content_key is not None else None
+        self.released = time.monotonic()
+        self.pcr_state = await self.read_pcr()
+        self.handshakes += 1
+
+    # The key, attesting first when the cached one cannot be used; returns (key, cached)
+    async def get_key(self):
+        async with self.lock:
+            reason = await self.invalid_reason()
+            if reason is None:
+                return bytes(self.key), True
+            print(f'Attesting ({reason})', file=sys.stderr, flush=True)
+            await self.attest()
+            return bytes(self.key), False
+
+    def status(self):
+        age = time.monotonic() - self.released if self.key is not None else None
+        return {'cached': self.key is not None, 'age': age, 'ttl': self.ttl, 'handshakes': self.handshakes}
+
+    async def handle(self, request):
+        if request == 'GET':
+            try:
+                key, cached = await self.get_key()
+            except RuntimeError as error:
+                return {'error': str(error)}
+            response = {'key': base64.b64encode(key).decode('ascii'), 'cached': cached,
+                        'expires_in': round(self.ttl - (time.monotonic() - self.released), 1)}
+            if self.content_key is not None:
+                response['content_key'] = base64.b64encode(self.content_key).decode('ascii')
+            return response
+        if request == 'STATUS':
+            return self.status()
+        if request == 'FLUSH':
+            self.forget()
+            return {'flushed': True}
+        return {'error': f'unknown request {request!r}'}
+
+
+# uid of the process at the other end of a unix socket
+def peer_uid(sock):
+    credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', credentials)[1]
+
+
+async def serve_client(agent, reader, writer):
+    try:
+        if peer_uid(writer.get_extra_info('socket')) not in (os.getuid(), 0):
+            response = {'error': 'permission denied'}
+        else:
+            request = (await reader.readline()).decode('ascii', 'replace').strip().upper()
+            response = await agent.handle(request)
+        writer.write(json.dumps(response).encode('utf-8') + b'\n')
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(agent, socket_path=SOCKET_PATH):
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    old_umask = os.umask(0o177)  # The socket is created rw for the owner only
+    try:
+        server = await asyncio.start_unix_server(lambda reader, writer: serve_client(agent, reader, writer),
+                                                 socket_path)
+    finally:
+        os.umask(old_umask)
+    print(f'Key agent listening on {socket_path}, keys kept for {agent.ttl}s', file=sys.stderr, flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        agent.forget()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+# Client side: send one request to the agent and return its answer
+def request(command, socket_path=SOCKET_PATH, timeout=600):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)  # The first GET waits for a whole handshake
+        sock.connect(socket_path)
+        sock.sendall(command.encode('ascii') + b'\n')
+        data = b''
+        while not data.endswith(b'\n'):
+            block = sock.recv(4096)
+            if not block:
+                break
+            data += block
+    return json.loads(data)
+
+
+# (key, content key or None) from the agent; raises OSError when no agent answers and
+# RuntimeError when it could not attest
+def fetch_keys(socket_path=SOCKET_PATH):
+    response = request('GET', socket_path)
+    if 'error' in response:
+        raise RuntimeError(response['error'])
+    content_key = response.get('content_key')
+    return base64.b64decode(response['key']), base64.b64decode(content_key) if content_key else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Attest once and serve the released key over a unix socket.')
+    parser.add_argument('--socket', default=SOCKET_PATH)
+    parser.add_argument('--ttl', type=float, default=TTL_SECONDS, help='seconds a released key is handed out')
+    parser.add_argument('--prefetch', action='store_true', help='attest at startup instead of on the first request')
+    parser.add_argument('--status', action='store_true', help='print the status of a running agent')
+    parser.add_argument('--flush', action='store_true', help='make a running agent forget its key')
+    args = parser.parse_args()
+
+    if args.status or args.flush:
+        print(json.dumps(request('STATUS' if args.status else 'FLUSH', args.socket)))
+        sys.exit()
+
+    async def main():
+        agent = KeyAgent(args.ttl)
+        if await agent.read_pcr() is None:
+            sys.exit(f'Cannot read PCR 16 with {" ".join(agent.pcr_command)}; cached keys could not be checked')
+        if args.prefetch:
+            await agent.get_key()
+        await serve(agent, args.socket)
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
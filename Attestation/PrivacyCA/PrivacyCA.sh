@@ -1,8 +1,8 @@
 #!/bin/bash
 
-# Fixed location
+# Fixed location; SERVICE_PROVIDER_LOCATION overrides the address, e.g. for bench_attestation.py on localhost
 #service_provider_location="$PWD/../SP"
-service_provider_location="20.85.126.165:8080/cgi-bin/server.py"
+service_provider_location="${SERVICE_PROVIDER_LOCATION:-20.85.126.165:8080/cgi-bin/server.py}"
 
 # Location for node 1, node 2, etc.
 device_location=""
@@ -11,20 +11,29 @@ registration_token=""
 # State
 event_file_found=0
 
+# Wait up to $1 seconds for file $2. The uploads are renamed into place when complete, so
+# inotifywait wakes up as soon as the file arrives (moved_to, or close_write for files
+# written in place). Without inotify-tools the directory is polled every poll_interval.
+poll_interval=0.1
 wait_loop() {
-    counter=1
-    until [ $counter -gt $1 ]
+    local deadline=$((SECONDS + $1))
+    local started=$EPOCHREALTIME
+    until test -f $2
     do
-       test -f $2
-       if [ $? == 0 ];then
-          event_file_found=1
-          break
+       if [ $SECONDS -ge $deadline ];then
+          trace wait $2 $started
+          return
+       fi
+       echo -ne "Waiting $1 seconds: $(($1 - deadline + SECONDS))"'\r'
+       if command -v inotifywait > /dev/null;then
+          # The timeout covers a file arriving between the test and the watch being set up
+          inotifywait -qq -t 1 -e moved_to -e close_write "$(dirname $2)" 2> /dev/null
        else
-          echo -ne "Waiting $1 seconds: $counter"'\r'
+          sleep $poll_interval
        fi
-       ((counter++))
-       sleep 1
     done
+    trace wait $2 $started
+    event_file_found=1
 }
 
 LOG_ERROR() {
@@ -37,11 +46,43 @@ LOG_INFO() {
     echo -e "\033[93mPASS: \e[97m${messagestring}\e[0m"
 }
 
+# With ATTEST_TRACE=FILE every wait, upload and tool call appends "<kind> <name> <start> <end>"
+# (epoch seconds) to FILE, for bench_attestation.py
+trace() {
+    if [ -n "$ATTEST_TRACE" ];then
+        echo "$1 $2 $3 $EPOCHREALTIME" >> "$ATTEST_TRACE"
+    fi
+}
+
+if [ -n "$ATTEST_TRACE" ];then
+    for traced_command in tpm2_makecredential fdupes; do
+        eval "$traced_command() {
+            local started=\$EPOCHREALTIME
+            command $traced_command \"\$@\"
+            local status=\$?
+            trace tool $traced_command \$started
+            return \$status
+        }"
+    done
+fi
+
 remote_cp() {
+    local started=$EPOCHREALTIME
     dest_name=${2##*/}
 	remote_host=${2%/${dest_name}}
 	
-	curl -X POST -F "file=@${1}" -F "destname=${dest_name}" ${remote_host}     
+	checksum=$(sha256sum ${1} | cut -d' ' -f1)
+	
+	# The receiver stores the file only when the checksum matches; a rejected upload
+	# (checksum mismatch, too large) fails here with the service's reason and the caller stops
+	# instead of leaving the other side waiting
+	response=$(curl -sS --fail-with-body -X POST -F "file=@${1}" -F "destname=${dest_name}" -F "sha256=${checksum}" ${remote_host})
+	local curl_status=$?
+	trace upload ${dest_name} $started
+	if [ $curl_status != 0 ] || [ "${response}" != "Success" ];then
+	    LOG_ERROR "Upload of ${1} to ${2} failed. ${response}"
+	    return 1
+	fi
 }
 
 process_device_registration_request_from_service_provider() {
@@ -69,7 +110,7 @@ credential_challenge() {
         --credential-blob cred.out \
         -Q
     
-    remote_cp cred.out $device_location/.
+    remote_cp cred.out $device_location/. || return 1
 
     credential_status_string="Activated credential receipt from device."
     max_wait=60
@@ -97,7 +138,7 @@ credential_challenge() {
 process_device_registration_processing_with_device() {
 
     touch p_d_pca_ready.txt
-    remote_cp p_d_pca_ready.txt $device_location/.
+    remote_cp p_d_pca_ready.txt $device_location/. || return 1
     rm -f p_d_pca_ready.txt
 
     process_registration_status_string="Device-ready acknowledgement receipt from device."
@@ -145,7 +186,7 @@ request_device_registration() {
         LOG_INFO "$registration_request_status_string"
         echo "registration_token: $registration_token" > \
         p_d_registration_token.txt
-        remote_cp p_d_registration_token.txt $device_location/.
+        remote_cp p_d_registration_token.txt $device_location/. || return 1
         rm -f p_d_registration_token.txt
     fi
 
@@ -164,7 +205,7 @@ request_device_service() {
     awk '{print $2}'`
     rm -f s_p_service.txt
 
-    remote_cp s_p_service_aik.pub $device_location/rsa_ak.pub
+    remote_cp s_p_service_aik.pub $device_location/rsa_ak.pub || return 1
     rm -f s_p_service_aik.pub
     process_device_registration_processing_with_device
     if [ $? == 1 ];then
@@ -183,7 +224,7 @@ request_device_service() {
     fi
 
     echo "service-token: $service_token" > p_d_service_token.txt
-    remote_cp p_d_service_token.txt $device_location/.
+    remote_cp p_d_service_token.txt $device_location/. || return 1
     rm -f p_d_service_token.txt
 
     return 0
@@ -1,8 +1,8 @@
 #!/bin/bash
 
-# Fixed location
+# Fixed location; PCA_LOCATION overrides the address, e.g. for bench_attestation.py on localhost
 #pca_location="$PWD/../PCA"
-pca_location="20.85.126.165:8080/cgi-bin/pca.py"
+pca_location="${PCA_LOCATION:-20.85.126.165:8080/cgi-bin/pca.py}"
 
 # Device Location not fixed
 device_location=""
@@ -19,21 +19,35 @@ GOLDEN_PCR="7914e70341bf6492284f991a2415ad88339acd27c7689c7bc5b1f6cca0726cc0"
 # Service Data
 #SERVICE_CONTENT="Hello world!"
 SERVICE_CONTENT='functionremainsunchangedasitwillcorrectly'
+# Optional file of any size (e.g. the dataset) released in the same round as SERVICE_CONTENT
+SERVICE_DATA_FILE=""
 
+# Envelope encryption of the service content (RSA-wrapped AES key, AES-GCM content)
+envelope="python3 $(dirname "$0")/../envelope.py"
+
+# Wait up to $1 seconds for file $2. The uploads are renamed into place when complete, so
+# inotifywait wakes up as soon as the file arrives (moved_to, or close_write for files
+# written in place). Without inotify-tools the directory is polled every poll_interval.
+poll_interval=0.1
 wait_loop() {
-    counter=1
-    until [ $counter -gt $1 ]
+    local deadline=$((SECONDS + $1))
+    local started=$EPOCHREALTIME
+    until test -f $2
     do
-       test -f $2
-       if [ $? == 0 ];then
-          event_file_found=1
-          break
+       if [ $SECONDS -ge $deadline ];then
+          trace wait $2 $started
+          return
+       fi
+       echo -ne "Waiting $1 seconds: $(($1 - deadline + SECONDS))"'\r'
+       if command -v inotifywait > /dev/null;then
+          # The timeout covers a file arriving between the test and the watch being set up
+          inotifywait -qq -t 1 -e moved_to -e close_write "$(dirname $2)" 2> /dev/null
        else
-          echo -ne "Waiting $1 seconds: $counter"'\r'
+          sleep $poll_interval
        fi
-       ((counter++))
-       sleep 1
     done
+    trace wait $2 $started
+    event_file_found=1
 }
 
 LOG_ERROR() {
@@ -46,13 +60,45 @@ LOG_INFO() {
     echo -e "\033[93mPASS: \e[97m${messagestring}\e[0m"
 }
 
+# With ATTEST_TRACE=FILE every wait, upload and tool call appends "<kind> <name> <start> <end>"
+# (epoch seconds) to FILE, for bench_attestation.py
+trace() {
+    if [ -n "$ATTEST_TRACE" ];then
+        echo "$1 $2 $3 $EPOCHREALTIME" >> "$ATTEST_TRACE"
+    fi
+}
+
+if [ -n "$ATTEST_TRACE" ];then
+    for traced_command in tpm2_checkquote tpm2_print openssl python3; do
+        eval "$traced_command() {
+            local started=\$EPOCHREALTIME
+            command $traced_command \"\$@\"
+            local status=\$?
+            trace tool $traced_command \$started
+            return \$status
+        }"
+    done
+fi
+
 remote_cp() {
+    local started=$EPOCHREALTIME
     dest_name=${2##*/}
 	remote_host=${2%/${dest_name}}
 	#echo $dest_name
 	#echo $remote_host
 	
-	curl -X POST -F "file=@${1}" -F "destname=${dest_name}" ${remote_host}     
+	checksum=$(sha256sum ${1} | cut -d' ' -f1)
+	
+	# The receiver stores the file only when the checksum matches; a rejected upload
+	# (checksum mismatch, too large) fails here with the service's reason and the caller stops
+	# instead of leaving the other side waiting
+	response=$(curl -sS --fail-with-body -X POST -F "file=@${1}" -F "destname=${dest_name}" -F "sha256=${checksum}" ${remote_host})
+	local curl_status=$?
+	trace upload ${dest_name} $started
+	if [ $curl_status != 0 ] || [ "${response}" != "Success" ];then
+	    LOG_ERROR "Upload of ${1} to ${2} failed. ${response}"
+	    return 1
+	fi
 }
 
 device_registration() {
@@ -70,12 +116,12 @@ device_registration() {
     "
 
     echo "$data_to_privacy_ca" > s_p_registration.txt
-    remote_cp s_p_registration.txt $pca_location/.
+    remote_cp s_p_registration.txt $pca_location/. || return 1
     rm -f s_p_registration.txt
 
     # Send privacy-CA information to device
     echo "privacy_ca_location: $pca_location" > s_d_registration.txt
-    remote_cp s_d_registration.txt $device_location/.
+    remote_cp s_d_registration.txt $device_location/. || return 1
     rm -f s_d_registration.txt
 
     # Wait for device_registration_token from device
@@ -115,12 +161,12 @@ device_node_identity_challenge() {
     "
 
     echo "$data_to_privacy_ca" > s_p_service.txt
-    remote_cp s_p_service.txt $pca_location/.
+    remote_cp s_p_service.txt $pca_location/. || return 1
     rm -f s_p_service.txt
 
     # Send privacy-CA information to device
     echo "privacy_ca_location: $pca_location" > s_d_service.txt
-    remote_cp s_d_service.txt $device_location/.
+    remote_cp s_d_service.txt $device_location/. || return 1
     rm -f s_d_service.txt
 
    identity_challenge_status_string="Aborting service request - AIK not found."
@@ -129,7 +175,7 @@ device_node_identity_challenge() {
       LOG_ERROR "$identity_challenge_status_string"
       return 1
    else
-      remote_cp d_s_service_aik.pub $pca_location/s_p_service_aik.pub
+      remote_cp d_s_service_aik.pub $pca_location/s_p_service_aik.pub || return 1
    fi
 
    identity_challenge_status_string="Service-Token receipt from device."
@@ -160,7 +206,7 @@ system_software_state_validation() {
    echo "pcr-selection: $GOLDEN_PCR_SELECTION" > s_d_pcrlist.txt
    NONCE=`dd if=/dev/urandom bs=1 count=32 status=none | xxd -p -c32`
    echo "nonce: $NONCE" >> s_d_pcrlist.txt
-   remote_cp s_d_pcrlist.txt $device_location/.
+   remote_cp s_d_pcrlist.txt $device_location/. || return 1
    rm -f s_d_pcrlist.txt
 
    software_status_string="Attestation data receipt from device"
@@ -241,7 +287,10 @@ device_service_content_key_validation() {
       -inkey d_s_service_aik.pub \
       -keyform pem \
       -pkeyopt digest:sha256
-   if [ $? == 1 ];then
+   retval=$?
+   # A signature left behind would be taken for the next request's before the device sends it
+   rm -f d_s_service_content_key_pub.sig service_content_key.pub.digest
+   if [ $retval == 1 ];then
       return 1
    fi
 
@@ -280,16 +329,28 @@ request_device_service() {
    fi
    LOG_INFO "$request_device_service_status_string"
 
-   # Encrypt service data content and deliver
+   # Encrypt service data content and deliver: a new AES key wrapped with the device's
+   # content key, and the content (and data file) encrypted with it
    echo "$SERVICE_CONTENT" > service-content.plain
-    openssl rsautl -encrypt -inkey d_s_service_content_key.pub -pubin \
-    -in service-content.plain -out s_d_service_content.encrypted
-
-    remote_cp s_d_service_content.encrypted $device_location/.
+    $envelope seal --public-key d_s_service_content_key.pub \
+    --wrapped-key-out s_d_service_content.key --key-out service-content.aeskey \
+    service-content.plain s_d_service_content.encrypted
+
+    # The data file goes first; the device is done once the content has arrived
+    if [ -n "$SERVICE_DATA_FILE" ];then
+        $envelope seal --key-file service-content.aeskey \
+        "$SERVICE_DATA_FILE" s_d_service_data.encrypted
+        remote_cp s_d_service_data.encrypted $device_location/. || return 1
+        rm -f s_d_service_data.encrypted
+    fi
+    remote_cp s_d_service_content.key $device_location/. || return 1
+    remote_cp s_d_service_content.encrypted $device_location/. || return 1
     rm -f d_s_service_aik.pub
     rm -f d_s_service_content_key.pub
+    rm -f s_d_service_content.key
     rm -f s_d_service_content.encrypted
     rm -f service-content.plain
+    rm -f service-content.aeskey
     LOG_INFO "Sending service-content: \e[5m$SERVICE_CONTENT"
 
    return 0
@@ -0,0 +1,523 @@
+#Attestation handshakes for many devices at once, in one Python process.
+#
+#    python3 attest_orchestrator.py --devices 8 --service-requests 3
+#
+#The bash scripts coordinate through fixed file names (d_s_registration.txt,
+#s_d_pcrlist.txt, ...) in one directory per role, so only one device can be in a handshake
+#at a time. Here the Device-Node, Privacy-CA and Service-Provider sides of a registration
+#or service request run as coroutines of a session. Every session has its own ID, a
+#directory sessions/ID/{device,pca,sp} for its files and a mailbox per role through which
+#the messages of the bash flow (under the same names) are passed. The TPM work is the same
+#tpm2-tools calls as in the scripts; each device talks to its own TPM through
+#TPM2TOOLS_TCTI, by default a swtpm simulator started per device, so any number of
+#handshakes run concurrently on one Linux box. Long-lived state is kept per device (EK and
+#AK contexts in devices/NAME) and by the Privacy-CA (the registered EK pool). The run ends
+#with the latency of every session and the handshakes per second.
+
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from envelope import iter_open_stream, new_key, seal_stream, wrap_key
+from quote_verifier import QuoteError, QuoteQueue, QuoteVerifier
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROLES = ('device', 'pca', 'sp')
+WAIT_SECONDS = 60
+TPM2_RH_ENDORSEMENT = '0x4000000B'
+# Golden reference of ServiceProvider.sh: PCR 16 after the code hash of code.txt is extended
+GOLDEN_PCR_SELECTION = 'sha1:16+sha256:16'
+GOLDEN_PCR = '7914e70341bf6492284f991a2415ad88339acd27c7689c7bc5b1f6cca0726cc0'
+CODE_FILE = os.path.join(HERE, 'DeviceNode', 'code.txt')
+SWTPM_PORT = 2321
+REPORT_FILE = 'attestation_report.json'
+
+
+class AttestationError(Exception):
+    pass
+
+
+# Run a tool and return its stdout; raises AttestationError when it fails
+async def tool(*args, env=None):
+    process = await asyncio.create_subprocess_exec(*args, env=env, stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.PIPE)
+    try:
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()  # Another side of the session failed
+        raise
+    if process.returncode != 0:
+        raise AttestationError(f"{args[0]} failed: {stderr.decode('utf-8', 'replace').strip()}")
+    return stdout
+
+
+def random_token():
+    return os.urandom(32).hex()
+
+
+def read_file(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def write_file(path, data):
+    with open(path, 'wb') as file:
+        file.write(data)
+
+
+# Value of `key: value` in a message such as s_d_pcrlist.txt
+def message_field(data, key):
+    for line in data.decode('utf-8').splitlines():
+        name, _, value = line.strip().partition(':')
+        if name == key:
+            return value.strip()
+    raise AttestationError(f'{key} missing from message')
+
+
+# Messages addressed to one role of a session, by name; get() waits for a message
+class Mailbox:
+    def __init__(self):
+        self.messages = {}
+        self.arrived = asyncio.Condition()
+
+    async def put(self, name, data):
+        async with self.arrived:
+            self.messages[name] = data
+            self.arrived.notify_all()
+
+    async def get(self, name, timeout=WAIT_SECONDS):
+        async with self.arrived:
+            await asyncio.wait_for(self.arrived.wait_for(lambda: name in self.messages), timeout)
+            return self.messages.pop(name)
+
+
+class Session:
+    def __init__(self, kind, device_name, root):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.device_name = device_name
+        self.dir = os.path.join(root, 'sessions', self.id)
+        for role in ROLES:
+            os.makedirs(os.path.join(self.dir, role))
+        self.mailboxes = {role: Mailbox() for role in ROLES}
+        self.steps = {}
+
+    def path(self, role, name):
+        return os.path.join(self.dir, role, name)
+
+    async def send(self, role, name, data):
+        await self.mailboxes[role].put(name, data)
+
+    async def receive(self, role, name, timeout=WAIT_SECONDS):
+        try:
+            return await self.mailboxes[role].get(name, timeout)
+        except asyncio.TimeoutError:
+            raise AttestationError(f'{role}: {name} not received within {timeout}s')
+
+    # Receive a message into the role's directory, for the tools that read files
+    async def receive_file(self, role, name):
+        path = self.path(role, name)
+        write_file(path, await self.receive(role, name))
+        return path
+
+    @asynccontextmanager
+    async def step(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps[name] = round(time.perf_counter() - started, 4)
+
+
+class Device:
+    def __init__(self, name, root, tcti, code_file=CODE_FILE):
+        self.name = name
+        self.dir = os.path.join(root, 'devices', name)
+        os.makedirs(self.dir, exist_ok=True)
+        self.env = dict(os.environ, TPM2TOOLS_TCTI=tcti)
+        self.code_file = code_file
+        self.lock = asyncio.Lock()  # One handshake at a time per device: its TPM and key files
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    async def tpm(self, *args):
+        return await tool(*args, env=self.env)
+
+    # Without a resource manager transient objects stay loaded after each tool
+    async def flush(self):
+        await self.tpm('tpm2_flushcontext', '--transient-object')
+
+    # EK and AK as in device_registration
+    async def create_identity(self):
+        await self.tpm('tpm2_createek', '--ek-context', self.path('rsa_ek.ctx'), '--key-algorithm', 'rsa',
+                       '--public', self.path('rsa_ek.pub'), '-Q')
+        await self.tpm('tpm2_createak', '--ek-context', self.path('rsa_ek.ctx'), '--ak-context', self.path('rsa_ak.ctx'),
+                       '--key-algorithm', 'rsa', '--hash-algorithm', 'sha256', '--signing-algorithm', 'rsassa',
+                       '--public', self.path('rsa_ak.pub'), '--private', self.path('rsa_ak.priv'),
+                       '--ak-name', self.path('rsa_ak.name'), '-Q')
+        await self.tpm('tpm2_readpublic', '-c', self.path('rsa_ak.ctx'), '-f', 'pem', '-o', self.path('rsa_ak.pub'), '-Q')
+        await self.flush()
+
+    # Hand EK and AK name to the Privacy-CA and answer its credential challenge
+    # (await_and_compelete_credential_challenge)
+    async def credential_challenge(self, session):
+        await session.receive('device', 'p_d_pca_ready.txt')
+        await session.send('pca', 'rsa_ek.pub', read_file(self.path('rsa_ek.pub')))
+        await session.send('pca', 'rsa_ak.name', read_file(self.path('rsa_ak.name')))
+        await session.send('pca', 'd_p_device_ready.txt', b'')
+        credential = await session.receive_file('device', 'cred.out')
+        policy = session.path('device', 'session.ctx')
+        certinfo = session.path('device', 'actcred.out')
+        await self.tpm('tpm2_startauthsession', '--policy-session', '--session', policy, '-Q')
+        try:
+            await self.tpm('tpm2_policysecret', '-S', policy, '-c', TPM2_RH_ENDORSEMENT, '-Q')
+            await self.tpm('tpm2_activatecredential', '--credentialedkey-context', self.path('rsa_ak.ctx'),
+                           '--credentialkey-context', self.path('rsa_ek.ctx'), '--credential-blob', credential,
+                           '--certinfo-data', certinfo, '--credentialkey-auth', f'session:{policy}', '-Q')
+        finally:
+            await self.tpm('tpm2_flushcontext', policy, '-Q')
+            await self.flush()
+        await session.send('pca', 'actcred.out', read_file(certinfo))
+
+    async def registration(self, session):
+        await session.send('sp', 'd_s_registration.txt', f'device_location: {session.id}\n'.encode())
+        await session.receive('device', 's_d_registration.txt')
+        async with session.step('device.create_identity'):
+            await self.create_identity()
+        async with session.step('device.credential_challenge'):
+            await self.credential_challenge(session)
+        token = await session.receive('device', 'p_d_registration_token.txt')
+        await session.send('sp', 'd_s_registration_token.txt', token)
+
+    # Quote of PCR 16 after extending the code hash (process_device_software_state_validation_request)
+    async def quote(self, session):
+        pcrlist = await session.receive('device', 's_d_pcrlist.txt')
+        code = read_file(self.code_file)
+        await self.tpm('tpm2_pcrreset', '16')
+        await self.tpm('tpm2_pcrextend', f'16:sha1={hashlib.sha1(code).hexdigest()},sha256={hashlib.sha256(code).hexdigest()}')
+        names = ['attestation_quote.dat', 'attestation_quote.signature', 'pcr.bin']
+        await self.tpm('tpm2_quote', '--key-context', self.path('rsa_ak.ctx'),
+                       '--message', session.path('device', names[0]), '--signature', session.path('device', names[1]),
+                       '--qualification', message_field(pcrlist, 'nonce'),
+                       '--pcr-list', message_field(pcrlist, 'pcr-selection'), '--pcr', session.path('device', names[2]), '-Q')
+        await self.flush()
+        for name in names:
+            await session.send('sp', name, read_file(session.path('device', name)))
+
+    # Certified content key (process_generate_service_content_key)
+    async def content_key(self, session):
+        public = session.path('device', 'd_s_service_content_key.pub')
+        signature = session.path('device', 'd_s_service_content_key_pub.sig')
+        await self.tpm('tpm2_create', '-C', 'n', '-c', self.path('service_content_key.ctx'),
+                       '-u', self.path('service_content_key.pub'), '-r', self.path('service_content_key.priv'), '-Q')
+        await self.tpm('tpm2_readpublic', '-c', self.path('service_content_key.ctx'), '-f', 'pem', '-o', public, '-Q')
+        await self.tpm('tpm2_sign', '-c', self.path('rsa_ak.ctx'), '-g', 'sha256', '-s', 'rsassa', '-f', 'plain',
+                       '-o', signature, public)
+        await self.flush()
+        await session.send('sp', 'd_s_service_content_key.pub', read_file(public))
+        await session.send('sp', 'd_s_service_content_key_pub.sig', read_file(signature))
+
+    # Unwrap the envelope key in the TPM and open the content (process_encrypted_service_data_content).
+    # The unwrapped key is read from tpm2_rsadecrypt's stdout and never written to the session
+    # directory, which is kept when the session fails.
+    async def open_content(self, session):
+        wrapped = await session.receive_file('device', 's_d_service_content.key')
+        encrypted = await session.receive('device', 's_d_service_content.encrypted')
+        key = await self.tpm('tpm2_rsadecrypt', '-c', self.path('service_content_key.ctx'), wrapped)
+        await self.flush()
+        try:
+            return b''.join(iter_open_stream(io.BytesIO(encrypted), key))
+        except ValueError as error:
+            raise AttestationError(f'service content: {error}')
+
+    async def service(self, session):
+        await session.send('sp', 'd_s_service.txt', f'device_location: {session.id}\n'.encode())
+        await session.send('sp', 'd_s_service_aik.pub', read_file(self.path('rsa_ak.pub')))
+        await session.receive('device', 's_d_service.txt')
+        if await session.receive('device', 'rsa_ak.pub') != read_file(self.path('rsa_ak.pub')):
+            raise AttestationError('AIK received from service provider is not on the device')
+        async with session.step('device.credential_challenge'):
+            await self.credential_challenge(session)
+        token = await session.receive('device', 'p_d_service_token.txt')
+        await session.send('sp', 'd_s_service_token.txt', token)
+        async with session.step('device.quote'):
+            await self.quote(session)
+        async with session.step('device.content_key'):
+            await self.content_key(session)
+        async with session.step('device.open_content'):
+            return await self.open_content(session)
+
+
+class PrivacyCA:
+    def __init__(self, root):
+        self.pool_dir = os.path.join(root, 'pca', 'Registered_EK_Pool')
+        os.makedirs(self.pool_dir, exist_ok=True)
+        self.registered = {read_file(os.path.join(self.pool_dir, name)) for name in os.listdir(self.pool_dir)}
+
+    # Make the device prove that the AK lives in the TPM of the EK (credential_challenge);
+    # returns the EK
+    async def credential_challenge(self, session):
+        await session.send('device', 'p_d_pca_ready.txt', b'')
+        await session.receive('pca', 'd_p_device_ready.txt')
+        ek = await session.receive_file('pca', 'rsa_ek.pub')
+        name = await session.receive('pca', 'rsa_ak.name')
+        secret = random_token().encode()
+        secret_path = session.path('pca', 'file_input.data')
+        write_file(secret_path, secret)
+        credential = session.path('pca', 'cred.out')
+        await tool('tpm2_makecredential', '--tcti', 'none', '--encryption-key', ek, '--secret', secret_path,
+                   '--name', name.hex(), '--credential-blob', credential, '-Q')
+        await session.send('device', 'cred.out', read_file(credential))
+        if await session.receive('pca', 'actcred.out') != secret:
+            raise AttestationError('credential activation challenge failed')
+        return read_file(ek)
+
+    async def registration(self, session):
+        token = message_field(await session.receive('pca', 's_p_registration.txt'), 'registration_token')
+        ek = await self.credential_challenge(session)
+        write_file(os.path.join(self.pool_dir, token), ek)
+        self.registered.add(ek)
+        await session.send('device', 'p_d_registration_token.txt', f'registration_token: {token}\n'.encode())
+
+    async def service(self, session):
+        token = message_field(await session.receive('pca', 's_p_service.txt'), 'service_token')
+        await session.send('device', 'rsa_ak.pub', await session.receive('pca', 's_p_service_aik.pub'))
+        ek = await self.credential_challenge(session)
+        if ek not in self.registered:
+            raise AttestationError('EK from device does not belong to the registered EK pool')
+        await session.send('device', 'p_d_service_token.txt', f'service-token: {token}\n'.encode())
+
+
+class ServiceProvider:
+    # Quotes and the content key certification are checked in-process unless
+    # verify_with_tools, which spawns tpm2_checkquote, tpm2_print and openssl as the script does
+    def __init__(self, content, golden_pcr=GOLDEN_PCR, pcr_selection=GOLDEN_PCR_SELECTION, verify_with_tools=False):
+        self.content = content
+        self.golden_pcr = golden_pcr
+        self.pcr_selection = pcr_selection
+        self.verify_with_tools = verify_with_tools
+        self.verifier = QuoteVerifier({pcr_selection: golden_pcr})
+        self.quotes = QuoteQueue(self.verifier)
+
+    async def registration(self, session):
+        await session.receive('sp', 'd_s_registration.txt')
+        token = random_token()
+        await session.send('pca', 's_p_registration.txt', f'registration_token: {token}\n'.encode())
+        await session.send('device', 's_d_registration.txt', f'privacy_ca_location: {session.id}\n'.encode())
+        received = await session.receive('sp', 'd_s_registration_token.txt')
+        if message_field(received, 'registration_token') != token:
+            raise AttestationError('registration token validation failed')
+
+    # Check the quote signature and the PCR digest against the golden reference
+    # (system_software_state_validation)
+    async def validate_software_state(self, session, aik):
+        nonce = random_token()
+        await session.send('device', 's_d_pcrlist.txt',
+                           f'pcr-selection: {self.pcr_selection}\nnonce: {nonce}\n'.encode())
+        quote = await session.receive_file('sp', 'attestation_quote.dat')
+        signature = await session.receive_file('sp', 'attestation_quote.signature')
+        pcr = await session.receive_file('sp', 'pcr.bin')
+        if not self.verify_with_tools:
+            try:
+                await self.quotes.verify(read_file(aik), nonce, read_file(quote), read_file(signature),
+                                         self.pcr_selection)
+            except QuoteError as error:
+                raise AttestationError(str(error))
+            return
+        await tool('tpm2_checkquote', '--public', aik, '--qualification', nonce, '--message', quote,
+                   '--signature', signature, '--pcr', pcr, '-Q')
+        printed = (await tool('tpm2_print', '-t', 'TPMS_ATTEST', quote)).decode('utf-8')
+        digest = next((line.split()[1] for line in printed.splitlines() if 'pcrDigest' in line), None)
+        if digest != self.golden_pcr:
+            raise AttestationError(f'device PCR {digest} does not match the golden PCR {self.golden_pcr}')
+
+    # Verify the content key is certified by the AIK (device_service_content_key_validation)
+    async def validate_content_key(self, session, aik):
+        public = await session.receive_file('sp', 'd_s_service_content_key.pub')
+        signature = await session.receive_file('sp', 'd_s_service_content_key_pub.sig')
+        if not self.verify_with_tools:
+            try:
+                self.verifier.verify_signature(read_file(aik), read_file(public), read_file(signature))
+            except QuoteError as error:
+                raise AttestationError(f'content key certification: {error}')
+            return public
+        digest = session.path('sp', 'service_content_key.pub.digest')
+        write_file(digest, hashlib.sha256(read_file(public)).digest())
+        await tool('openssl', 'pkeyutl', '-verify', '-in', digest, '-sigfile', signature, '-pubin', '-inkey', aik,
+                   '-keyform', 'pem', '-pkeyopt', 'digest:sha256')
+        return public
+
+    async def service(self, session):
+        await session.receive('sp', 'd_s_service.txt')
+        aik = await session.receive_file('sp', 'd_s_service_aik.pub')
+        token = random_token()
+        await session.send('pca', 's_p_service.txt', f'service_token: {token}\n'.encode())
+        await session.send('device', 's_d_service.txt', f'privacy_ca_location: {session.id}\n'.encode())
+        await session.send('pca', 's_p_service_aik.pub', read_file(aik))
+        if message_field(await session.receive('sp', 'd_s_service_token.txt'), 'service-token') != token:
+            raise AttestationError('service token validation failed')
+        await self.validate_software_state(session, aik)
+        public = await self.validate_content_key(session, aik)
+        key = new_key()
+        sealed = io.BytesIO()
+        seal_stream(io.BytesIO(self.content), sealed, key)
+        await session.send('device', 's_d_service_content.key', wrap_key(key, public))
+        await session.send('device', 's_d_service_content.encrypted', sealed.getvalue())
+
+
+# Run the three sides of a session; the first failure cancels the others
+async def run_roles(*coroutines):
+    tasks = [asyncio.create_task(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+# One registration or service request of device; returns the session summary. Any error
+# but a cancellation marks the session failed, and its files are kept for inspection;
+# otherwise they are removed.
+async def run_session(kind, device, pca, sp, root):
+    async with device.lock:
+        session = Session(kind, device.name, root)
+        started = time.perf_counter()
+        summary = {'session': session.id, 'kind': kind, 'device': device.name, 'status': 'ok'}
+        try:
+            if kind == 'registration':
+                await run_roles(device.registration(session), pca.registration(session), sp.registration(session))
+            else:
+                content, _, _ = await run_roles(device.service(session), pca.service(session), sp.service(session))
+                if content != sp.content:
+                    raise AttestationError('device received different service content')
+        except Exception as error:  # A missing file or tool fails this session, not the run
+            message = str(error) if isinstance(error, AttestationError) else f'{type(error).__name__}: {error}'
+            summary.update(status='failed', error=message, workdir=session.dir)
+        summary['seconds'] = round(time.perf_counter() - started, 4)
+        summary['steps'] = session.steps
+        if summary['status'] == 'ok':
+            shutil.rmtree(session.dir)
+        return summary
+
+
+class SoftwareTPM:
+    def __init__(self, state_dir, port):
+        self.state_dir = state_dir
+        self.port = port
+        self.process = None
+
+    @property
+    def tcti(self):
+        return f'swtpm:host=127.0.0.1,port={self.port}'
+
+    async def start(self, timeout=10):
+        os.makedirs(self.state_dir, exist_ok=True)
+        self.process = await asyncio.create_subprocess_exec(
+            'swtpm', 'socket', '--tpm2', '--tpmstate', f'dir={self.state_dir}',
+            '--server', f'type=tcp,port={self.port}', '--ctrl', f'type=tcp,port={self.port + 1}',
+            '--flags', 'not-need-init,startup-clear', stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                _, writer = await asyncio.open_connection('127.0.0.1', self.port)
+                writer.close()
+                return
+            except OSError:
+                if self.process.returncode is not None or time.monotonic() > deadline:
+                    raise AttestationError(f'swtpm on port {self.port} did not start')
+                await asyncio.sleep(0.05)
+
+    async def stop(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.terminate()
+            await self.process.wait()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def print_report(sessions, seconds):
+    for kind in ('registration', 'service'):
+        done = [summary['seconds'] for summary in sessions if summary['kind'] == kind and summary['status'] == 'ok']
+        failed = sum(summary['kind'] == kind and summary['status'] != 'ok' for summary in sessions)
+        if done or failed:
+            timing = f"median {statistics.median(done):.3f}s  p95 {percentile(done, 0.95):.3f}s" if done else ''
+            print(f"{kind:<13} {len(done):4d} ok {failed:4d} failed  {timing}")
+    for summary in sessions:
+        if summary['status'] != 'ok':
+            print(f"  {summary['kind']} {summary['device']} {summary['session']}: {summary['error']}")
+    completed = sum(summary['status'] == 'ok' for summary in sessions)
+    print(f"{completed} handshakes in {seconds:.2f}s: {completed / seconds:.2f} handshakes/s")
+
+
+async def main(args):
+    root = os.path.abspath(args.root)
+    os.makedirs(root, exist_ok=True)
+    names = [f'device{index}' for index in range(args.devices)]
+    tpms = []
+    if args.tcti:
+        tctis = [args.tcti] * len(names)
+    else:
+        tpms = [SoftwareTPM(os.path.join(root, 'devices', name, 'tpm'), args.swtpm_port + 2 * index)
+                for index, name in enumerate(names)]
+        await asyncio.gather(*(tpm.start() for tpm in tpms))
+        tctis = [tpm.tcti for tpm in tpms]
+    devices = [Device(name, root, tcti) for name, tcti in zip(names, tctis)]
+    pca = PrivacyCA(root)
+    content = read_file(args.content_file) if args.content_file else os.urandom(args.content_size)
+    sp = ServiceProvider(content, args.golden_pcr, verify_with_tools=args.verify_with_tools)
+
+    async def device_run(device):
+        sessions = [await run_session('registration', device, pca, sp, root)]
+        if sessions[0]['status'] == 'ok':
+            for _ in range(args.service_requests):
+                sessions.append(await run_session('service', device, pca, sp, root))
+        return sessions
+
+    started = time.perf_counter()
+    try:
+        results = await asyncio.gather(*(device_run(device) for device in devices))
+    finally:
+        await asyncio.gather(*(tpm.stop() for tpm in tpms))
+    seconds = time.perf_counter() - started
+    sessions = [summary for device_sessions in results for summary in device_sessions]
+    return sessions, seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run attestation handshakes for many devices concurrently.')
+    parser.add_argument('--devices', type=int, default=4, help='devices, each with its own swtpm')
+    parser.add_argument('--service-requests', type=int, default=1, help='service requests per device after registering')
+    parser.add_argument('--root', default='attestation_run', help='directory for device, Privacy-CA and session state')
+    parser.add_argument('--tcti', default=None, help='use this TPM for all devices instead of starting swtpm, '
+                                                     'e.g. device:/dev/tpmrm0 with --devices 1')
+    parser.add_argument('--swtpm-port', type=int, default=SWTPM_PORT, help='first swtpm port; two per device')
+    parser.add_argument('--golden-pcr', default=GOLDEN_PCR)
+    parser.add_argument('--verify-with-tools', action='store_true',
+                        help='verify quotes with tpm2_checkquote and openssl instead of in-process')
+    parser.add_argument('--content-file', default=None, help='service content to release (default: random bytes)')
+    parser.add_argument('--content-size', type=int, default=64, help='size of the random service content')
+    parser.add_argument('--report', default=REPORT_FILE, help='session latencies and steps as JSON')
+    args = parser.parse_args()
+    if args.tcti and args.devices != 1:
+        parser.error('--tcti is one TPM, so it only works with --devices 1')
+
+    sessions, seconds = asyncio.run(main(args))
+    with open(args.report, 'w') as file:
+        json.dump({'seconds': round(seconds, 3), 'devices': args.devices, 'sessions': sessions}, file, indent=2)
+    print_report(sessions, seconds)
+    sys.exit(0 if all(summary['status'] == 'ok' for summary in sessions) else 1)
@@ -0,0 +1,205 @@
+#End-to-end latency of the attestation handshake on one machine, step by step.
+#
+#    python3 bench_attestation.py --iterations 20 --flow both
+#
+#The three scripts run from a temporary copy of the role directories. upload_service.py on
+#localhost stands in for the remote CGI host, and a swtpm simulator is the device's TPM
+#(--tcti uses another one). Every iteration starts ServiceProvider.sh and PrivacyCA.sh
+#fresh and runs a registration or service request of DeviceNode.sh; for service requests
+#the device registers once beforehand. Steps are timed from the scripts' PASS/FAIL lines as
+#they are printed. With ATTEST_TRACE the scripts also log every wait_loop, upload
+#(remote_cp) and tpm2_*/openssl call, so the report splits the runs into waiting, uploading
+#and tool time. Percentiles over the iterations are printed and all timings are written to
+#--report.
+
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from attest_orchestrator import percentile
+from bench_upload import free_port, wait_for_port
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = {
+    'sp': ('ServiceProvider', 'ServiceProvider.sh'),
+    'pca': ('PrivacyCA', 'PrivacyCA.sh'),
+    'device': ('DeviceNode', 'DeviceNode.sh'),
+}
+DEVICE_ARGS = {'registration': ['-r'], 'service': ['-t', 'rsa_ak.pub']}
+ANSI = re.compile(r'\x1b\[[0-9;]*m')
+STATUS_LINE = re.compile(r'(PASS|FAIL): (.*)')
+RUN_TIMEOUT = 300
+REPORT_FILE = 'attestation_bench.json'
+
+
+def start_swtpm(state_dir):
+    port = free_port()  # The control channel uses the next port
+    process = subprocess.Popen(['swtpm', 'socket', '--tpm2', '--tpmstate', f'dir={state_dir}',
+                                '--server', f'type=tcp,port={port}', '--ctrl', f'type=tcp,port={port + 1}',
+                                '--flags', 'not-need-init,startup-clear'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return process, f'swtpm:host=127.0.0.1,port={port}'
+
+
+# PASS/FAIL lines of a script as (time read, role, PASS or FAIL, message)
+def collect_lines(process, role, lines):
+    for raw in process.stdout:
+        # Colour codes and the \r-terminated countdown of wait_loop are dropped
+        text = ANSI.sub('', raw.decode('utf-8', 'replace')).split('\r')[-1].strip()
+        match = STATUS_LINE.match(text)
+        if match:
+            lines.append((time.time(), role, match.group(1), match.group(2)))
+
+
+# Entries "<kind> <name> <start> <end>" the scripts appended to their trace files
+def read_trace(path, role):
+    calls = []
+    if os.path.exists(path):
+        with open(path) as file:
+            for line in file:
+                kind, name, start, end = line.split()
+                calls.append({'role': role, 'kind': kind, 'name': name, 'seconds': float(end) - float(start)})
+    return calls
+
+
+# One registration or service request; returns its timings
+def run_flow(root, env, flow):
+    traces = {role: os.path.join(root, f'trace_{role}.log') for role in SCRIPTS}
+    for path in traces.values():
+        if os.path.exists(path):
+            os.remove(path)
+    lines = []
+    processes = {}
+    readers = []
+    started = time.time()
+    for role, (directory, script) in SCRIPTS.items():
+        args = ['bash', script] + (DEVICE_ARGS[flow] if role == 'device' else [])
+        processes[role] = subprocess.Popen(args, cwd=os.path.join(root, directory), stdout=subprocess.PIPE,
+                                           stderr=subprocess.STDOUT, env=dict(env, ATTEST_TRACE=traces[role]))
+        readers.append(threading.Thread(target=collect_lines, args=(processes[role], role, lines)))
+        readers[-1].start()
+    statuses = {}
+    for role, process in processes.items():
+        try:
+            statuses[role] = process.wait(max(1, RUN_TIMEOUT - (time.time() - started)))
+        except subprocess.TimeoutExpired:
+            process.kill()
+            statuses[role] = process.wait()
+    seconds = time.time() - started
+    for reader in readers:
+        reader.join()
+
+    # A step lasts from the previous status line of the same script (or the start) to its own
+    steps = []
+    previous = {role: started for role in SCRIPTS}
+    for when, role, status, message in sorted(lines):
+        steps.append({'role': role, 'status': status, 'step': message, 'seconds': when - previous[role]})
+        previous[role] = when
+    calls = [call for role, path in traces.items() for call in read_trace(path, role)]
+    return {'flow': flow, 'ok': all(status == 0 for status in statuses.values()), 'statuses': statuses,
+            'seconds': seconds, 'steps': steps, 'calls': calls}
+
+
+def row(name, values):
+    print(f"  {name[:58]:<58} p50 {percentile(values, 0.5):7.3f}s  p90 {percentile(values, 0.9):7.3f}s  "
+          f"p99 {percentile(values, 0.99):7.3f}s")
+
+
+def print_report(runs, top):
+    for flow in DEVICE_ARGS:
+        flow_runs = [run for run in runs if run['flow'] == flow]
+        done = [run for run in flow_runs if run['ok']]
+        if not flow_runs:
+            continue
+        print(f"{flow}: {len(done)} of {len(flow_runs)} runs succeeded")
+        for run in flow_runs:
+            if not run['ok']:
+                failed = [step['step'] for step in run['steps'] if step['status'] == 'FAIL']
+                print(f"  failed run, exit statuses {run['statuses']}: {'; '.join(failed[:3])}")
+        if not done:
+            continue
+        row('whole handshake', [run['seconds'] for run in done])
+
+        print('  steps (since the previous PASS line of the same script)')
+        names = []
+        for run in done:
+            names.extend((step['role'], step['step']) for step in run['steps'] if (step['role'], step['step']) not in names)
+        for role, name in names:
+            values = [step['seconds'] for run in done for step in run['steps'] if (step['role'], step['step']) == (role, name)]
+            row(f'{role}: {name}', values)
+
+        print('  time per handshake by kind')
+        kinds = sorted({(call['role'], call['kind']) for run in done for call in run['calls']})
+        for role, kind in kinds:
+            row(f'{role} {kind}', [sum(call['seconds'] for call in run['calls'] if (call['role'], call['kind']) == (role, kind))
+                                   for run in done])
+
+        print('  slowest calls')
+        calls = {}
+        for run in done:
+            for call in run['calls']:
+                calls.setdefault((call['role'], call['kind'], call['name']), []).append(call['seconds'])
+        for (role, kind, name), values in sorted(calls.items(), key=lambda item: -percentile(item[1], 0.5))[:top]:
+            row(f'{role} {kind} {name}', values)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time the attestation handshake end to end against swtpm.')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--flow', choices=['registration', 'service', 'both'], default='both')
+    parser.add_argument('--tcti', default=None, help='TPM of the device instead of a new swtpm, e.g. device:/dev/tpmrm0')
+    parser.add_argument('--top', type=int, default=10, help='slowest traced calls to list')
+    parser.add_argument('--report', default=REPORT_FILE, help='all timings as JSON')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary directory for inspection')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='bench_attestation_')
+    processes = []
+    keep = args.keep
+    try:
+        for directory, _ in SCRIPTS.values():
+            shutil.copytree(os.path.join(HERE, directory), os.path.join(root, directory),
+                            ignore=shutil.ignore_patterns('__pycache__', '*.sock'))
+        shutil.copy(os.path.join(HERE, 'envelope.py'), root)  # $(dirname "$0")/../envelope.py
+        port = free_port()
+        processes.append(subprocess.Popen([sys.executable, os.path.join(HERE, 'upload_service.py'), '--host', '127.0.0.1',
+                                           '--port', str(port), '--root', root], stderr=subprocess.DEVNULL))
+        wait_for_port(port)
+        tcti = args.tcti
+        if tcti is None:
+            swtpm, tcti = start_swtpm(os.path.join(root, 'swtpm'))
+            processes.append(swtpm)
+        env = dict(os.environ, TPM2TOOLS_TCTI=tcti,
+                   SERVICE_PROVIDER_LOCATION=f'127.0.0.1:{port}/cgi-bin/server.py',
+                   PCA_LOCATION=f'127.0.0.1:{port}/cgi-bin/pca.py',
+                   DEVICE_LOCATION=f'127.0.0.1:{port}/cgi-bin/client.py')
+
+        flows = ['registration', 'service'] if args.flow == 'both' else [args.flow]
+        if flows == ['service'] and not run_flow(root, env, 'registration')['ok']:
+            keep = True  # The message points at the files
+            sys.exit(f'registration of the device failed, see {root}')
+        runs = []
+        for iteration in range(args.iterations):
+            for flow in flows:
+                runs.append(run_flow(root, env, flow))
+                print(f"{iteration + 1}/{args.iterations} {flow}: {runs[-1]['seconds']:.2f}s"
+                      f"{'' if runs[-1]['ok'] else ' FAILED'}", file=sys.stderr)
+        with open(args.report, 'w') as file:
+            json.dump(runs, file, indent=2)
+        print_report(runs, args.top)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        if keep:
+            print(f'Files kept in {root}', file=sys.stderr)
+        else:
+            shutil.rmtree(root)
@@ -0,0 +1,142 @@
+#Upload latency of the CGI scripts against upload_service.py on localhost.
+#
+#    python3 bench_upload.py --requests 200
+#
+#Both servers run from a temporary copy of the role directories. Each upload is a
+#multipart POST like remote_cp sends, of a file the size of a handshake message. The CGI
+#path (`http.server --cgi`) needs a new connection and a new interpreter per upload; the
+#service is measured with a new connection per upload, as curl does, and with one
+#kept-alive connection. --curl also times the uploads through curl itself.
+
+import argparse
+import http.client
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from upload_service import ROUTES
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PAYLOAD = os.urandom(300)  # About the size of rsa_ak.name or a registration token
+
+
+def multipart_body(filename, data, destname):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode() + data + \
+           (f'\r\n--{boundary}\r\nContent-Disposition: form-data; name="destname"\r\n\r\n{destname}\r\n'
+            f'--{boundary}--\r\n').encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'nothing listening on port {port}')
+
+
+def upload(connection, route, destname):
+    body, content_type = multipart_body('upload.bin', PAYLOAD, destname)
+    connection.request('POST', route, body, {'Content-Type': content_type})
+    response = connection.getresponse()
+    response.read()
+    if response.status != 200:
+        raise RuntimeError(f'upload failed with HTTP {response.status}')
+
+
+# Seconds per upload, opening a new connection for every upload unless keep_alive
+def time_uploads(port, route, requests, keep_alive=False):
+    timings = []
+    connection = http.client.HTTPConnection('127.0.0.1', port) if keep_alive else None
+    for index in range(requests):
+        started = time.perf_counter()
+        if keep_alive:
+            upload(connection, route, f'bench_{index}.bin')
+        else:
+            fresh = http.client.HTTPConnection('127.0.0.1', port)
+            upload(fresh, route, f'bench_{index}.bin')
+            fresh.close()
+        timings.append(time.perf_counter() - started)
+    if connection is not None:
+        connection.close()
+    return timings
+
+
+def time_curl(port, route, requests, path):
+    timings = []
+    for index in range(requests):
+        started = time.perf_counter()
+        subprocess.run(['curl', '-s', '-o', os.devnull, '-X', 'POST', '-F', f'file=@{path}',
+                        '-F', f'destname=bench_{index}.bin', f'127.0.0.1:{port}{route}'], check=True)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def report(name, timings):
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{name:<32} median {statistics.median(ordered) * 1000:7.2f} ms  p95 {p95 * 1000:7.2f} ms  "
+          f"{len(ordered) / sum(ordered):7.1f} uploads/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare upload latency of the CGI scripts and upload_service.py.')
+    parser.add_argument('--requests', type=int, default=100, help='uploads per measurement')
+    parser.add_argument('--route', default='/cgi-bin/server.py', choices=sorted(ROUTES))
+    parser.add_argument('--curl', action='store_true', help='also time uploads through curl')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='bench_upload_')
+    processes = []
+    try:
+        shutil.copytree(os.path.join(HERE, 'cgi-bin'), os.path.join(root, 'cgi-bin'),
+                        ignore=shutil.ignore_patterns('__pycache__'))
+        for script in ROUTES:
+            os.chmod(os.path.join(root, script.lstrip('/')), 0o755)  # http.server execs them
+        for directory in ROUTES.values():
+            os.makedirs(os.path.join(root, directory))
+        cgi_port, service_port = free_port(), free_port()
+        processes.append(subprocess.Popen([sys.executable, '-m', 'http.server', '--cgi', str(cgi_port),
+                                           '--bind', '127.0.0.1'], cwd=root,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        processes.append(subprocess.Popen([sys.executable, os.path.join(HERE, 'upload_service.py'), '--host', '127.0.0.1',
+                                           '--port', str(service_port), '--root', root], stderr=subprocess.DEVNULL))
+        wait_for_port(cgi_port)
+        wait_for_port(service_port)
+
+        report('CGI, new connection', time_uploads(cgi_port, args.route, args.requests))
+        report('service, new connection', time_uploads(service_port, args.route, args.requests))
+        report('service, keep-alive', time_uploads(service_port, args.route, args.requests, keep_alive=True))
+        if args.curl:
+            payload_path = os.path.join(root, 'payload.bin')
+            with open(payload_path, 'wb') as file:
+                file.write(PAYLOAD)
+            report('CGI, curl', time_curl(cgi_port, args.route, args.requests, payload_path))
+            report('service, curl', time_curl(service_port, args.route, args.requests, payload_path))
+
+        stored = os.path.join(root, ROUTES[args.route], 'bench_0.bin')
+        with open(stored, 'rb') as file:
+            if file.read() != PAYLOAD:
+                sys.exit(f'{stored} does not hold the uploaded data')
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(root)
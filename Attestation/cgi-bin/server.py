@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import cgi
 import cgitb
+import hashlib
 import os
 
 cgitb.enable()
@@ -14,17 +15,27 @@ size = fileitem.file.tell()
 fileitem.file.seek(0)
 name, extension = os.path.splitext(fileitem.filename)
 
-message = "Failed"
+# Larger files go through upload_service.py, which streams them to disk
+status = "413 Payload Too Large"
+message = "Failed: uploads through the CGI scripts are limited to 4096 bytes"
 if size < 4096:
     data = fileitem.file.read()
-    # this is the base name of the file that was uploaded:
-    #filename = os.path.basename(fileitem.filename)
-    filename = os.path.join(os.getcwd(), "ServiceProvider", os.path.basename(fileitem.filename))
-    if destname != ".":
-        filename = os.path.join(os.getcwd(), "ServiceProvider", destname)
-    with open(filename, 'wb') as f:
-        f.write(data)
-    message = "Success"
-    
-#print('Content-Type: text/plain\r\n\r\n', end='')
-#print(message)
+    expected = form.getvalue('sha256')
+    if expected and hashlib.sha256(data).hexdigest() != expected.strip().lower():
+        status = "400 Bad Request"
+        message = "Failed: SHA-256 mismatch"
+    else:
+        # this is the base name of the file that was uploaded:
+        #filename = os.path.basename(fileitem.filename)
+        filename = os.path.join(os.getcwd(), "ServiceProvider", os.path.basename(fileitem.filename))
+        if destname != ".":
+            filename = os.path.join(os.getcwd(), "ServiceProvider", destname)
+        # Written next to the destination and renamed, so the waiting script never sees a partial file
+        with open(filename + '.part', 'wb') as f:
+            f.write(data)
+        os.replace(filename + '.part', filename)
+        status = "200 OK"
+        message = "Success"
+
+print(f'Status: {status}\r\nContent-Type: text/plain\r\n\r\n', end='')
+print(message)
@@ -0,0 +1,170 @@
+#Envelope encryption of the service content.
+#
+#    python3 envelope.py seal --public-key d_s_service_content_key.pub --wrapped-key-out s_d_service_content.key \
+#        --key-out content.aeskey service-content.plain s_d_service_content.encrypted
+#    python3 envelope.py seal --key-file content.aeskey train.zip s_d_service_data.encrypted
+#    python3 envelope.py open --key-file service_content.key s_d_service_content.encrypted -
+#
+#`openssl rsautl -encrypt` with the device's content key limits the content to one RSA
+#block. Instead the Service-Provider generates a random AES-256 key, wraps it with the
+#content key (PKCS#1 v1.5, what rsautl used, so `tpm2 rsadecrypt` on the device unwraps
+#it) and encrypts the content of any size with AES-GCM in chunks:
+#
+#    MAGIC | version (1 byte) | header length (4 bytes) | JSON header | chunk 0 | chunk 1 | ...
+#
+#Every chunk but the last holds chunk_size bytes of plaintext; the last one is shorter
+#(possibly empty), which marks the end. A chunk is its ciphertext followed by the 16 byte
+#tag, its nonce is the random nonce prefix from the header plus the chunk number and its
+#associated data the SHA-256 of the header, the chunk number and whether it is the last,
+#so modified, reordered or truncated streams fail authentication. Several streams can be
+#sealed under one key (they get different nonce prefixes), e.g. the dataset key and the
+#dataset itself in one attestation round.
+
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+
+from Cryptodome.Cipher import AES, PKCS1_v1_5
+from Cryptodome.PublicKey import RSA
+from Cryptodome.Random import get_random_bytes
+
+MAGIC = b'ENVL'
+VERSION = 1
+KEY_SIZE = 32
+TAG_SIZE = 16
+CHUNK_SIZE = 1024 * 1024
+
+
+def new_key():
+    return get_random_bytes(KEY_SIZE)
+
+
+# The AES key encrypted with the RSA public key in public_key_path (PEM)
+def wrap_key(key, public_key_path):
+    with open(public_key_path, 'rb') as file:
+        public_key = RSA.import_key(file.read())
+    return PKCS1_v1_5.new(public_key).encrypt(key)
+
+
+def chunk_cipher(key, header_digest, prefix, index, final):
+    cipher = AES.new(key, AES.MODE_GCM, nonce=prefix + struct.pack('>I', index))
+    cipher.update(header_digest + struct.pack('>Q?', index, final))
+    return cipher
+
+
+# Encrypt in_file into out_file (binary file objects) chunk by chunk
+def seal_stream(in_file, out_file, key, chunk_size=CHUNK_SIZE, name=None):
+    header = json.dumps({'nonce_prefix': get_random_bytes(8).hex(), 'chunk_size': chunk_size, 'name': name},
+                        sort_keys=True).encode('utf-8')
+    out_file.write(MAGIC + struct.pack('<BI', VERSION, len(header)) + header)
+    header_digest = hashlib.sha256(header).digest()
+    prefix = bytes.fromhex(json.loads(header)['nonce_prefix'])
+    index = 0
+    while True:
+        data = in_file.read(chunk_size)
+        final = len(data) < chunk_size
+        ciphertext, tag = chunk_cipher(key, header_digest, prefix, index, final).encrypt_and_digest(data)
+        out_file.write(ciphertext + tag)
+        if final:
+            return index + 1
+        index += 1
+
+
+def read_header(in_file):
+    start = in_file.read(len(MAGIC) + 5)
+    if len(start) != len(MAGIC) + 5 or start[:len(MAGIC)] != MAGIC:
+        raise ValueError('not an envelope')
+    version, length = struct.unpack('<BI', start[len(MAGIC):])
+    if version != VERSION:
+        raise ValueError(f'unsupported envelope version {version}')
+    header = in_file.read(length)
+    try:
+        return header, json.loads(header)
+    except ValueError:
+        raise ValueError('corrupt envelope header')
+
+
+# Plaintext chunks of an envelope read from in_file; raises ValueError as soon as a chunk
+# fails authentication or the stream ends before its last chunk
+def iter_open_stream(in_file, key):
+    header, fields = read_header(in_file)
+    header_digest = hashlib.sha256(header).digest()
+    prefix = bytes.fromhex(fields['nonce_prefix'])
+    blob_size = fields['chunk_size'] + TAG_SIZE
+    index = 0
+    while True:
+        blob = in_file.read(blob_size)
+        if len(blob) < TAG_SIZE:
+            raise ValueError('envelope is truncated')
+        final = len(blob) < blob_size
+        cipher = chunk_cipher(key, header_digest, prefix, index, final)
+        try:
+            data = cipher.decrypt_and_verify(blob[:-TAG_SIZE], blob[-TAG_SIZE:])
+        except ValueError:
+            raise ValueError(f'chunk {index} failed authentication (wrong key, modified or truncated envelope)')
+        yield data
+        if final:
+            return
+        index += 1
+
+
+def open_stream(in_file, out_file, key):
+    for data in iter_open_stream(in_file, key):
+        out_file.write(data)
+
+
+# Key files are only readable by their owner
+def write_key(path, key):
+    with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as file:
+        file.write(key)
+
+
+def read_key(path):
+    with open(path, 'rb') as file:
+        key = file.read()
+    if len(key) != KEY_SIZE:
+        raise ValueError(f'{path} does not hold a {KEY_SIZE} byte key')
+    return key
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Seal or open service content with an RSA-wrapped AES-GCM envelope.')
+    parser.add_argument('command', choices=['seal', 'open'])
+    parser.add_argument('input', help="input file, or '-' for stdin")
+    parser.add_argument('output', help="output file, or '-' for stdout")
+    parser.add_argument('--key-file', help='raw AES key (open, or seal with an existing key)')
+    parser.add_argument('--public-key', help='seal: PEM public key the new AES key is wrapped with')
+    parser.add_argument('--wrapped-key-out', help='seal: where the wrapped AES key is written')
+    parser.add_argument('--key-out', help='seal: also keep the new AES key, to seal more content with it')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    if args.command == 'open' or not args.public_key:
+        if not args.key_file:
+            parser.error('--key-file is needed unless sealing with --public-key')
+        key = read_key(args.key_file)
+    else:
+        if not args.wrapped_key_out:
+            parser.error('--public-key needs --wrapped-key-out')
+        key = new_key()
+        with open(args.wrapped_key_out, 'wb') as file:
+            file.write(wrap_key(key, args.public_key))
+        if args.key_out:
+            write_key(args.key_out, key)
+
+    in_file = sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')
+    out_file = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+    try:
+        if args.command == 'seal':
+            seal_stream(in_file, out_file, key, args.chunk_size,
+                        None if args.input == '-' else os.path.basename(args.input))
+        else:
+            open_stream(in_file, out_file, key)
+    except ValueError as error:
+        sys.exit(f'envelope: {error}')
+    finally:
+        in_file.close()
+        out_file.close()
@@ -0,0 +1,278 @@
+#In-process verification of TPM quotes for the Service-Provider.
+#
+#    python3 quote_verifier.py --public d_s_service_aik.pub --nonce $NONCE \
+#        --message attestation_quote.dat --signature attestation_quote.signature \
+#        --pcr-selection sha1:16+sha256:16 --code code.txt
+#
+#system_software_state_validation spawns tpm2_checkquote and tpm2_print for every service
+#request, and the content key check spawns openssl. QuoteVerifier does the same checks in
+#Python: it parses the TPMS_ATTEST written by tpm2_quote, checks its magic, type, nonce and
+#that it covers exactly the PCR selection the Service-Provider asked for, verifies the
+#AIK's RSASSA-PKCS1-v1_5 signature over it and compares the PCR digest with the golden
+#value for that selection. AIK public keys are parsed once and
+#cached. Golden digests are either given or computed once from the code file the device
+#extends into PCR 16. QuoteQueue collects the quotes of concurrent service requests and
+#verifies them in batches off the event loop, so with many devices attesting a quote costs
+#a signature check instead of several process spawns.
+
+import argparse
+import asyncio
+import hashlib
+import struct
+import sys
+
+from Cryptodome.PublicKey import RSA
+
+TPM_GENERATED_VALUE = 0xff544347
+TPM_ST_ATTEST_QUOTE = 0x8018
+TPM_ALG_RSASSA = 0x0014
+# TPM algorithm IDs of the hashes, with their hashlib name and the DER DigestInfo prefix
+# of a PKCS#1 v1.5 signature
+HASH_ALGORITHMS = {
+    0x0004: ('sha1', bytes.fromhex('3021300906052b0e03021a05000414')),
+    0x000B: ('sha256', bytes.fromhex('3031300d060960864801650304020105000420')),
+    0x000C: ('sha384', bytes.fromhex('3041300d060960864801650304020205000430')),
+    0x000D: ('sha512', bytes.fromhex('3051300d060960864801650304020305000440')),
+}
+HASH_IDS = {name: algorithm for algorithm, (name, _) in HASH_ALGORITHMS.items()}
+BATCH_SIZE = 64
+
+
+class QuoteError(ValueError):
+    pass
+
+
+# Big-endian reader for the TPM structures
+class Reader:
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def take(self, size):
+        if self.offset + size > len(self.data):
+            raise QuoteError('quote is truncated')
+        data = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return data
+
+    def unpack(self, fmt):
+        return struct.unpack('>' + fmt, self.take(struct.calcsize('>' + fmt)))
+
+    def sized(self):  # TPM2B_*: 16 bit size and the bytes
+        return self.take(self.unpack('H')[0])
+
+
+# Fields of a TPMS_ATTEST holding a quote: the nonce (extraData), the PCR selection as
+# [(hash algorithm ID, [PCR indices])] and the PCR digest
+def parse_quote(message):
+    reader = Reader(message)
+    magic, kind = reader.unpack('IH')
+    if magic != TPM_GENERATED_VALUE:
+        raise QuoteError('not generated by a TPM')
+    if kind != TPM_ST_ATTEST_QUOTE:
+        raise QuoteError(f'attestation type {kind:#06x} is not a quote')
+    reader.sized()  # qualifiedSigner
+    nonce = reader.sized()
+    reader.unpack('QIIBQ')  # clockInfo and firmwareVersion
+    selection = []
+    for _ in range(reader.unpack('I')[0]):
+        algorithm, size = reader.unpack('HB')
+        bitmap = reader.take(size)
+        selection.append((algorithm, [8 * byte + bit for byte in range(size) for bit in range(8)
+                                      if bitmap[byte] >> bit & 1]))
+    digest = reader.sized()
+    return {'nonce': nonce, 'selection': selection, 'pcr_digest': digest}
+
+
+# Signature bytes and hash algorithm ID of a quote signature, either a TPMT_SIGNATURE
+# (tpm2_quote's default output) or a plain one (-f plain, assumed SHA-256)
+def parse_signature(signature):
+    if len(signature) > 6:
+        scheme, algorithm, size = struct.unpack('>HHH', signature[:6])
+        if len(signature) == 6 + size:
+            if scheme != TPM_ALG_RSASSA:
+                raise QuoteError(f'signature scheme {scheme:#06x} is not RSASSA')
+            return signature[6:], algorithm
+    return signature, HASH_IDS['sha256']
+
+
+# 'sha1:16+sha256:16' as [(hash algorithm ID, [16])]
+def parse_selection(text):
+    selection = []
+    for bank in text.split('+'):
+        name, _, indices = bank.partition(':')
+        try:
+            selection.append((HASH_IDS[name.strip()], sorted(int(index) for index in indices.split(','))))
+        except (KeyError, ValueError):
+            raise QuoteError(f'invalid PCR selection {text!r}')
+    return selection
+
+
+# [(hash algorithm ID, [16])] as 'sha1:16+sha256:16'
+def format_selection(selection):
+    return '+'.join(f"{HASH_ALGORITHMS[algorithm][0] if algorithm in HASH_ALGORITHMS else hex(algorithm)}:"
+                    f"{','.join(str(index) for index in indices)}" for algorithm, indices in selection)
+
+
+# Hashable form of a parsed selection, for the golden digest table
+def selection_key(selection):
+    return tuple((algorithm, tuple(indices)) for algorithm, indices in selection)
+
+
+# PCR digest a quote of selection reports after the device resets PCR 16 and extends the
+# hash of code (extend_code_hash_to_pcr in DeviceNode.sh); other PCRs are not modelled
+def code_pcr_digest(code, selection, digest_name='sha256'):
+    if not selection or not all(indices for _, indices in selection):
+        raise QuoteError('golden value of an empty PCR selection cannot be computed from the code')
+    values = b''
+    for algorithm, indices in selection:
+        name, _ = HASH_ALGORITHMS[algorithm]
+        for index in indices:
+            if index != 16:
+                raise QuoteError(f'golden value of PCR {index} cannot be computed from the code')
+            size = hashlib.new(name).digest_size
+            values += hashlib.new(name, bytes(size) + hashlib.new(name, code).digest()).digest()
+    return hashlib.new(digest_name, values).digest()
+
+
+class QuoteVerifier:
+    def __init__(self, golden=None, code=None):
+        self.golden = {}  # PCR selection -> expected digest
+        for selection, digest in (golden or {}).items():
+            self.add_golden(selection, digest)
+        self.code = code
+        self.keys = {}
+        self.selections = {}  # Requested selection text -> selection_key
+
+    def add_golden(self, selection, digest):
+        self.golden[selection_key(parse_selection(selection))] = bytes.fromhex(digest)
+
+    def requested_selection(self, text):
+        if text not in self.selections:
+            self.selections[text] = selection_key(parse_selection(text))
+        return self.selections[text]
+
+    def golden_digest(self, selection, digest_name):
+        key = selection_key(selection)
+        if key not in self.golden:
+            if self.code is None:
+                raise QuoteError('no golden PCR value for the quoted selection')
+            self.golden[key] = code_pcr_digest(self.code, selection, digest_name)
+        return self.golden[key]
+
+    # Modulus, exponent and size in bytes of an AIK public key (PEM), parsed once per key
+    def public_key(self, pem):
+        if pem not in self.keys:
+            try:
+                key = RSA.import_key(pem)
+            except (ValueError, IndexError, TypeError):
+                raise QuoteError('AIK is not an RSA public key')
+            self.keys[pem] = (int(key.n), int(key.e), key.size_in_bytes())
+        return self.keys[pem]
+
+    # RSASSA-PKCS1-v1_5 check of signature over data, as openssl pkeyutl -verify does. The
+    # signature is raised to the public exponent with Python integers and compared with the
+    # expected encoding, which is what pkcs1_15 does without its per-call conversions.
+    def verify_signature(self, pem, data, signature, algorithm=HASH_IDS['sha256']):
+        if algorithm not in HASH_ALGORITHMS:
+            raise QuoteError(f'unsupported signature hash {algorithm:#06x}')
+        modulus, exponent, size = self.public_key(pem)
+        name, prefix = HASH_ALGORITHMS[algorithm]
+        digest_info = prefix + hashlib.new(name, data).digest()
+        expected = b'\x00\x01' + b'\xff' * (size - len(digest_info) - 3) + b'\x00' + digest_info
+        value = int.from_bytes(signature, 'big')
+        if len(signature) != size or value >= modulus or \
+                pow(value, exponent, modulus).to_bytes(size, 'big') != expected:
+            raise QuoteError('signature verification failed')
+
+    # Check a quote of the PCR selection (text, as sent to the device) as tpm2_checkquote
+    # plus the golden PCR comparison do; raises QuoteError, returns the parsed quote. The
+    # cheap checks come first, the signature last.
+    def verify(self, pem, nonce, message, signature, selection):
+        signature, algorithm = parse_signature(signature)
+        if algorithm not in HASH_ALGORITHMS:
+            raise QuoteError(f'unsupported signature hash {algorithm:#06x}')
+        quote = parse_quote(message)
+        try:
+            expected_nonce = bytes.fromhex(nonce)
+        except ValueError:
+            raise QuoteError('nonce is not hex')
+        if quote['nonce'] != expected_nonce:
+            raise QuoteError('quote does not hold the nonce')
+        if selection_key(quote['selection']) != self.requested_selection(selection):
+            raise QuoteError(f"quote covers PCR selection {format_selection(quote['selection'])!r}, "
+                             f"not the requested {selection!r}")
+        expected = self.golden_digest(quote['selection'], HASH_ALGORITHMS[algorithm][0])
+        if quote['pcr_digest'] != expected:
+            raise QuoteError(f"device PCR {quote['pcr_digest'].hex()} does not match the golden PCR {expected.hex()}")
+        self.verify_signature(pem, message, signature, algorithm)
+        return quote
+
+    # [(pem, nonce, message, signature, selection)] -> [None or the QuoteError of each quote]
+    def verify_batch(self, quotes):
+        results = []
+        for pem, nonce, message, signature, selection in quotes:
+            try:
+                self.verify(pem, nonce, message, signature, selection)
+                results.append(None)
+            except QuoteError as error:
+                results.append(error)
+        return results
+
+
+# Quotes submitted by concurrent handshakes, verified batch by batch in a worker thread
+class QuoteQueue:
+    def __init__(self, verifier, batch_size=BATCH_SIZE):
+        self.verifier = verifier
+        self.batch_size = batch_size
+        self.pending = []
+        self.worker = None
+        self.batches = 0
+
+    # Raises QuoteError when the quote does not verify
+    async def verify(self, pem, nonce, message, signature, selection):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(((pem, nonce, message, signature, selection), future))
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self.drain())
+        error = await future
+        if error is not None:
+            raise error
+
+    async def drain(self):
+        loop = asyncio.get_running_loop()
+        while self.pending:
+            batch, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+            results = await loop.run_in_executor(None, self.verifier.verify_batch, [quote for quote, _ in batch])
+            self.batches += 1
+            for (_, future), error in zip(batch, results):
+                if not future.done():
+                    future.set_result(error)
+
+
+def read_file(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Verify a TPM quote against the AIK and the golden PCR value.')
+    parser.add_argument('--public', required=True, help='AIK public key (PEM)')
+    parser.add_argument('--nonce', required=True, help='qualification the quote was requested with')
+    parser.add_argument('--message', required=True, help='TPMS_ATTEST from tpm2_quote')
+    parser.add_argument('--signature', required=True, help='signature from tpm2_quote')
+    parser.add_argument('--pcr-selection', default='sha1:16+sha256:16', help='selection the quote was requested for')
+    parser.add_argument('--golden-pcr', help='expected PCR digest (hex)')
+    parser.add_argument('--code', help='compute the golden PCR digest from this code file instead')
+    args = parser.parse_args()
+    if not args.golden_pcr and not args.code:
+        parser.error('--golden-pcr or --code is needed')
+
+    try:
+        verifier = QuoteVerifier({args.pcr_selection: args.golden_pcr} if args.golden_pcr else None,
+                                 read_file(args.code) if args.code else None)
+        quote = verifier.verify(read_file(args.public), args.nonce, read_file(args.message), read_file(args.signature),
+                                args.pcr_selection)
+    except QuoteError as error:
+        sys.exit(f'quote verification failed: {error}')
+    print(f"Quote verified, PCR digest {quote['pcr_digest'].hex()}")
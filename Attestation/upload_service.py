@@ -0,0 +1,268 @@
+#Long-running upload service for the attestation handshake.
+#
+#    python3 upload_service.py --port 8080
+#
+#Serves the same routes as the CGI scripts in cgi-bin, so remote_cp in the shell scripts
+#works unchanged: a multipart POST of `file` and `destname` to /cgi-bin/client.py,
+#/cgi-bin/server.py or /cgi-bin/pca.py is stored in DeviceNode/, ServiceProvider/ or
+#PrivacyCA/ under --root. Unlike `http.server --cgi` no interpreter is started per upload
+#and connections are kept alive between requests. The multipart body is parsed as it
+#arrives and the file part streamed to a .part file in chunks, so uploads of any size
+#(e.g. the encrypted dataset) never sit in memory. When the request carries a SHA-256 of
+#the file (a `sha256` form field or an X-Content-SHA256 header), the file is only renamed
+#into place when it matches; a mismatch or an upload over --max-upload is rejected with
+#an error status. The waiting script wakes up on the rename.
+
+import argparse
+import asyncio
+import email.message
+import hashlib
+import os
+import sys
+
+ROUTES = {
+    '/cgi-bin/client.py': 'DeviceNode',
+    '/cgi-bin/server.py': 'ServiceProvider',
+    '/cgi-bin/pca.py': 'PrivacyCA',
+}
+MAX_FIELD = 4096  # Form fields other than the file are held in memory
+READ_SIZE = 65536
+MAX_HEADER = 16384
+KEEPALIVE_SECONDS = 30
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+REASONS = {100: 'Continue', 200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           411: 'Length Required', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class BadRequest(Exception):
+    status = 400
+
+
+class PayloadTooLarge(BadRequest):
+    status = 413
+
+
+# Lower-cased value and the parameters of a header such as Content-Type or Content-Disposition
+def parse_header(value):
+    message = email.message.Message()
+    message['header'] = value
+    params = message.get_params(header='header') or [('', '')]
+    return params[0][0].lower(), {key.lower(): val for key, val in params[1:]}
+
+
+# Reads at most length bytes of a request body from the connection
+class BodyReader:
+    def __init__(self, reader, length):
+        self.reader = reader
+        self.remaining = length
+
+    async def read(self, size=READ_SIZE):
+        if self.remaining <= 0:
+            return b''
+        data = await self.reader.read(min(size, self.remaining))
+        if not data:
+            raise BadRequest('connection closed in the request body')
+        self.remaining -= len(data)
+        return data
+
+    async def drain(self):
+        while await self.read():
+            pass
+
+
+# Incremental multipart/form-data parser: next_part() returns the headers of the next part
+# (None after the last one), part_data() then yields its content in chunks
+class MultipartReader:
+    def __init__(self, body, boundary):
+        self.body = body
+        self.delimiter = b'\r\n--' + boundary
+        self.buffer = b'\r\n'  # The first delimiter has no preceding line break
+        self.started = False
+
+    async def fill(self):
+        data = await self.body.read()
+        if not data:
+            raise BadRequest('multipart body ended early')
+        self.buffer += data
+
+    async def read_until(self, marker):
+        while (index := self.buffer.find(marker)) < 0:
+            if len(self.buffer) > MAX_HEADER:
+                raise BadRequest('multipart headers too long')
+            await self.fill()
+        data, self.buffer = self.buffer[:index], self.buffer[index + len(marker):]
+        return data
+
+    async def next_part(self):
+        if not self.started:
+            await self.read_until(self.delimiter)  # Skip the preamble
+            self.started = True
+        while len(self.buffer) < 2:
+            await self.fill()
+        if self.buffer.startswith(b'--'):
+            await self.body.drain()
+            return None
+        if not self.buffer.startswith(b'\r\n'):
+            raise BadRequest('malformed multipart delimiter')
+        self.buffer = self.buffer[2:]
+        headers = {}
+        for line in (await self.read_until(b'\r\n\r\n')).decode('latin-1').split('\r\n'):
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return headers
+
+    async def part_data(self):
+        keep = len(self.delimiter) - 1
+        while True:
+            index = self.buffer.find(self.delimiter)
+            if index >= 0:
+                data, self.buffer = self.buffer[:index], self.buffer[index + len(self.delimiter):]
+                if data:
+                    yield data
+                return
+            if len(self.buffer) > keep:
+                data, self.buffer = self.buffer[:-keep], self.buffer[-keep:]
+                yield data
+            await self.fill()
+
+
+# Store the upload of a multipart body in directory; returns the SHA-256 of the file
+async def store_upload(parts, directory, expected_sha256=None, max_upload=None):
+    temp_path = os.path.join(directory, f'.upload-{os.getpid()}-{id(parts)}.part')
+    filename = destname = None
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while (headers := await parts.next_part()) is not None:
+            _, params = parse_header(headers.get('content-disposition', ''))
+            if params.get('name') == 'file':
+                filename = params.get('filename') or 'upload'
+                with open(temp_path, 'wb') as file:
+                    async for data in parts.part_data():
+                        size += len(data)
+                        if max_upload is not None and size > max_upload:
+                            raise PayloadTooLarge(f'upload larger than {max_upload} bytes')
+                        digest.update(data)
+                        file.write(data)
+                continue
+            value = b''
+            async for data in parts.part_data():
+                value += data
+                if len(value) > MAX_FIELD:
+                    raise BadRequest(f"form field {params.get('name')} too long")
+            if params.get('name') == 'destname':
+                destname = value.decode('utf-8')
+            elif params.get('name') == 'sha256':
+                expected_sha256 = value.decode('ascii').strip()
+        if filename is None:
+            raise BadRequest('no file in the upload')
+        if expected_sha256 and digest.hexdigest() != expected_sha256.lower():
+            raise BadRequest(f'SHA-256 mismatch: received {size} bytes with SHA-256 {digest.hexdigest()}')
+        # Only names inside the role's directory, as with the CGI scripts' os.path.join;
+        # destname '.' keeps the uploaded file's name as there
+        requested = destname if destname not in (None, '.') else filename
+        name = os.path.basename(requested)
+        if name in ('', '.', '..'):
+            raise BadRequest(f'invalid destination name {requested!r}')
+        os.replace(temp_path, os.path.join(directory, name))
+        return digest.hexdigest()
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+async def send_response(writer, status, message='', keep_alive=True, headers=()):
+    body = message.encode('utf-8') + (b'\n' if message else b'')
+    extra = ''.join(f'{name}: {value}\r\n' for name, value in headers)
+    writer.write(f'HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: text/plain\r\n{extra}'
+                 f'Content-Length: {len(body)}\r\nConnection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'
+                 .encode('latin-1') + body)
+    await writer.drain()
+
+
+# Handle one request; returns whether the connection can be used for another one
+async def handle_request(reader, writer, root, max_upload=None):
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_SECONDS)
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        return False
+    request_line, *header_lines = head.decode('latin-1').split('\r\n')
+    method, path, version = (request_line.split(' ') + ['', '', ''])[:3]
+    headers = {}
+    for line in header_lines:
+        if line:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+    connection = headers.get('connection', '').lower()
+    keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+
+    if 'content-length' not in headers:
+        await send_response(writer, 411 if method == 'POST' else 405, keep_alive=False)
+        return False
+    try:
+        length = int(headers['content-length'])
+    except ValueError:
+        length = -1
+    if length < 0:
+        await send_response(writer, 400, 'invalid Content-Length', keep_alive=False)
+        return False
+    body = BodyReader(reader, length)
+    directory = ROUTES.get(path.split('?')[0])
+    content_type, params = parse_header(headers.get('content-type', ''))
+    if method != 'POST' or directory is None or content_type != 'multipart/form-data' or 'boundary' not in params:
+        status = 405 if method != 'POST' else 404 if directory is None else 400
+        await send_response(writer, status, keep_alive=False)
+        return False
+    # Refused before the body is sent when the client waits for 100 Continue, as curl does
+    if max_upload is not None and body.remaining > max_upload + MAX_HEADER:
+        await send_response(writer, 413, f'upload larger than {max_upload} bytes', keep_alive=False)
+        return False
+    if headers.get('expect', '').lower() == '100-continue':
+        writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+    try:
+        digest = await store_upload(MultipartReader(body, params['boundary'].encode('latin-1')),
+                                    os.path.join(root, directory), headers.get('x-content-sha256'), max_upload)
+    except BadRequest as error:
+        await send_response(writer, error.status, str(error), keep_alive=False)
+        return False
+    await send_response(writer, 200, 'Success', keep_alive, [('X-Content-SHA256', digest)])
+    return keep_alive
+
+
+async def serve_connection(reader, writer, root, max_upload=None):
+    try:
+        while await handle_request(reader, writer, root, max_upload):
+            pass
+    except ConnectionError:
+        pass
+    except Exception as error:
+        # Answered rather than leaving the client with an empty reply (curl exit 52)
+        print(f'Request failed: {error!r}', file=sys.stderr, flush=True)
+        try:
+            await send_response(writer, 500, 'internal error', keep_alive=False)
+        except ConnectionError:
+            pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port, root, max_upload=None):
+    server = await asyncio.start_server(lambda reader, writer: serve_connection(reader, writer, root, max_upload),
+                                        host, port)
+    print(f"Serving uploads for {', '.join(ROUTES)} on {host}:{port}", file=sys.stderr, flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Upload service for the attestation handshake (replaces cgi-bin).')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--root', default=ROOT, help='directory holding DeviceNode/, ServiceProvider/ and PrivacyCA/')
+    parser.add_argument('--max-upload', type=int, default=None, metavar='BYTES', help='reject larger uploads (default: no limit)')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.root, args.max_upload))
+    except KeyboardInterrupt:
+        pass
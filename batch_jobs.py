@@ -0,0 +1,199 @@
+#Run the analysis on the VM for many datasets in one go.
+#
+#    python batch_jobs.py jobs.json --results-dir results
+#
+#The job spec (JSON, or YAML when PyYAML is installed) lists the datasets and the script
+#to run on each; values at the top level are defaults for every job:
+#
+#    {"parallel": 2, "script": "Data_analysis.py", "outputs": ["Task2RunResults.txt"],
+#     "jobs": [{"name": "0601", "data": "exports/0601.bin"},
+#              {"name": "0602", "data": "exports/0602.bin", "timeout": 3600}]}
+#
+#Every job gets its own directory on the VM (jobs/NAME in remote_dir), so NAME must be a
+#plain file name. The dataset is decrypted into it, the script runs there and the outputs
+#are downloaded to results-dir/NAME. At most `parallel` jobs run at once over the pooled SSH connections; a
+#failing job does not stop the others. The per-job timings end up in a summary JSON file.
+
+import argparse
+import json
+import os
+import posixpath
+import shlex
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from delta_sync import delta_upload
+from orchestrator import REMOTE_DIR, file_chunks
+from result_stream import run_streaming
+from sftp_transfer import download, upload
+from ssh_jobs import SSHPool, LinePrinter, run_command
+
+SUMMARY_FILE = 'batch_results.json'
+TRANSFERS = ('stream', 'sftp', 'delta')
+DEFAULTS = {
+    'remote_dir': REMOTE_DIR,
+    'script': 'Data_analysis.py',
+    'args': [],
+    'outputs': ['Task2RunResults.txt', 'Task2RunProfile.json'],
+    'transfer': 'stream',  # stream: pipe into decrypt.py, sftp: resumable upload, delta: changed blocks only
+    'timeout': None,
+}
+
+
+def load_spec(path):
+    with open(path) as file:
+        if path.endswith(('.yml', '.yaml')):
+            if yaml is None:
+                raise ValueError('YAML job specs need PyYAML (pip install pyyaml); use JSON otherwise')
+            spec = yaml.safe_load(file)
+        else:
+            spec = json.load(file)
+    if not isinstance(spec, dict) or not spec.get('jobs'):
+        raise ValueError(f'{path} has no jobs')
+    return spec
+
+
+# The jobs of spec with the defaults filled in
+def expand_jobs(spec):
+    defaults = dict(DEFAULTS)
+    defaults.update({key: value for key, value in spec.items() if key in DEFAULTS})
+    jobs = []
+    for entry in spec['jobs']:
+        if 'data' not in entry:
+            raise ValueError(f'job {entry!r} has no data file')
+        job = dict(defaults)
+        job.update(entry)
+        job.setdefault('name', os.path.splitext(os.path.basename(job['data']))[0])
+        # The name becomes a directory under jobs/ on the VM and under --results-dir
+        if not isinstance(job['name'], str) or job['name'] in ('', '.', '..') or \
+                any(separator in job['name'] for separator in ('/', '\\')):
+            raise ValueError(f"job name {job['name']!r} must be a plain file name")
+        if not os.path.isfile(job['data']):
+            raise ValueError(f"job {job['name']}: {job['data']} does not exist")
+        if job['transfer'] not in TRANSFERS:
+            raise ValueError(f"job {job['name']}: transfer must be one of {', '.join(TRANSFERS)}")
+        jobs.append(job)
+    names = [job['name'] for job in jobs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"duplicate job names: {', '.join(duplicates)}")
+    return jobs
+
+
+def check(result, what):
+    if result['exit_status'] != 0:
+        raise RuntimeError(f"{what} failed with exit status {result['exit_status']}")
+
+
+# Upload and decrypt the dataset, run the script and download its outputs; returns the
+# job's summary with the time spent in each step
+def run_job(pool, job, results_dir):
+    name = job['name']
+    workdir = posixpath.join(job['remote_dir'], 'jobs', name)
+    decrypt = f"python3 {shlex.quote(posixpath.join(job['remote_dir'], 'decrypt.py'))}"
+    summary = {'name': name, 'data': job['data'], 'bytes': os.path.getsize(job['data']), 'status': 'ok'}
+    started = time.perf_counter()
+    step_started = started
+    printer = LinePrinter(name)
+
+    def step(key):
+        nonlocal step_started
+        now = time.perf_counter()
+        summary[key] = round(now - step_started, 3)
+        step_started = now
+
+    try:
+        check(run_command(pool, f'mkdir -p {shlex.quote(workdir)}'), 'mkdir')
+        if job['transfer'] == 'stream':
+            command = f'{decrypt} --input - --extract-to {shlex.quote(workdir)}'
+            check(run_command(pool, command, printer, input_chunks=file_chunks(job['data'])), 'decrypt')
+            printer.flush()
+        else:
+            remote_data = posixpath.join(workdir, 'data.bin')
+            if job['transfer'] == 'delta':
+                delta_upload(pool, job['data'], remote_data)
+            else:
+                upload(pool, job['data'], remote_data)
+            command = f'{decrypt} --input {shlex.quote(remote_data)} --extract-to {shlex.quote(workdir)}'
+            check(run_command(pool, command, printer), 'decrypt')
+            printer.flush()
+        step('upload_decrypt_seconds')
+
+        script = posixpath.join(job['remote_dir'], job['script'])
+        command = (f'cd {shlex.quote(workdir)} && ANALYSIS_HEADLESS=1 python3 '
+                   + ' '.join(shlex.quote(str(arg)) for arg in [script] + list(job['args'])))
+        # Run under the result stream's wrapper, which reports the remote process group, so a
+        # timeout kills the script on the VM instead of only closing the channel
+        try:
+            result, _ = run_streaming(pool, command, timeout=job['timeout'], name=name)
+        except TimeoutError:
+            raise RuntimeError(f"{job['script']} timed out after {job['timeout']}s and was killed")
+        check(result, job['script'])
+        step('analysis_seconds')
+
+        local_dir = os.path.join(results_dir, name)
+        os.makedirs(local_dir, exist_ok=True)
+        for output in job['outputs']:
+            download(pool, posixpath.join(workdir, output), os.path.join(local_dir, os.path.basename(output)))
+        summary['outputs'] = [os.path.join(local_dir, os.path.basename(output)) for output in job['outputs']]
+        step('download_seconds')
+    except Exception as error:
+        printer.flush()
+        summary['status'] = 'failed'
+        summary['error'] = str(error)
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+# Run the jobs with at most `parallel` at a time; summaries are in job order
+def run_jobs(pool, jobs, results_dir, parallel=2):
+    with ThreadPoolExecutor(parallel) as executor:
+        return list(executor.map(lambda job: run_job(pool, job, results_dir), jobs))
+
+
+def print_summary(summaries, seconds):
+    for summary in summaries:
+        steps = '  '.join(f"{key[:-8]} {summary[key]:7.1f}s" for key in
+                          ('upload_decrypt_seconds', 'analysis_seconds', 'download_seconds') if key in summary)
+        print(f"{summary['name']:<20} {summary['status']:<7} {summary['seconds']:8.1f}s  {steps}"
+              + (f"  {summary['error']}" if 'error' in summary else ''))
+    failed = sum(summary['status'] != 'ok' for summary in summaries)
+    print(f"{len(summaries) - failed} of {len(summaries)} jobs succeeded in {seconds:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the analysis on the VM for every dataset in a job spec.')
+    parser.add_argument('spec', help='job spec (.json, or .yaml with PyYAML installed)')
+    parser.add_argument('--results-dir', default='results', help='local directory; each job downloads into NAME/')
+    parser.add_argument('--parallel', type=int, default=None, help='jobs running at the same time (default: spec or 2)')
+    parser.add_argument('--connections', type=int, default=None, help='SSH connections in the pool (default: --parallel)')
+    parser.add_argument('--summary', default=SUMMARY_FILE, help='per-job timings and status as JSON')
+    parser.add_argument('--only', nargs='+', metavar='NAME', help='run only these jobs')
+    args = parser.parse_args()
+
+    try:
+        spec = load_spec(args.spec)
+        jobs = expand_jobs(spec)
+    except (OSError, ValueError) as error:
+        sys.exit(str(error))
+    if args.only:
+        unknown = sorted(set(args.only) - {job['name'] for job in jobs})
+        if unknown:
+            sys.exit(f"no job named {', '.join(unknown)} in {args.spec}")
+        jobs = [job for job in jobs if job['name'] in args.only]
+    parallel = args.parallel or spec.get('parallel', 2)
+
+    started = time.perf_counter()
+    with SSHPool.from_config(max_connections=args.connections or parallel) as pool:
+        summaries = run_jobs(pool, jobs, args.results_dir, parallel)
+    seconds = time.perf_counter() - started
+    with open(args.summary, 'w') as file:
+        json.dump({'seconds': round(seconds, 3), 'parallel': parallel, 'jobs': summaries}, file, indent=2)
+    print_summary(summaries, seconds)
+    sys.exit(1 if any(summary['status'] != 'ok' for summary in summaries) else 0)
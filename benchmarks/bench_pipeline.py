@@ -0,0 +1,66 @@
+#Benchmarks of the Data_analysis.py pipeline stages on synthetic data.
+#
+#    cd benchmarks && pytest bench_pipeline.py --benchmark-compare=0001 --benchmark-compare-fail=min:25%
+#    cd benchmarks && pytest bench_pipeline.py --benchmark-save=baseline   # record a new baseline
+#
+#Baselines are stored under benchmarks/.benchmarks and committed, so regressions show up
+#against earlier runs on the same machine. 0001_baseline was recorded at the conftest's
+#default sizes. The best round (min) is compared because the first round of some stages
+#includes warm-up.
+
+import numpy as np
+
+from pipeline_stages import fit_pca, fit_ppca, load_and_optimize_csv, sample_hidden_given_visible, sample_visible_given_hidden, train_logistic
+from user_features import expand_interests, user_feature_columns
+
+# The PPCA samplers loop in Python, so they run on a fixed-size slice
+PPCA_ROWS = 5000
+
+
+def bench_load_and_optimize_csv(benchmark, dataset_paths):
+    ads_file_path, _ = dataset_paths
+    df = benchmark.pedantic(load_and_optimize_csv, args=(ads_file_path,), rounds=3)
+    assert len(df) > 0
+
+
+def bench_split_and_expand(benchmark, frames):
+    _, df_feeds = frames
+    slots, counts = benchmark(lambda: expand_interests(df_feeds['u_newsCatInterests'], []))
+    assert len(counts) == len(df_feeds)
+
+
+def bench_overlap_join(benchmark, frames):
+    df_ads, df_feeds = frames
+    columns = benchmark.pedantic(user_feature_columns, args=(df_ads, df_feeds, []), rounds=3)
+    assert columns['in_ads'].sum() > 0 and columns['in_feeds'].sum() > 0
+
+
+def bench_model_frame(benchmark, user_table):
+    final = benchmark(user_table.model_frame)
+    assert set(final['target']) == {0, 1}
+
+
+def bench_logistic_training(benchmark, model_data):
+    X, y = model_data
+    model = benchmark.pedantic(train_logistic, args=(X, y), rounds=3)[0]
+    assert model.coef_.shape[1] == X.shape[1]
+
+
+def bench_pca(benchmark, model_data):
+    X, y = model_data
+    numeric_final = X.assign(target=y)
+    pca, _ = benchmark(fit_pca, numeric_final)
+    assert len(pca.explained_variance_) == numeric_final.shape[1]
+
+
+def bench_ppca_sampling(benchmark, model_data):
+    X, y = model_data
+    data = np.array(X.assign(target=y), dtype=np.float64)[:PPCA_ROWS]
+    ppca = fit_ppca(data, q=1)
+
+    def sample():
+        hidden = sample_hidden_given_visible(ppca['weight_ml'], ppca['mu_ml'], ppca['var_ml'], data)
+        return sample_visible_given_hidden(ppca['weight_ml'], ppca['mu_ml'], ppca['var_ml'], hidden)
+
+    act_visible = benchmark.pedantic(sample, rounds=3)
+    assert act_visible.shape == data.shape
@@ -0,0 +1,37 @@
+#Latency of ssh_jobs.py against the local stub server: one command on a pooled
+#connection, concurrent channels on one connection and output streamed while the command
+#still runs.
+#
+#    cd benchmarks && pytest bench_ssh_jobs.py
+
+from ssh_jobs import SSHPool, run_command, run_commands
+
+SLEEP_SECONDS = 0.3
+CHANNELS = 8
+
+
+def bench_command_latency(benchmark, sshd):
+    with SSHPool(sshd.connector(), max_connections=1) as pool:
+        run_command(pool, 'true')  # Connect outside the measurement
+        result = benchmark(run_command, pool, 'echo ok')
+    assert result['exit_status'] == 0 and result['stdout'] == b'ok\n'
+
+
+# CHANNELS sleeping commands on one connection take about as long as one
+def bench_concurrent_channels(benchmark, sshd):
+    with SSHPool(sshd.connector(), max_connections=1, max_channels=CHANNELS) as pool:
+        commands = [f'sleep {SLEEP_SECONDS}'] * CHANNELS
+        results = benchmark.pedantic(run_commands, args=(pool, commands, CHANNELS, False), rounds=3)
+        assert len(pool.clients) == 1
+    assert all(result['exit_status'] == 0 for result in results)
+    assert benchmark.stats.stats.max < SLEEP_SECONDS * CHANNELS / 2
+
+
+# The first line arrives while the command is still running
+def bench_streamed_output(benchmark, sshd):
+    with SSHPool(sshd.connector(), max_connections=1) as pool:
+        result = benchmark.pedantic(run_command, args=(pool, f'echo first; sleep {SLEEP_SECONDS}; echo last'),
+                                    rounds=3)
+    assert result['stdout'] == b'first\nlast\n'
+    assert result['first_output_seconds'] < result['latency_seconds'] - SLEEP_SECONDS / 2
+
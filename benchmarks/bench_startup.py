@@ -0,0 +1,49 @@
+#Startup cost of Data_analysis.py per stage selection: a fresh interpreter imports what the
+#script loads at startup plus the libraries of the selected stages (ANALYSIS_STAGES), as
+#the stage cells do when they run. The child's peak RSS ends up in the benchmark's
+#extra_info (shown with --benchmark-json or --benchmark-save).
+#
+#    cd benchmarks && pytest bench_startup.py --benchmark-columns=min,mean,max
+
+import importlib.util
+import os
+import subprocess
+import sys
+
+import pytest
+
+from pipeline_stages import STAGE_MODULES, selected_stages
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+CHILD = ('import resource, sys\n'
+         'from pipeline_stages import import_stage_modules, selected_stages\n'
+         'import_stage_modules(selected_stages(sys.argv[1]))\n'
+         'print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)')
+# '' only loads the data, 'all' is the default run
+SELECTIONS = ['', 'plots', 'logistic', 'pca,ppca', 'vae', 'all']
+
+
+# First module of selection that is not installed, or None
+def missing_module(selection):
+    for stage in ['load'] + sorted(selected_stages(selection)):
+        for name in STAGE_MODULES[stage]:
+            if importlib.util.find_spec(name.split('.')[0]) is None:
+                return name
+    return None
+
+
+# Import the modules of selection in a new interpreter; returns its peak RSS in MB
+def start_interpreter(selection):
+    output = subprocess.run([sys.executable, '-c', CHILD, selection], cwd=ROOT, check=True,
+                            stdout=subprocess.PIPE, text=True).stdout
+    return int(output.split()[-1]) / 1024
+
+
+@pytest.mark.parametrize('selection', SELECTIONS)
+def bench_startup(benchmark, selection):
+    missing = missing_module(selection)
+    if missing is not None:
+        pytest.skip(f'{missing} is not installed')
+    peak_rss_mb = benchmark.pedantic(start_interpreter, args=(selection,), rounds=5)
+    benchmark.extra_info['peak_rss_mb'] = peak_rss_mb
+    assert peak_rss_mb > 0
@@ -0,0 +1,59 @@
+#Shared fixtures for the pipeline benchmarks: a synthetic dataset generated once per
+#session. Sizes can be changed with BENCH_ADS_ROWS, BENCH_FEEDS_ROWS, BENCH_USERS and
+#BENCH_OVERLAP. The SSH benchmarks run against the local stub server of the tests
+#(tests/ssh_stub.py).
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'tests'))  # ssh_stub.py
+
+from pipeline_stages import encode_categories, load_and_optimize_csv
+from synthetic_data import write_synthetic_dataset
+from user_features import build_user_feature_table
+
+
+def env_number(name, default, cast=int):
+    return cast(os.environ.get(name, default))
+
+
+@pytest.fixture(scope='session')
+def dataset_paths(tmp_path_factory):
+    out_dir = tmp_path_factory.mktemp('bench_data')
+    return write_synthetic_dataset(str(out_dir),
+                                   ads_rows=env_number('BENCH_ADS_ROWS', 100000),
+                                   feeds_rows=env_number('BENCH_FEEDS_ROWS', 100000),
+                                   n_users=env_number('BENCH_USERS', 20000),
+                                   overlap=env_number('BENCH_OVERLAP', 0.3, float))
+
+
+@pytest.fixture(scope='session')
+def frames(dataset_paths):
+    ads_file_path, feeds_file_path = dataset_paths
+    return load_and_optimize_csv(ads_file_path), load_and_optimize_csv(feeds_file_path)
+
+
+@pytest.fixture(scope='session')
+def user_table(frames, tmp_path_factory):
+    df_ads, df_feeds = frames
+    return build_user_feature_table(df_ads, df_feeds, str(tmp_path_factory.mktemp('user_feature_table')))
+
+
+# Encoded features and target of the model frame, as the logistic cell uses them
+@pytest.fixture(scope='session')
+def model_data(user_table):
+    final = user_table.model_frame()
+    X = encode_categories(final.drop(columns=['target']))
+    return X, final['target'].astype(int)
+
+
+@pytest.fixture(scope='session')
+def sshd(tmp_path_factory):
+    from ssh_stub import StubSSHD
+
+    server = StubSSHD(str(tmp_path_factory.mktemp('sshd')))
+    yield server
+    server.close()
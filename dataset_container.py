@@ -0,0 +1,355 @@
+#Chunked AES-GCM container for the encrypted datasets.
+#
+#    python dataset_container.py encrypt train.zip train.dsc --key-file key.txt
+#    python dataset_container.py decrypt train.dsc train.zip --key-file key.txt
+#    python dataset_container.py encrypt --csv train_data_ads.csv train_data_feeds.csv train.dsc --key-file key.txt
+#
+#Unlike the single CBC stream in train.bin, every chunk is encrypted independently with
+#its own nonce and GCM tag, so chunks are encrypted/decrypted across all cores and any
+#chunk can be read on its own. Layout:
+#
+#    MAGIC | version (1 byte) | header length (4 bytes) | JSON header | chunk 0 | chunk 1 | ...
+#
+#The JSON header holds the nonce prefix and the plaintext size of every chunk (the chunk
+#index). Each chunk is its ciphertext followed by the 16 byte tag; its nonce is the
+#prefix plus the chunk number and its associated data is the SHA-256 of the header plus
+#the chunk number, so a modified header or reordered/truncated chunks fail authentication.
+#
+#CSV files can be stored directly as members (encrypt --csv) with chunks cut at row
+#boundaries; the header then also records how many rows every chunk holds, so a row range
+#or a sample only decrypts the chunks it touches (see read_rows/sample_rows in decrypt.py).
+#Rows are split on newlines, so quoted fields must not contain line breaks.
+
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+
+MAGIC = b'DSCT'
+VERSION = 1
+TAG_SIZE = 16
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+# Same key derivation as decrypt_aes in decrypt.py
+def container_key(key):
+    return key[:32].ljust(32, b'\0')
+
+
+def chunk_nonce(prefix, index):
+    return prefix + struct.pack('>I', index)
+
+
+def chunk_aad(header_digest, index):
+    return header_digest + struct.pack('>Q', index)
+
+
+def encrypt_chunk(key, nonce, aad, data):
+    cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+    cipher.update(aad)
+    ciphertext, tag = cipher.encrypt_and_digest(data)
+    return ciphertext + tag
+
+
+# Raises ValueError when the chunk or the header it belongs to was modified
+def decrypt_chunk(key, nonce, aad, blob):
+    cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+    cipher.update(aad)
+    return cipher.decrypt_and_verify(blob[:-TAG_SIZE], blob[-TAG_SIZE:])
+
+
+def _apply(args):
+    function, *function_args = args
+    return function(*function_args)
+
+
+# Results of function over tasks in order, with at most `window` chunks in flight so that
+# memory stays bounded however large the file is
+def bounded_map(tasks, workers=None, window=None):
+    workers = workers or os.cpu_count() or 1
+    window = window or 2 * workers
+    if workers == 1:
+        for task in tasks:
+            yield _apply(task)
+        return
+    with ProcessPoolExecutor(workers) as executor:
+        pending = []
+        for task in tasks:
+            pending.append(executor.submit(_apply, task))
+            if len(pending) >= window:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+def encode_header(header):
+    body = json.dumps(header, sort_keys=True).encode('utf-8')
+    return MAGIC + struct.pack('<BI', VERSION, len(body)) + body
+
+
+# True when path starts with the container magic (and not e.g. an IV-prefixed CBC file)
+def is_container(path):
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+# Plaintext sizes of the chunks of a file of `size` bytes split every chunk_size bytes
+def fixed_chunk_sizes(size, chunk_size=CHUNK_SIZE):
+    sizes = [chunk_size] * (size // chunk_size)
+    if size % chunk_size or not sizes:
+        sizes.append(size % chunk_size)
+    return sizes
+
+
+# Chunk sizes of a CSV file cut at row boundaries, and the number of rows in each chunk.
+# The header line is a chunk of its own so every data chunk parses with the same columns.
+def csv_row_chunks(path, chunk_size=CHUNK_SIZE):
+    sizes, rows = [], []
+    with open(path, 'rb') as file:
+        header = file.readline()
+        sizes.append(len(header))
+        rows.append(0)
+        carry = b''
+        while True:
+            block = file.read(chunk_size)
+            data = carry + block
+            if not block:
+                if data:
+                    # Last row without a trailing newline
+                    sizes.append(len(data))
+                    rows.append(data.count(b'\n') + (not data.endswith(b'\n')))
+                break
+            end = data.rfind(b'\n') + 1
+            if end == 0:
+                carry = data  # A row longer than chunk_size, keep reading
+                continue
+            carry = data[end:]
+            sizes.append(end)
+            rows.append(data.count(b'\n', 0, end))
+    return sizes, rows
+
+
+# Encrypt the (path, chunk_sizes) parts one after the other into a container at
+# output_path; metadata is stored (authenticated, not encrypted) in the header.
+def write_chunks(parts, output_path, key, workers=None, metadata=None):
+    key = container_key(key)
+    chunk_sizes = [size for _, sizes in parts for size in sizes]
+    prefix = get_random_bytes(8)
+    header = encode_header({'nonce_prefix': prefix.hex(), 'chunk_sizes': chunk_sizes,
+                            'metadata': metadata or {}})
+    digest = hashlib.sha256(header).digest()
+
+    def tasks():
+        index = 0
+        for input_path, sizes in parts:
+            with open(input_path, 'rb') as plain_file:
+                for size in sizes:
+                    data = plain_file.read(size)
+                    if len(data) != size:
+                        raise ValueError(f'{input_path} is shorter than its chunk index')
+                    yield encrypt_chunk, key, chunk_nonce(prefix, index), chunk_aad(digest, index), data
+                    index += 1
+
+    with open(output_path + '.tmp', 'wb') as out:
+        out.write(header)
+        for blob in bounded_map(tasks(), workers):
+            out.write(blob)
+    os.replace(output_path + '.tmp', output_path)
+    return len(chunk_sizes)
+
+
+# Encrypt input_path into a container at output_path split every chunk_size bytes
+def write_container(input_path, output_path, key, chunk_size=CHUNK_SIZE, workers=None, metadata=None):
+    chunk_sizes = fixed_chunk_sizes(os.path.getsize(input_path), chunk_size)
+    return write_chunks([(input_path, chunk_sizes)], output_path, key, workers, metadata)
+
+
+# Encrypt CSV files as members of one container, with a row index per member
+def write_csv_container(csv_paths, output_path, key, chunk_size=CHUNK_SIZE, workers=None):
+    parts, members = [], []
+    first_chunk = 0
+    for path in csv_paths:
+        sizes, rows = csv_row_chunks(path, chunk_size)
+        parts.append((path, sizes))
+        members.append({'name': os.path.basename(path), 'first_chunk': first_chunk,
+                        'row_counts': rows[1:]})
+        first_chunk += len(sizes)
+    return write_chunks(parts, output_path, key, workers, {'members': members})
+
+
+# Rows of a decrypted CSV chunk, each with its line ending
+def split_rows(data):
+    lines = [line + b'\n' for line in data.split(b'\n')]
+    lines[-1] = lines[-1][:-1]
+    return lines if lines[-1] else lines[:-1]
+
+
+class ContainerReader:
+    def __init__(self, path, key):
+        self.path = path
+        self.key = container_key(key)
+        with open(path, 'rb') as file:
+            magic, version, length = struct.unpack('<4sBI', file.read(len(MAGIC) + 5))
+            if magic != MAGIC:
+                raise ValueError(f'{path} is not a dataset container')
+            if version != VERSION:
+                raise ValueError(f'{path} has unsupported container version {version}')
+            body = file.read(length)
+        header = MAGIC + struct.pack('<BI', version, length) + body
+        self.digest = hashlib.sha256(header).digest()
+        try:
+            meta = json.loads(body)
+            self.prefix = bytes.fromhex(meta['nonce_prefix'])
+            self.chunk_sizes = meta['chunk_sizes']
+            self.metadata = meta['metadata']
+        except (ValueError, KeyError, TypeError):
+            raise ValueError(f'{path} has a corrupt container header')
+        # File offset of every chunk; the header itself is authenticated with the first chunk read
+        self.offsets = [len(header)]
+        for size in self.chunk_sizes:
+            self.offsets.append(self.offsets[-1] + size + TAG_SIZE)
+        if os.path.getsize(path) != self.offsets[-1]:
+            raise ValueError(f'{path} is truncated or has trailing data')
+
+    def __len__(self):
+        return len(self.chunk_sizes)
+
+    @property
+    def size(self):
+        return sum(self.chunk_sizes)
+
+    def _read_blob(self, file, index):
+        file.seek(self.offsets[index])
+        return file.read(self.chunk_sizes[index] + TAG_SIZE)
+
+    def _task(self, file, index):
+        return (decrypt_chunk, self.key, chunk_nonce(self.prefix, index),
+                chunk_aad(self.digest, index), self._read_blob(file, index))
+
+    # Decrypt a single chunk without touching the others
+    def read_chunk(self, index):
+        with open(self.path, 'rb') as file:
+            return _apply(self._task(file, index))
+
+    # Decrypted chunks with the given indices in order, decrypted in parallel
+    def iter_chunk_indices(self, indices, workers=None):
+        with open(self.path, 'rb') as file:
+            yield from bounded_map((self._task(file, index) for index in indices), workers)
+
+    # Decrypted chunks start..stop-1 in order
+    def iter_chunks(self, start=0, stop=None, workers=None):
+        stop = len(self) if stop is None else stop
+        return self.iter_chunk_indices(range(start, stop), workers)
+
+    # CSV members and their row indexes (empty for containers of a single file)
+    @property
+    def members(self):
+        return {member['name']: member for member in self.metadata.get('members', [])}
+
+    def n_rows(self, name):
+        return sum(self.members[name]['row_counts'])
+
+    # Header line of a CSV member
+    def csv_header(self, name):
+        return self.read_chunk(self.members[name]['first_chunk'])
+
+    # First row of every data chunk of a CSV member, plus the total row count at the end
+    def row_offsets(self, name):
+        offsets = [0]
+        for count in self.members[name]['row_counts']:
+            offsets.append(offsets[-1] + count)
+        return offsets
+
+    # CSV text (header included) of rows start..stop-1 of a member; only the chunks
+    # holding those rows are decrypted
+    def read_rows(self, name, start, stop, workers=None):
+        member = self.members[name]
+        offsets = self.row_offsets(name)
+        start, stop = max(start, 0), min(stop, offsets[-1])
+        lines = []
+        if start < stop:
+            first = bisect.bisect_right(offsets, start) - 1
+            last = bisect.bisect_left(offsets, stop)
+            indices = range(member['first_chunk'] + 1 + first, member['first_chunk'] + 1 + last)
+            chunk_lines = [line for chunk in self.iter_chunk_indices(indices, workers)
+                           for line in split_rows(chunk)]
+            lines = chunk_lines[start - offsets[first]:stop - offsets[first]]
+        return self.csv_header(name) + b''.join(lines)
+
+    # CSV text of the given rows of a member, in ascending row order
+    def read_row_numbers(self, name, row_numbers, workers=None):
+        member = self.members[name]
+        offsets = self.row_offsets(name)
+        by_chunk = {}
+        for row in sorted(set(row_numbers)):
+            if not 0 <= row < offsets[-1]:
+                raise IndexError(f'row {row} out of range for {name}')
+            by_chunk.setdefault(bisect.bisect_right(offsets, row) - 1, []).append(row)
+        indices = [member['first_chunk'] + 1 + chunk for chunk in by_chunk]
+        lines = []
+        for chunk, data in zip(by_chunk, self.iter_chunk_indices(indices, workers)):
+            chunk_lines = split_rows(data)
+            lines.extend(chunk_lines[row - offsets[chunk]] for row in by_chunk[chunk])
+        return self.csv_header(name) + b''.join(lines)
+
+
+# Decrypt a whole container into output_path; returns the decrypted size. The CSV
+# members of a container written by write_csv_container go to files in the output_path directory.
+def decrypt_container(input_path, output_path, key, workers=None):
+    reader = ContainerReader(input_path, key)
+    if not reader.members:
+        parts = [(output_path, 0, len(reader))]
+    else:
+        os.makedirs(output_path, exist_ok=True)
+        parts = [(os.path.join(output_path, name), member['first_chunk'],
+                  member['first_chunk'] + 1 + len(member['row_counts']))
+                 for name, member in reader.members.items()]
+    written = 0
+    for path, start, stop in parts:
+        with open(path, 'wb') as out:
+            for chunk in reader.iter_chunks(start, stop, workers):
+                out.write(chunk)
+                written += len(chunk)
+    return written
+
+
+def read_key(args):
+    if args.key_file:
+        with open(args.key_file, 'rb') as file:
+            return file.read().strip()
+    return args.key.encode('utf-8')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Encrypt or decrypt a chunked AES-GCM dataset container.')
+    parser.add_argument('command', choices=['encrypt', 'decrypt'])
+    parser.add_argument('input', nargs='+', help='input file (several CSV files with --csv)')
+    parser.add_argument('output')
+    key_group = parser.add_mutually_exclusive_group(required=True)
+    key_group.add_argument('--key', help='encryption key')
+    key_group.add_argument('--key-file', help='file holding the encryption key')
+    parser.add_argument('--csv', action='store_true',
+                        help='store the input CSV files as members with a row index')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: all cores)')
+    args = parser.parse_args()
+
+    if args.command == 'encrypt' and args.csv:
+        n_chunks = write_csv_container(args.input, args.output, read_key(args), args.chunk_size, args.workers)
+        print(f"Encrypted {', '.join(args.input)} into {n_chunks} chunks in {args.output}")
+    elif args.command == 'encrypt':
+        if len(args.input) != 1:
+            parser.error('several input files need --csv')
+        n_chunks = write_container(args.input[0], args.output, read_key(args), args.chunk_size, args.workers)
+        print(f'Encrypted {args.input[0]} into {n_chunks} chunks in {args.output}')
+    else:
+        if len(args.input) != 1:
+            parser.error('decrypt takes a single container')
+        size = decrypt_container(args.input[0], args.output, read_key(args), args.workers)
+        print(f'Decrypted {size} bytes into {args.output}')
@@ -1,7 +1,17 @@
+import argparse
+import io
+import os
+import sys
+
+import numpy as np
+import pandas as pd
 from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
 import base64
 
+from dataset_container import ContainerReader, decrypt_container, is_container
+from stream_extract import extract_zip_stream
+
 
 def unpad(data):
     padding_length = data[-1]
@@ -17,15 +27,79 @@ def decrypt_aes(encrypted_data, key):
     decrypted_data = cipher.decrypt(encrypted_data)
     return unpad(decrypted_data)
 
-def encrypt_aes(unencrypted_data):
+
+# Chunks are read and decrypted this many bytes at a time (a multiple of the AES block size)
+CHUNK_SIZE = 1024 * 1024
+
+
+# Decrypt an IV-prefixed AES-CBC stream chunk by chunk. The cipher object carries the CBC
+# state between chunks and the last block is held back until the end so that only the
+# final block is unpadded.
+def iter_decrypted_chunks(file, key, chunk_size=CHUNK_SIZE):
+    key = key[:32].ljust(32, b'\0')
+    iv = file.read(AES.block_size)  # Extract the IV
+    if len(iv) != AES.block_size:
+        raise ValueError('encrypted data is shorter than the IV')
+    cipher = AES.new(key, AES.MODE_CBC, iv)
+    pending = b''  # bytes read past the last whole block
+    last_block = b''
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        chunk = pending + chunk
+        aligned = len(chunk) - len(chunk) % AES.block_size
+        pending = chunk[aligned:]
+        if aligned == 0:
+            continue
+        decrypted = last_block + cipher.decrypt(chunk[:aligned])
+        last_block = decrypted[-AES.block_size:]
+        if len(decrypted) > AES.block_size:
+            yield decrypted[:-AES.block_size]
+    if pending or not last_block:
+        raise ValueError('encrypted data is not a whole number of AES blocks')
+    yield unpad(last_block)
+
+
+# Decrypt input_path into output_path in constant memory; returns the decrypted size
+def decrypt_aes_stream(input_path, output_path, key, chunk_size=CHUNK_SIZE):
+    written = 0
+    with open(input_path, 'rb') as encrypted_file, open(output_path, 'wb') as decrypted_file:
+        for chunk in iter_decrypted_chunks(encrypted_file, key, chunk_size):
+            decrypted_file.write(chunk)
+            written += len(chunk)
+    return written
+
+# PKCS#7 padding, the inverse of unpad
+def pad(data):
+    padding_length = AES.block_size - len(data) % AES.block_size
+    return data + bytes([padding_length]) * padding_length
+
+
+# IV-prefixed AES-CBC encryption in the format decrypt_aes reads (e.g. train.bin)
+def encrypt_aes(unencrypted_data, key):
     key = key[:32].ljust(32, b'\0')
-    iv = unencrypted_data[:16]  # Extract the IV
-    unencrypted_data = unencrypted_data[16:]
+    iv = get_random_bytes(AES.block_size)  # Fresh IV, stored in front of the ciphertext
     cipher = AES.new(key, AES.MODE_CBC, iv)
-    encrypted_data = cipher.encrypt(unencrypted_data)
-    return key
+    encrypted_data = cipher.encrypt(pad(unencrypted_data))
+    return iv + encrypted_data
+
 
 
+# Rows start..stop-1 of a CSV member of a dataset container as a DataFrame; only the
+# encrypted chunks holding those rows are decrypted
+def read_rows(container_path, key, member, start, stop, workers=None):
+    reader = ContainerReader(container_path, key)
+    return pd.read_csv(io.BytesIO(reader.read_rows(member, start, stop, workers)))
+
+
+# n random rows of a CSV member, decrypting only the chunks they fall in
+def sample_rows(container_path, key, member, n, seed=None, workers=None):
+    reader = ContainerReader(container_path, key)
+    n_rows = reader.n_rows(member)
+    rows = np.random.default_rng(seed).choice(n_rows, size=min(n, n_rows), replace=False)
+    return pd.read_csv(io.BytesIO(reader.read_row_numbers(member, rows, workers)))
+
 
 def read_binary_file(file_path):
     with open(file_path, 'rb') as file:
@@ -37,19 +111,64 @@ def write_binary_file(file_path, data):
 
 
 
-# Example usage
-key = b'functionremainsunchangedasitwillcorrectly'  # Your encryption key
-input_file_path = 'train.zip'  # Path to the input binary file
-encrypted_file_path = 'train.bin'  # Path to the output encrypted file
-decrypted_file_path = 'decrypted_file.zip'  # Path to the output decrypted file
-
-
-
-# Read the encrypted data from the encrypted file
-encrypted_data_from_file = read_binary_file(encrypted_file_path)
-
-# Decrypt the data and write it to the decrypted file
-decrypted_data = decrypt_aes(encrypted_data_from_file, key)
-write_binary_file(decrypted_file_path, decrypted_data)
-
-print('decryption completed successfully.')
\ No newline at end of file
+if __name__ == "__main__":
+    # Example usage
+    key = b'functionremainsunchangedasitwillcorrectly'  # Your encryption key
+    input_file_path = 'train.zip'  # Path to the input binary file
+    encrypted_file_path = 'train.bin'  # Path to the output encrypted file
+    decrypted_file_path = 'decrypted_file.zip'  # Path to the output decrypted file
+
+    parser = argparse.ArgumentParser(description='Decrypt train.bin or a chunked dataset container.')
+    parser.add_argument('--input', default=encrypted_file_path,
+                        help="encrypted file (CBC or dataset container), or '-' to read a CBC stream from stdin")
+    parser.add_argument('--output', default=decrypted_file_path, help='decrypted zip file')
+    parser.add_argument('--extract-to', metavar='DIR',
+                        help='unzip the decrypted stream straight into DIR instead of writing the zip file')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes for dataset containers (default: all cores)')
+    parser.add_argument('--member', help='CSV member of a dataset container to read rows from')
+    parser.add_argument('--rows', metavar='START:STOP', help='print only these rows of --member')
+    parser.add_argument('--sample', type=int, metavar='N', help='print N random rows of --member')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.rows or args.sample:
+        # Ad-hoc queries decrypt only the chunks they need
+        if not args.member:
+            parser.error('--rows and --sample need --member')
+        if args.rows:
+            start, stop = (int(value) for value in args.rows.split(':'))
+            print(read_rows(args.input, key, args.member, start, stop, args.workers))
+        else:
+            print(sample_rows(args.input, key, args.member, args.sample, args.seed, args.workers))
+        raise SystemExit
+
+    # Containers written by dataset_container.py are decrypted in parallel, older
+    # IV-prefixed CBC files like train.bin sequentially. A CBC stream can also come in
+    # on stdin, e.g. while it is still being uploaded.
+    from_stdin = args.input == '-'
+    container = not from_stdin and is_container(args.input)
+    if args.extract_to:
+        # Decrypted chunks go directly into the zip extractor, the archive never touches the disk
+        reader = ContainerReader(args.input, key) if container else None
+        if reader is not None and reader.members:
+            # CSV members are written out as they are
+            decrypt_container(args.input, args.extract_to, key, args.workers)
+            paths = [os.path.join(args.extract_to, name) for name in reader.members]
+        elif reader is not None:
+            paths = extract_zip_stream(reader.iter_chunks(workers=args.workers), args.extract_to)
+        else:
+            with (sys.stdin.buffer if from_stdin else open(args.input, 'rb')) as encrypted_file:
+                paths = extract_zip_stream(iter_decrypted_chunks(encrypted_file, key), args.extract_to)
+        print('Extracted ' + ', '.join(paths))
+    elif container:
+        decrypt_container(args.input, args.output, key, args.workers)
+    elif from_stdin:
+        with open(args.output, 'wb') as decrypted_file:
+            for chunk in iter_decrypted_chunks(sys.stdin.buffer, key):
+                decrypted_file.write(chunk)
+    else:
+        # Decrypt the encrypted file into the decrypted file chunk by chunk
+        decrypt_aes_stream(args.input, args.output, key)
+
+    print('decryption completed successfully.')
@@ -0,0 +1,118 @@
+#VM side of delta_sync.py. delta_sync.py sends this file's source with `python3 -c`,
+#so it must only depend on the standard library and numpy.
+#
+#    signature PATH BLOCK_SIZE          write the size of PATH and the (weak, strong) checksums of
+#                                       every block of PATH, the short last one included, to stdout
+#    patch BASIS OUT SHA256 BLOCK_SIZE  rebuild OUT from BASIS and the delta read from stdin
+#
+#The delta is a sequence of records: b'C' + (first block, block count) copies blocks of
+#BASIS, b'L' + length + data inserts literal data and b'E' ends it. OUT is written to a
+#temporary file and only replaces the old file when its SHA-256 matches.
+
+import hashlib
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+FILE_SIZE = struct.Struct('<Q')
+SIGNATURE = struct.Struct('<I16s')
+COPY = struct.Struct('<QI')
+LITERAL = struct.Struct('<I')
+
+
+# rsync style weak checksum of the window of block_size bytes starting at every position
+# of data (a uint8 array), computed for all positions at once from prefix sums
+def weak_checksums(data, block_size):
+    x = data.astype(np.int64)
+    prefix = np.zeros(len(x) + 1, dtype=np.int64)
+    np.cumsum(x, out=prefix[1:])
+    weighted = np.zeros(len(x) + 1, dtype=np.int64)
+    x *= np.arange(len(x), dtype=np.int64)
+    np.cumsum(x, out=weighted[1:])
+    # a = sum of the window, b = sum of (block_size - i) * x[start + i]
+    a = prefix[block_size:] - prefix[:-block_size]
+    b = np.arange(block_size, len(prefix), dtype=np.int64)
+    b *= a
+    b -= weighted[block_size:]
+    b += weighted[:-block_size]
+    a &= 0xFFFF
+    b &= 0xFFFF
+    b <<= 16
+    b |= a
+    return b.astype(np.uint32)
+
+
+def strong_checksum(block):
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+
+def write_signature(path, block_size, out):
+    out.write(FILE_SIZE.pack(os.path.getsize(path)))
+    with open(path, 'rb') as file:
+        while True:
+            block = file.read(block_size)
+            if not block:
+                break
+            weak = int(weak_checksums(np.frombuffer(block, dtype=np.uint8), len(block))[0])
+            out.write(SIGNATURE.pack(weak, strong_checksum(block)))
+
+
+def read_exact(stream, n):
+    data = stream.read(n)
+    if len(data) != n:
+        raise EOFError('delta stream ended unexpectedly')
+    return data
+
+
+def apply_patch(basis_path, out_path, expected_sha256, block_size, stream):
+    digest = hashlib.sha256()
+    copied = literal = 0
+    basis = open(basis_path, 'rb') if os.path.exists(basis_path) else None
+    try:
+        with open(out_path + '.delta', 'wb') as out:
+            while True:
+                kind = read_exact(stream, 1)
+                if kind == b'E':
+                    break
+                if kind == b'C':
+                    first, count = COPY.unpack(read_exact(stream, COPY.size))
+                    basis.seek(first * block_size)
+                    remaining = count * block_size
+                    while remaining > 0:
+                        data = basis.read(min(remaining, 1024 * 1024))
+                        if not data:
+                            break
+                        out.write(data)
+                        digest.update(data)
+                        copied += len(data)
+                        remaining -= len(data)
+                elif kind == b'L':
+                    (length,) = LITERAL.unpack(read_exact(stream, LITERAL.size))
+                    data = read_exact(stream, length)
+                    out.write(data)
+                    digest.update(data)
+                    literal += len(data)
+                else:
+                    raise ValueError(f'bad delta record {kind!r}')
+    finally:
+        if basis is not None:
+            basis.close()
+    if digest.hexdigest() != expected_sha256:
+        os.remove(out_path + '.delta')
+        raise ValueError('SHA-256 of the rebuilt file does not match')
+    os.replace(out_path + '.delta', out_path)
+    return {'copied_bytes': copied, 'literal_bytes': literal}
+
+
+if __name__ == "__main__":
+    command = sys.argv[1]
+    if command == 'signature':
+        write_signature(sys.argv[2], int(sys.argv[3]), sys.stdout.buffer)
+    elif command == 'patch':
+        stats = apply_patch(sys.argv[2], sys.argv[3], sys.argv[4], int(sys.argv[5]), sys.stdin.buffer)
+        print(json.dumps(stats))
+    else:
+        sys.exit(f'unknown command {command}')
@@ -0,0 +1,169 @@
+#rsync-like delta upload of a dataset to the VM.
+#
+#    python delta_sync.py train_data_ads.csv /home/DatacraftHacker/summer_hackathon/train_data_ads.csv
+#
+#The VM computes a weak (rolling) and a strong checksum for every block of its copy of
+#the file (delta_helper.py, sent along with the command). Locally the weak checksum is
+#computed for every byte offset at once with numpy, candidates are confirmed with the
+#strong checksum, and only the data between matched blocks is sent. The VM's short last
+#block can only match the end of the local file, so it is compared there. The VM rebuilds the
+#file from its old copy and that data, checks the SHA-256 and replaces the old copy, so
+#after a small daily append only the new rows cross the network.
+
+import argparse
+import hashlib
+import json
+import os
+import shlex
+import time
+
+import numpy as np
+
+from delta_helper import COPY, FILE_SIZE, LITERAL, SIGNATURE, strong_checksum, weak_checksums
+from ssh_jobs import SSHPool, run_command
+
+BLOCK_SIZE = 128 * 1024
+SEGMENT = 1024 * 1024  # Byte offsets searched per numpy pass
+SEND_SIZE = 1024 * 1024
+
+HELPER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'delta_helper.py')
+
+
+# Remote command running delta_helper.py with args
+def helper_command(*args):
+    with open(HELPER_PATH) as file:
+        source = file.read()
+    return ' '.join(['python3', '-c', shlex.quote(source)] + [shlex.quote(str(arg)) for arg in args])
+
+
+# Checksums of the whole blocks from the output of `delta_helper.py signature`: weak
+# checksum -> [(block index, strong checksum)], and (block index, length, strong checksum)
+# of the short last block or None
+def parse_signatures(output, block_size=BLOCK_SIZE):
+    (size,) = FILE_SIZE.unpack_from(output)
+    signatures = {}
+    tail = None
+    for index, (weak, strong) in enumerate(SIGNATURE.iter_unpack(output[FILE_SIZE.size:])):
+        if (index + 1) * block_size > size:
+            tail = (index, size - index * block_size, strong)
+        else:
+            signatures.setdefault(weak, []).append((index, strong))
+    return signatures, tail
+
+
+# Block checksums of remote_path as parse_signatures returns them; empty when the VM has no
+# copy yet
+def remote_signatures(pool, remote_path, block_size=BLOCK_SIZE):
+    result = run_command(pool, f'test -f {shlex.quote(remote_path)} && ' + helper_command('signature', remote_path, block_size))
+    if result['exit_status'] != 0:
+        return {}, None
+    return parse_signatures(result['stdout'], block_size)
+
+
+# Delta of local_path against the remote blocks: ('copy', first block, count) and
+# ('literal', offset, length) of local_path, in file order. tail is the remote short last
+# block (see parse_signatures).
+def compute_delta(local_path, signatures, block_size=BLOCK_SIZE, tail=None):
+    size = os.path.getsize(local_path)
+    if size == 0:
+        return []
+    data = np.memmap(local_path, dtype=np.uint8, mode='r')
+    known = np.array(sorted(signatures), dtype=np.uint32)
+    by_strong = {strong: index for blocks in signatures.values() for index, strong in blocks}
+    ops = []
+    literal_start = pos = 0
+
+    def add_match(offset, index):
+        if offset > literal_start:
+            ops.append(('literal', literal_start, offset - literal_start))
+        if ops and ops[-1][0] == 'copy' and ops[-1][1] + ops[-1][2] == index:
+            ops[-1] = ('copy', ops[-1][1], ops[-1][2] + 1)
+        else:
+            ops.append(('copy', index, 1))
+
+    last_start = size - block_size  # Last offset a whole block fits at
+    while pos <= last_start and len(known):
+        # Unchanged data continues block after block: try the next block directly
+        index = by_strong.get(strong_checksum(data[pos:pos + block_size].tobytes()))
+        if index is not None:
+            add_match(pos, index)
+            pos = literal_start = pos + block_size
+            continue
+        # Otherwise search the following offsets for the next block the VM has
+        segment_start = pos + 1
+        stop = min(segment_start + SEGMENT, last_start + 1)
+        if segment_start >= stop:
+            break
+        weak = weak_checksums(data[segment_start:stop + block_size - 1], block_size)
+        slots = np.minimum(np.searchsorted(known, weak), len(known) - 1)
+        pos = stop
+        for offset in np.nonzero(known[slots] == weak)[0] + segment_start:
+            strong = strong_checksum(data[offset:offset + block_size].tobytes())
+            index = next((index for index, candidate in signatures[int(weak[offset - segment_start])]
+                          if candidate == strong), None)
+            if index is not None:
+                add_match(offset, index)
+                pos = literal_start = offset + block_size
+                break
+    # The VM copies its short last block up to its end of file, so it only matches here
+    if tail is not None and size - literal_start >= tail[1] and \
+            strong_checksum(data[size - tail[1]:].tobytes()) == tail[2]:
+        add_match(size - tail[1], tail[0])
+        literal_start = size
+    if literal_start < size:
+        ops.append(('literal', literal_start, size - literal_start))
+    return ops
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(SEND_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Delta records for ops, reading literal data from local_path as they are sent
+def iter_delta_records(local_path, ops):
+    with open(local_path, 'rb') as file:
+        for op in ops:
+            if op[0] == 'copy':
+                yield b'C' + COPY.pack(op[1], op[2])
+                continue
+            file.seek(op[1])
+            remaining = op[2]
+            while remaining > 0:
+                data = file.read(min(remaining, SEND_SIZE))
+                yield b'L' + LITERAL.pack(len(data)) + data
+                remaining -= len(data)
+    yield b'E'
+
+
+# Bring remote_path up to date with local_path sending only what changed
+def delta_upload(pool, local_path, remote_path, block_size=BLOCK_SIZE):
+    started = time.perf_counter()
+    signatures, tail = remote_signatures(pool, remote_path, block_size)
+    ops = compute_delta(local_path, signatures, block_size, tail)
+    command = helper_command('patch', remote_path, remote_path, sha256_file(local_path), block_size)
+    result = run_command(pool, command, input_chunks=iter_delta_records(local_path, ops))
+    if result['exit_status'] != 0:
+        raise IOError(f"delta patch of {remote_path} failed: {result['stderr'].decode('utf-8', 'replace')}")
+    stats = json.loads(result['stdout'])
+    stats['bytes'] = os.path.getsize(local_path)
+    stats['remote_blocks'] = sum(len(blocks) for blocks in signatures.values()) + (tail is not None)
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Upload only the changed blocks of a file to the VM.')
+    parser.add_argument('local_path')
+    parser.add_argument('remote_path')
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE)
+    parser.add_argument('--compress', action='store_true', help='zlib compression on the SSH connection')
+    args = parser.parse_args()
+
+    with SSHPool.from_config(compress=args.compress, max_connections=1) as pool:
+        stats = delta_upload(pool, args.local_path, args.remote_path, args.block_size)
+    print(f"{stats['bytes']} bytes synced in {stats['seconds']:.1f}s: {stats['literal_bytes']} sent, "
+          f"{stats['copied_bytes']} reused from the VM's copy")
@@ -0,0 +1,199 @@
+#Figures of the analysis, drawn from precomputed aggregates.
+#Interactively every figure is drawn and shown with plt.show(). In headless mode
+#(ANALYSIS_HEADLESS=1, e.g. on the VM) they are rendered with the Agg backend to
+#FIGURE_DIR (default 'figures') in a pool of worker processes, so the pipeline keeps
+#running while figures are written. FIGURE_FORMATS picks the file types (default png,svg)
+#and FIGURE_WORKERS the pool size.
+
+import multiprocessing
+import os
+
+import numpy as np
+
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def draw_age_distribution(ages_counts):
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(10, 6))
+    plt.bar(ages_counts.index, ages_counts.values, color='skyblue')
+    plt.xlabel('Unique Value of Ages')
+    plt.ylabel('Number of Users')
+    plt.title('Distribution of Ages Among Users Who Click on Ads')
+    plt.grid(True, linestyle='--', alpha=0.6)
+    plt.xticks(ages_counts.index)  # Ensure x-axis labels are aligned correctly
+
+    # Add text annotations
+    for age, count in zip(ages_counts.index, ages_counts.values):
+        plt.text(age, count + 0.5, str(count), ha='center', va='bottom', fontsize=8)
+
+
+# Bars of the top_n values with "value\n(count)" labels (cities, device sizes)
+def draw_top_values(counts, top_n, xlabel, title, figsize):
+    import matplotlib.pyplot as plt
+
+    top = counts.head(top_n)
+    plt.figure(figsize=figsize)
+    bars = plt.bar(top.index, top.values, color='skyblue')
+    plt.xlabel(xlabel)
+    plt.ylabel('Number of Users')
+    plt.title(title)
+    plt.grid(True, linestyle='--', alpha=0.6)
+    plt.xticks(rotation=45, ha='right')  # Rotate x-axis labels for better readability
+
+    for bar, (value, count) in zip(bars, top.items()):
+        plt.text(bar.get_x() + bar.get_width() / 2, bar.get_height() + 0.5, f"{value}\n({count})", ha='center', va='bottom', fontsize=8)
+
+    plt.tight_layout()
+
+
+def draw_city_distribution(cities_counts, top_n=10):
+    draw_top_values(cities_counts, top_n, 'City Value', f'Top {top_n} Cities Among Users Who Click on Ads', (12, 6))
+
+
+def draw_devices_distribution(devices_counts, top_n=10):
+    draw_top_values(devices_counts, top_n, 'Device Size', f'Top {top_n} Devices Sizes Among Users Who Click on Ads', (15, 8))
+
+
+# Bar chart of precomputed counts in the viridis palette (what sns.barplot drew)
+def draw_count_bars(counts, xlabel, ylabel, title, labels=None, rotate=False, offset=1):
+    import matplotlib.pyplot as plt
+
+    positions = np.arange(len(counts))
+    plt.figure(figsize=(12, 6))
+    plt.bar(positions, counts.values, color=plt.cm.viridis(np.linspace(0, 1, len(counts))))
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plt.title(title)
+    plt.xticks(positions, labels if labels is not None else [str(value) for value in counts.index],
+               rotation=45 if rotate else 0, ha='right' if rotate else 'center')
+    plt.grid(True, linestyle='--', alpha=0.6)
+    for i, v in enumerate(counts.values):
+        plt.text(i, v + offset, str(v), ha='center')
+
+
+def draw_hourly_clicks(hourly_clicks):
+    draw_count_bars(hourly_clicks, 'Hour of the Day', 'Number of Ad Clicks', 'Ad Clicks by Hour of the Day')
+
+
+def draw_daily_clicks(daily_clicks):
+    draw_count_bars(daily_clicks, 'Day of the Week', 'Number of Ad Clicks', 'Ad Clicks by Day of the Week',
+                    labels=[DAY_NAMES[day] for day in daily_clicks.index])
+
+
+def draw_top_interests(top10):
+    import matplotlib.pyplot as plt
+
+    draw_count_bars(top10, 'Category', 'Count', 'Distribution of Top 10 News Category Interests', rotate=True, offset=0.5)
+    plt.tight_layout(pad=2.0)
+
+
+# Eigenvalues against principal components with the Kaiser threshold
+def draw_pca_eigenvalues(explained_variance):
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(10, 6))
+    plt.plot(range(1, len(explained_variance) + 1), explained_variance, marker='o', linestyle='-')
+    plt.axhline(y=1, color='r', linestyle='--', label='Kaiser Criterion (Eigenvalue=1)')
+    plt.title('Principal Component vs Eigenvalue with Kaiser Criterion')
+    plt.xlabel('Principal Component')
+    plt.ylabel('Eigenvalue')
+    plt.xticks(range(1, len(explained_variance) + 1))
+    plt.legend()
+    plt.grid(True)
+
+
+def draw_pca_loadings(loadings, component):
+    import matplotlib.pyplot as plt
+
+    plt.figure()
+    x = np.linspace(1, len(loadings), len(loadings))
+    plt.bar(x, loadings * -1)
+    plt.xlabel('Feature Index')
+    plt.ylabel('Loading')
+    plt.title(f'Principal Component {component} Loadings')
+
+
+def draw_latent_space(latent_x, latent_y, target):
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(10, 6))
+    scatter = plt.scatter(latent_x, latent_y, c=target, cmap='viridis', s=10)
+    plt.legend(*scatter.legend_elements(), title='target')
+    plt.xlabel('Latent Dimension 1')
+    plt.ylabel('Latent Dimension 2')
+    plt.title('Latent Space Representation')
+
+
+FIGURES = {
+    'age_distribution': draw_age_distribution,
+    'city_distribution': draw_city_distribution,
+    'devices_distribution': draw_devices_distribution,
+    'hourly_clicks': draw_hourly_clicks,
+    'daily_clicks': draw_daily_clicks,
+    'top_interests': draw_top_interests,
+    'pca_eigenvalues': draw_pca_eigenvalues,
+    'pca_loadings': draw_pca_loadings,
+    'latent_space': draw_latent_space,
+}
+
+
+# Worker side: draw one figure with the Agg backend and save it in every format
+def render_figure(kind, name, data, out_dir, formats):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    FIGURES[kind](**data)
+    paths = []
+    for fmt in formats:
+        path = os.path.join(out_dir, f"{name}.{fmt}")
+        plt.savefig(path, bbox_inches='tight')
+        paths.append(path)
+    plt.close('all')
+    return paths
+
+
+class FigureRenderer:
+    def __init__(self, headless=False, out_dir='figures', formats=('png', 'svg'), workers=None):
+        self.headless = headless
+        self.out_dir = out_dir
+        self.formats = tuple(formats)
+        self.pending = []
+        self.pool = None
+        if headless:
+            import matplotlib
+            matplotlib.use('Agg')
+            os.makedirs(out_dir, exist_ok=True)
+            # All workers are forked up front, before torch and friends are imported
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+            self.pool = context.Pool(workers or min(4, os.cpu_count() or 1))
+
+    @classmethod
+    def from_env(cls):
+        return cls(headless=os.environ.get('ANALYSIS_HEADLESS') == '1',
+                   out_dir=os.environ.get('FIGURE_DIR', 'figures'),
+                   formats=os.environ.get('FIGURE_FORMATS', 'png,svg').split(','),
+                   workers=int(os.environ['FIGURE_WORKERS']) if 'FIGURE_WORKERS' in os.environ else None)
+
+    # Draw and show the figure, or queue it for rendering to files in headless mode
+    def show(self, kind, name=None, **data):
+        if not self.headless:
+            import matplotlib.pyplot as plt
+            FIGURES[kind](**data)
+            plt.show()
+            return
+        self.pending.append(self.pool.apply_async(render_figure, (kind, name or kind, data, self.out_dir, self.formats)))
+
+    # Wait for queued figures; returns the written file paths
+    def close(self):
+        if self.pool is None:
+            return []
+        paths = [path for result in self.pending for path in result.get()]
+        self.pool.close()
+        self.pool.join()
+        self.pool = None
+        self.pending = []
+        return paths
@@ -0,0 +1,149 @@
+#Incremental ingest of the daily ads/feeds exports.
+#Rows are stored as one CSV per dataset and pt_d (feeds: e_et) date under the store directory. An ingest
+#run only parses the export files it is given, writes the dates that are not in the
+#manifest yet and folds just those rows into the aggregate counts and the per-user
+#feature table (which holds the user overlap flags), so a nightly run costs time
+#proportional to the new data rather than the whole history.
+#
+#    python ingest.py --ads exports/ads_20220610.csv --feeds exports/feeds_20220610.csv
+#
+#Ingested partitions are immutable: rows for a date that is already in the manifest are
+#skipped and reported.
+
+import argparse
+import json
+import os
+
+import pandas as pd
+
+from pipeline_stages import iter_optimized_chunks
+from user_features import ADS_FEATURE_COLUMNS, INTEREST_COLUMNS, count_interests, open_user_feature_table, update_user_feature_table
+
+STORE_DIR = 'data_store'
+MANIFEST_FILE = 'manifest.json'
+USER_TABLE_DIR = 'user_feature_table'
+
+# Columns the per-user table needs from each dataset
+DATASET_COLUMNS = {
+    'ads': ['user_id', 'pt_d'] + ADS_FEATURE_COLUMNS,
+    'feeds': ['u_userId'] + INTEREST_COLUMNS,
+}
+
+
+# Timestamp columns (YYYYMMDDHHMM) rows are partitioned by, in order of preference; the
+# feeds export carries its event time in e_et
+PARTITION_COLUMNS = ['pt_d', 'e_et']
+
+
+def partition_path(store_dir, dataset, date):
+    return os.path.join(store_dir, dataset, f"pt_d={date}.csv")
+
+
+def load_manifest(store_dir):
+    manifest_path = os.path.join(store_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {'partitions': {'ads': {}, 'feeds': {}}, 'interest_counts': {}}
+    with open(manifest_path) as file:
+        return json.load(file)
+
+
+def save_manifest(store_dir, manifest):
+    manifest_path = os.path.join(store_dir, MANIFEST_FILE)
+    with open(manifest_path + '.tmp', 'w') as file:
+        json.dump(manifest, file)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+# Partition files of every ingested date, oldest first
+def partition_files(store_dir, manifest):
+    return [partition_path(store_dir, dataset, date) for dataset in ('ads', 'feeds') for date in sorted(manifest['partitions'][dataset])]
+
+
+# Parse export files and write the rows of dates that are not ingested yet into their
+# partitions; returns the new rows and the row count of every new partition
+def write_new_partitions(store_dir, dataset, file_paths, known_dates, chunk_size=100000):
+    os.makedirs(os.path.join(store_dir, dataset), exist_ok=True)
+    written = {}
+    new_rows = []
+    skipped = 0
+    for file_path in file_paths:
+        for chunk in iter_optimized_chunks(file_path, chunk_size):
+            time_columns = [col for col in PARTITION_COLUMNS if col in chunk.columns]
+            if not time_columns:
+                raise ValueError(f"{file_path} has none of the columns {PARTITION_COLUMNS} to partition by")
+            dates = chunk[time_columns[0]].astype(str).str[:8]
+            new = ~dates.isin(known_dates)
+            skipped += int((~new).sum())
+            chunk, dates = chunk[new], dates[new]
+            for date, rows in chunk.groupby(dates):
+                # The first write in a run truncates leftovers of an interrupted run
+                first = date not in written
+                rows.to_csv(partition_path(store_dir, dataset, date), mode='w' if first else 'a', header=first, index=False)
+                written[date] = written.get(date, 0) + len(rows)
+            new_rows.append(chunk[DATASET_COLUMNS[dataset]])
+    if skipped:
+        print(f"Skipped {skipped} {dataset} rows of already ingested dates")
+    if not new_rows:
+        return pd.DataFrame(columns=DATASET_COLUMNS[dataset]), written
+    return pd.concat(new_rows, ignore_index=True), written
+
+
+def ingest(store_dir=STORE_DIR, ads_files=(), feeds_files=(), chunk_size=100000):
+    manifest = load_manifest(store_dir)
+    df_ads, new_ads = write_new_partitions(store_dir, 'ads', ads_files, set(manifest['partitions']['ads']), chunk_size)
+    df_feeds, new_feeds = write_new_partitions(store_dir, 'feeds', feeds_files, set(manifest['partitions']['feeds']), chunk_size)
+    if not new_ads and not new_feeds:
+        print("No new partitions to ingest.")
+        return manifest
+
+    manifest['partitions']['ads'].update(new_ads)
+    manifest['partitions']['feeds'].update(new_feeds)
+    sources = partition_files(store_dir, manifest)
+
+    # The table records the partitions it was built from, so a run that crashed after
+    # updating the table but before saving the manifest does not add the rows twice
+    table_dir = os.path.join(store_dir, USER_TABLE_DIR)
+    table = open_user_feature_table(table_dir)
+    if table is None or not {os.path.abspath(p) for p in sources} <= {s['path'] for s in table.sources}:
+        del table
+        update_user_feature_table(table_dir, df_ads, df_feeds, sources)
+
+    interest_counts = pd.Series(manifest['interest_counts'], dtype='int64').add(count_interests(df_feeds), fill_value=0)
+    manifest['interest_counts'] = {str(category): int(count) for category, count in interest_counts.items()}
+    save_manifest(store_dir, manifest)
+
+    print(f"Ingested {len(new_ads)} ads partitions ({len(df_ads)} rows) and {len(new_feeds)} feeds partitions ({len(df_feeds)} rows)")
+    return manifest
+
+
+# Aggregates and per-user table of an existing store, or None if nothing was ingested yet
+def open_store(store_dir=STORE_DIR):
+    if not os.path.exists(os.path.join(store_dir, MANIFEST_FILE)):
+        return None
+    manifest = load_manifest(store_dir)
+    user_table = open_user_feature_table(os.path.join(store_dir, USER_TABLE_DIR))
+    if user_table is None:
+        return None
+    interest_counts = pd.Series(manifest['interest_counts'], dtype='int64').sort_values(ascending=False)
+    return {'manifest': manifest, 'user_table': user_table, 'interest_counts': interest_counts}
+
+
+# Rows of the stored partitions, optionally limited to a date range (YYYYMMDD, inclusive)
+def load_partitions(store_dir, dataset, start=None, end=None):
+    manifest = load_manifest(store_dir)
+    dates = [d for d in sorted(manifest['partitions'][dataset]) if (start is None or d >= start) and (end is None or d <= end)]
+    frames = [pd.read_csv(partition_path(store_dir, dataset, date)) for date in dates]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Ingest new ads/feeds exports into the partitioned store.')
+    parser.add_argument('--store', default=STORE_DIR, help='store directory')
+    parser.add_argument('--ads', nargs='*', default=[], help='ads export CSV files')
+    parser.add_argument('--feeds', nargs='*', default=[], help='feeds export CSV files')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='rows parsed per chunk')
+    args = parser.parse_args()
+
+    ingest(args.store, args.ads, args.feeds, args.chunk_size)
@@ -0,0 +1,187 @@
+#Upload -> decrypt -> analyze -> download on the VM with the stages overlapped.
+#
+#    python orchestrator.py --data train.bin --results-dir results
+#
+#The encrypted dataset is streamed over the SSH channel straight into `decrypt.py --input -`
+#on the VM, so decryption and unzipping run while the upload is still in progress. While
+#the analysis runs headless, its output files (results, profile, figures) are polled and
+#each one is downloaded as soon as it stops changing; a last sweep after the analysis
+#exits picks up the rest. paramiko calls run in executor threads under asyncio. Every
+#stage start/end, download and streamed analysis event (see result_stream.py) is appended
+#to a JSON-lines timeline.
+
+import argparse
+import asyncio
+import json
+import os
+import posixpath
+import shlex
+import stat
+import sys
+import time
+from contextlib import asynccontextmanager
+from functools import partial
+
+from paramikodatapuller import local_data_file
+from result_stream import run_streaming
+from sftp_transfer import open_sftp
+from ssh_jobs import SSHPool, LinePrinter, run_command
+
+REMOTE_DIR = '/home/DatacraftHacker/summer_hackathon'
+RESULT_PATHS = ['Task2RunResults.txt', 'Task2RunProfile.json', 'figures']
+TIMELINE_FILE = 'orchestrator_timeline.jsonl'
+POLL_SECONDS = 2.0
+SEND_SIZE = 1024 * 1024
+
+
+class Timeline:
+    def __init__(self, path=TIMELINE_FILE):
+        self.path = path
+        self.started = time.time()
+        self.file = open(path, 'a')
+
+    def record(self, stage, event, **fields):
+        entry = {'time': time.time(), 'elapsed': round(time.time() - self.started, 3), 'stage': stage, 'event': event}
+        entry.update(fields)
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+
+    @asynccontextmanager
+    async def stage(self, name, **fields):
+        started = time.perf_counter()
+        self.record(name, 'start', **fields)
+        try:
+            yield
+        except BaseException as error:
+            self.record(name, 'error', seconds=round(time.perf_counter() - started, 3), error=repr(error))
+            raise
+        self.record(name, 'end', seconds=round(time.perf_counter() - started, 3))
+
+    def close(self):
+        self.file.close()
+
+
+async def in_thread(function, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(None, partial(function, *args, **kwargs))
+
+
+def file_chunks(path):
+    with open(path, 'rb') as file:
+        yield from iter(lambda: file.read(SEND_SIZE), b'')
+
+
+# (size, mtime) of the files at the remote paths; directories are listed one level deep
+def remote_files(sftp, remote_dir, paths):
+    files = {}
+    for path in paths:
+        full_path = posixpath.join(remote_dir, path)
+        try:
+            attrs = sftp.stat(full_path)
+        except IOError:
+            continue
+        if stat.S_ISDIR(attrs.st_mode):
+            for entry in sftp.listdir_attr(full_path):
+                if stat.S_ISREG(entry.st_mode):
+                    files[posixpath.join(path, entry.filename)] = (entry.st_size, entry.st_mtime)
+        else:
+            files[path] = (attrs.st_size, attrs.st_mtime)
+    return files
+
+
+def download_file(sftp, remote_path, local_path):
+    os.makedirs(os.path.dirname(local_path) or '.', exist_ok=True)
+    sftp.get(remote_path, local_path + '.part')
+    os.replace(local_path + '.part', local_path)
+
+
+# Download result files while the analysis runs: a new or changed file is fetched once
+# it looks the same on two polls in a row, everything left once `finished` is set.
+# baseline holds the files from before the run, which are not downloaded again.
+async def watch_downloads(pool, remote_dir, paths, local_dir, timeline, finished, baseline):
+    sftp = await in_thread(open_sftp, pool)
+    downloaded = dict(baseline)
+    last_poll = {}
+    try:
+        while True:
+            final = finished.is_set()
+            current = await in_thread(remote_files, sftp, remote_dir, paths)
+            for path, attrs in sorted(current.items()):
+                if downloaded.get(path) == attrs or not (final or last_poll.get(path) == attrs):
+                    continue
+                started = time.perf_counter()
+                await in_thread(download_file, sftp, posixpath.join(remote_dir, path), os.path.join(local_dir, path))
+                downloaded[path] = attrs
+                timeline.record('download', 'file', path=path, bytes=attrs[0],
+                                seconds=round(time.perf_counter() - started, 3), during_analysis=not final)
+            last_poll = current
+            if final:
+                return sorted(path for path in downloaded if baseline.get(path) != downloaded[path])
+            try:
+                await asyncio.wait_for(finished.wait(), POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        sftp.close()
+
+
+# Streamed analysis events go to the timeline as they arrive
+def record_event(timeline, event):
+    fields = {key: value for key, value in event.items() if key not in ('kind', 'time', 'stage')}
+    timeline.record('analysis', event['kind'], analysis_stage=event.get('stage', event.get('name')), **fields)
+
+
+async def orchestrate(pool, data_path, remote_dir, script, extract_to, result_paths, local_dir, timeline):
+    sftp = await in_thread(open_sftp, pool)
+    try:
+        baseline = await in_thread(remote_files, sftp, remote_dir, result_paths)
+    finally:
+        sftp.close()
+
+    # Upload and decryption overlap: the file is piped into the remote decryptor
+    decrypt_command = (f'cd {shlex.quote(remote_dir)} && python3 decrypt.py --input - '
+                       f'--extract-to {shlex.quote(extract_to)}')
+    async with timeline.stage('upload_decrypt', bytes=os.path.getsize(data_path)):
+        printer = LinePrinter('decrypt')
+        result = await in_thread(run_command, pool, decrypt_command, printer, input_chunks=file_chunks(data_path))
+        printer.flush()
+        if result['exit_status'] != 0:
+            raise RuntimeError(f"decrypt.py failed with exit status {result['exit_status']}")
+
+    # Results are downloaded while the analysis is still running
+    finished = asyncio.Event()
+    watcher = asyncio.create_task(watch_downloads(pool, remote_dir, result_paths, local_dir, timeline,
+                                                  finished, baseline))
+    try:
+        async with timeline.stage('analysis'):
+            analysis_command = f'cd {shlex.quote(remote_dir)} && ANALYSIS_HEADLESS=1 python3 {shlex.quote(script)}'
+            result, _ = await in_thread(run_streaming, pool, analysis_command, on_event=partial(record_event, timeline))
+    finally:
+        finished.set()
+        async with timeline.stage('download_remaining'):
+            downloaded = await watcher
+    if result['exit_status'] != 0:
+        raise RuntimeError(f"{script} failed with exit status {result['exit_status']}")
+    return downloaded
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Upload, decrypt, analyze and download with overlapping stages.')
+    parser.add_argument('--data', default=local_data_file, help='local encrypted dataset (CBC, e.g. train.bin)')
+    parser.add_argument('--remote-dir', default=REMOTE_DIR)
+    parser.add_argument('--script', default='Data_analysis.py', help='analysis script in --remote-dir')
+    parser.add_argument('--extract-to', default='.', help='directory in --remote-dir the CSVs are unzipped to')
+    parser.add_argument('--results', nargs='+', default=RESULT_PATHS, help='result files/directories in --remote-dir')
+    parser.add_argument('--results-dir', default='results', help='local directory for the results')
+    parser.add_argument('--timeline', default=TIMELINE_FILE)
+    args = parser.parse_args()
+
+    timeline = Timeline(args.timeline)
+    with SSHPool.from_config(max_connections=2) as pool:
+        try:
+            paths = asyncio.run(orchestrate(pool, args.data, args.remote_dir, args.script, args.extract_to,
+                                            args.results, args.results_dir, timeline))
+        except RuntimeError as error:
+            sys.exit(str(error))
+        finally:
+            timeline.close()
+    print(f"Downloaded {', '.join(paths) or 'nothing'} to {args.results_dir}; timeline in {args.timeline}")
@@ -18,15 +18,16 @@ remote_data_file = 'path_to_remote_data_file' # this is where you want the datas
 remote_python_script = 'path_to_remote_python_script' # this is Jia's script on the VM
 remote_output_file = 'path_to_remote_output_file' # this is the the path to Jia's output result file
 local_output_file = 'path_to_local_output_file' # this is where the file ends up on your computer
+use_delta_sync = False # when the VM already has an older copy of the dataset, only send the changed blocks
 
 # ##############################################################
 
-def ssh_connect(hostname, port, username, ssh_key_path):
-    # Establish SSH connection using a PPK key.
+def ssh_connect(hostname, port, username, ssh_key_path, compress=False):
+    # Establish SSH connection using a PPK key; compress turns on zlib compression of the connection.
     k = paramiko.RSAKey.from_private_key_file(filename=ssh_key_path)
     ssh = paramiko.SSHClient()
     ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh.connect(hostname, port, username, pkey=k)
+    ssh.connect(hostname, port, username, pkey=k, compress=compress)
     return ssh
 
 def upload_file(sftp, local_path, remote_path):
@@ -44,32 +45,36 @@ def execute_command(ssh, command):
 
 # Main execution
 if __name__ == "__main__":
-    # Connect to the VM
-    ssh = ssh_connect(hostname, port, username, ssh_key_path)
-    sftp = ssh.open_sftp()
-
-    # Upload the data file
-    upload_file(sftp, local_data_file, remote_data_file)
-
-    # Decrypt data
-    stdout, stderr = execute_command(ssh, f'python3 /home/DatacraftHacker/summer_hackathon/decrypt.py')
-    if stderr:
-        print(f"Error: {stderr.decode('utf-8')}")
+    from ssh_jobs import SSHPool, LinePrinter, run_command
+    from sftp_transfer import upload, download
+    from delta_sync import delta_upload
+    from result_stream import run_streaming
+
+    # Connect to the VM; the connection is reused for the transfers and both commands
+    pool = SSHPool.from_config(max_connections=1)
+
+    # Upload the data file in parallel ranges, resuming an interrupted upload,
+    # or only the blocks that changed since the last upload
+    if use_delta_sync:
+        delta_upload(pool, local_data_file, remote_data_file)
     else:
-        print(f"Output: {stdout.decode('utf-8')}")
+        upload(pool, local_data_file, remote_data_file)
 
-    # Execute the analysis script
-    stdout, stderr = execute_command(ssh, f'python3 {remote_python_script}')
-    if stderr:
-        print(f"Error: {stderr.decode('utf-8')}")
-    else:
-        print(f"Output: {stdout.decode('utf-8')}")
+    # Decrypt data, printing its output as it arrives
+    printer = LinePrinter('decrypt')
+    result = run_command(pool, 'python3 /home/DatacraftHacker/summer_hackathon/decrypt.py', printer)
+    printer.flush()
+    print(f"decrypt finished with exit status {result['exit_status']} in {result['latency_seconds']:.1f}s")
+
+    # Execute the analysis script, showing each stage and model result as soon as it is reported
+    result, stream = run_streaming(pool, f'python3 {remote_python_script}')
+    print(f"analysis finished with exit status {result['exit_status']} in {result['latency_seconds']:.1f}s, "
+          f"{len(stream.results())} results received")
 
     # Download the generated data file
-    download_file(sftp, remote_output_file, local_output_file)
+    download(pool, remote_output_file, local_output_file)
 
     # Close the connections
-    sftp.close()
-    ssh.close()
+    pool.close()
 
     print("Operation completed successfully.")
@@ -0,0 +1,154 @@
+#Reusable pieces of the Data_analysis.py pipeline, importable without running the analysis
+
+import importlib
+
+import numpy as np
+import pandas as pd
+
+# Stages of Data_analysis.py that ANALYSIS_STAGES can pick (default: all). Loading the data
+# and building the user feature table always run; ppca works on the data the pca stage
+# prepared, so it brings pca along.
+ANALYSIS_STAGES = ('plots', 'logistic', 'pca', 'ppca', 'vae')
+STAGE_REQUIRES = {'ppca': ['pca']}
+# Stages that draw figures; without them no renderer (matplotlib, worker pool) is started
+FIGURE_STAGES = {'plots', 'pca', 'vae'}
+
+# Heavy modules each stage imports when it runs, 'load' being what the script imports at
+# startup (the figures import matplotlib when they are drawn); used to time the imports
+STAGE_MODULES = {
+    'load': ['pandas', 'ingest', 'stage_profiler', 'user_features', 'figures'],
+    'plots': [],
+    'logistic': ['sklearn.model_selection', 'sklearn.metrics', 'sklearn.linear_model', 'sklearn.preprocessing',
+                 'imblearn.over_sampling'],
+    'pca': ['sklearn.metrics', 'sklearn.preprocessing', 'sklearn.decomposition', 'scipy.stats'],
+    'ppca': [],
+    'vae': ['sklearn.preprocessing', 'sklearn.metrics', 'sklearn.mixture', 'torch', 'torch.utils.data'],
+}
+
+# Set of stages to run from a comma separated list such as 'plots,logistic'; None or 'all'
+# for every stage
+def selected_stages(value=None):
+    if value is None or value.strip().lower() == 'all':
+        return set(ANALYSIS_STAGES)
+    stages = {stage.strip().lower() for stage in value.split(',') if stage.strip()}
+    unknown = stages - set(ANALYSIS_STAGES)
+    if unknown:
+        raise ValueError(f"unknown analysis stages {', '.join(sorted(unknown))} (choose from {', '.join(ANALYSIS_STAGES)})")
+    for stage in list(stages):
+        stages.update(STAGE_REQUIRES.get(stage, []))
+    return stages
+
+# Import the modules of stages (and of the startup); returns their names
+def import_stage_modules(stages):
+    names = []
+    for stage in ['load'] + [stage for stage in ANALYSIS_STAGES if stage in stages]:
+        for name in STAGE_MODULES[stage]:
+            if name not in names:
+                importlib.import_module(name)
+                names.append(name)
+    return names
+
+# Function to optimize data types
+def optimize_types(df):
+    for col in df.select_dtypes(include=['int64', 'float64']).columns:
+        if pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast='signed')  # downcast to int32
+        else:
+            df[col] = pd.to_numeric(df[col], downcast='float')  # downcast to float32
+    return df
+
+# Optimized chunks of a CSV file, NA rows dropped
+def iter_optimized_chunks(file_path, chunk_size=1000):
+    for chunk in pd.read_csv(file_path, chunksize=chunk_size):
+        chunk = chunk.dropna()  # Drop NA in chunks
+        yield optimize_types(chunk)
+
+# Optimizing and loading dataset in chunks
+def load_and_optimize_csv(file_path, chunk_size=1000):
+    chunks = list(iter_optimized_chunks(file_path, chunk_size))
+    df = pd.concat(chunks, ignore_index=True)
+    return df
+
+# Category codes for object columns, floats for the rest (logistic model encoding)
+def encode_categories(X):
+    X = X.copy()
+    for col in X.columns:
+        if X[col].dtype == 'object':
+            X[col] = X[col].astype('category').cat.codes
+        else:
+            X[col] = X[col].astype(float)
+    return X
+
+# Train/test split, SMOTE on the training part, standardize and fit the logistic model
+def train_logistic(X, y, random_state=42):
+    from sklearn.model_selection import train_test_split
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.linear_model import LogisticRegression
+    from imblearn.over_sampling import SMOTE
+
+    # split data into training and testting data
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, stratify=y, random_state=random_state)
+
+    # smote for class imbalance in training
+    sm = SMOTE(random_state=random_state)
+    X_train, y_train = sm.fit_resample(X_train, y_train)
+
+    # standardize
+    scaler = StandardScaler()
+    X_train = scaler.fit_transform(X_train)
+    X_test = scaler.transform(X_test)
+
+    model = LogisticRegression(max_iter=500, solver='lbfgs', random_state=random_state)
+    model.fit(X_train, y_train)
+    return model, X_train, X_test, y_train, y_test
+
+# z-score the data and fit a full PCA
+def fit_pca(numeric_final):
+    from sklearn.decomposition import PCA
+    from scipy import stats
+
+    zscoredData = stats.zscore(numeric_final)
+    pca = PCA()
+    pca.fit(zscoredData)
+    return pca, zscoredData
+
+# Maximum likelihood PPCA with q latent dimensions
+def fit_ppca(data, q=1):
+    d = data.shape[1]
+    mu_ml = np.mean(data, axis=0)
+    data_cov = np.cov(data, rowvar=False)
+
+    lambdas, eigenvecs = np.linalg.eig(data_cov)
+    idx = lambdas.argsort()[::-1]
+    lambdas = lambdas[idx]
+    eigenvecs = - eigenvecs[:, idx]
+
+    # MLE of the noise variance and the weight matrix
+    var_ml = (1.0 / (d - q)) * sum([lambdas[j] for j in range(q, d)])
+    uq = eigenvecs[:, :q]
+    lambdaq = np.diag(lambdas[:q])
+    weight_ml = uq * np.sqrt(lambdaq - var_ml * np.eye(q))
+    return {'mu_ml': mu_ml, 'data_cov': data_cov, 'lambdas': lambdas, 'eigenvecs': eigenvecs,
+            'var_ml': var_ml, 'uq': uq, 'lambdaq': lambdaq, 'weight_ml': weight_ml}
+
+#Sampling hidden units?
+def sample_hidden_given_visible(weight_ml, mu_ml, var_ml, visible_samples):
+    q = weight_ml.shape[1]
+    m = np.transpose(weight_ml) @ weight_ml + var_ml * np.eye(q)
+    cov = var_ml * np.linalg.inv(m)
+    act_hidden = []
+    for data_visible in visible_samples:
+        mean = np.linalg.inv(m) @ np.transpose(weight_ml) @ (data_visible - mu_ml)
+        sample = np.random.multivariate_normal(mean, cov, size=1)
+        act_hidden.append(sample[0])
+    return np.array(act_hidden)
+
+def sample_visible_given_hidden(weight_ml, mu_ml, var_ml, hidden_samples):
+    d = weight_ml.shape[0]
+    act_visible = []
+    for data_hidden in hidden_samples:
+        mean = weight_ml @ data_hidden + mu_ml
+        cov = var_ml * np.eye(d)
+        sample = np.random.multivariate_normal(mean, cov, size=1)
+        act_visible.append(sample[0])
+    return np.array(act_visible)
@@ -0,0 +1,165 @@
+#Follow the analysis on the VM stage by stage.
+#
+#    python result_stream.py --stop-after logistic.evaluate
+#
+#The analysis runs with STREAM_RESULTS=1, so StageProfiler prints a JSON line (starting
+#with STREAM_PREFIX) whenever a stage starts or finishes and for every partial result
+#(model metrics, training progress). ResultStream picks these lines out of the SSH output
+#as they arrive and shows them, passing the rest of the output through. A run can be
+#aborted early: after a given stage (--stop-after), when a stage takes too long
+#(--max-stage-seconds), from an on_event callback or with Ctrl-C. Aborting kills the
+#remote process group, which the wrapper command reports on its first output line.
+
+import argparse
+import json
+import shlex
+import sys
+import threading
+
+from stage_profiler import STREAM_PREFIX
+from ssh_jobs import SSHPool, LinePrinter, StopCommand, run_command
+
+PID_PREFIX = '@@pid '
+REMOTE_DIR = '/home/DatacraftHacker/summer_hackathon'
+
+
+# Wrap a remote shell command so it reports its process group and streams results
+def streaming_command(command):
+    return f'echo "{PID_PREFIX}$$"; export STREAM_RESULTS=1 PYTHONUNBUFFERED=1; {command}'
+
+
+# Short one-line rendering of an event
+def describe_event(event):
+    kind = event.get('kind')
+    if kind == 'start':
+        return f"started {event['stage']}"
+    if kind == 'stage':
+        rows = '' if event.get('rows') is None else f", {event['rows']} rows"
+        return f"finished {event['name']} in {event['wall_seconds']:.2f}s{rows}, peak RSS {event.get('peak_rss_mb') or 0:.0f} MB"
+    fields = {key: value for key, value in event.items() if key not in ('kind', 'time', 'stage')}
+    values = ', '.join(f'{key}={value:.4g}' if isinstance(value, float) else f'{key}={value}'
+                       for key, value in fields.items() if not isinstance(value, list))
+    return f"{kind} {event.get('stage', '')}: {values}".rstrip(': ')
+
+
+class ResultStream:
+    # on_event(event) is called for every event and may return True to abort the run
+    def __init__(self, pool, name='analysis', on_event=None, stop_after=None, max_stage_seconds=None):
+        self.pool = pool
+        self.printer = LinePrinter(name)
+        self.name = name
+        self.on_event = on_event
+        self.stop_after = stop_after
+        self.max_stage_seconds = max_stage_seconds
+        self.events = []
+        self.pid = None
+        self.partial = b''
+        self.watchdog = None
+        self.aborted = None
+
+    # Output callback for run_command
+    def __call__(self, stream, data):
+        if stream != 'stdout':
+            self.printer(stream, data)
+            return
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        for line in lines:
+            self.handle_line(line.decode('utf-8', 'replace'))
+
+    def handle_line(self, line):
+        if line.startswith(PID_PREFIX):
+            self.pid = int(line[len(PID_PREFIX):])
+            return
+        if not line.startswith(STREAM_PREFIX):
+            self.printer('stdout', line.encode('utf-8') + b'\n')
+            return
+        event = json.loads(line[len(STREAM_PREFIX):])
+        self.events.append(event)
+        print(f"[{self.name}] >> {describe_event(event)}", flush=True)
+        if event.get('kind') == 'start':
+            self.start_watchdog(event['stage'])
+        elif event.get('kind') == 'stage':
+            self.cancel_watchdog()
+        reason = None
+        if self.on_event is not None and self.on_event(event):
+            reason = 'on_event'
+        elif event.get('kind') == 'stage' and event.get('name') == self.stop_after:
+            reason = f'stop after {self.stop_after}'
+        if reason is not None:
+            self.abort(reason)
+            raise StopCommand(reason)
+
+    def start_watchdog(self, stage):
+        self.cancel_watchdog()
+        if self.max_stage_seconds is not None:
+            self.watchdog = threading.Timer(self.max_stage_seconds, self.abort,
+                                            (f'{stage} ran longer than {self.max_stage_seconds}s',))
+            self.watchdog.daemon = True
+            self.watchdog.start()
+
+    def cancel_watchdog(self):
+        if self.watchdog is not None:
+            self.watchdog.cancel()
+            self.watchdog = None
+
+    # Kill the remote process group; the command then ends and run_command returns
+    def abort(self, reason):
+        if self.aborted is not None:
+            return
+        self.aborted = reason
+        self.cancel_watchdog()
+        print(f"[{self.name}] aborting: {reason}", file=sys.stderr, flush=True)
+        if self.pid is not None:
+            run_command(self.pool, f'kill -TERM -{self.pid} 2>/dev/null || kill -TERM {self.pid}')
+
+    def flush(self):
+        self.cancel_watchdog()
+        if self.partial:
+            self.handle_line(self.partial.decode('utf-8', 'replace'))
+            self.partial = b''
+        self.printer.flush()
+
+    # Events of one kind, e.g. results('result') for the model metrics received so far
+    def results(self, kind='result'):
+        return [event for event in self.events if event.get('kind') == kind]
+
+
+# Run command on the VM following its streamed results; returns (run_command result, stream).
+# When it has not finished after timeout seconds its process group is killed and
+# TimeoutError raised.
+def run_streaming(pool, command, timeout=None, **kwargs):
+    stream = ResultStream(pool, **kwargs)
+    try:
+        result = run_command(pool, streaming_command(command), stream, timeout)
+    except KeyboardInterrupt:
+        stream.abort('interrupted')
+        raise
+    except TimeoutError:
+        stream.abort(f'no exit within {timeout}s')
+        raise
+    stream.flush()
+    return result, stream
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the analysis on the VM and follow its results as they arrive.')
+    parser.add_argument('--remote-dir', default=REMOTE_DIR)
+    parser.add_argument('--script', default='Data_analysis.py')
+    parser.add_argument('--stop-after', metavar='STAGE', help='abort once this stage has finished, e.g. logistic.evaluate')
+    parser.add_argument('--max-stage-seconds', type=float, default=None, help='abort when a stage runs longer')
+    parser.add_argument('--results-file', default=None, help='also write the received events as JSON lines')
+    args = parser.parse_args()
+
+    command = f'cd {shlex.quote(args.remote_dir)} && ANALYSIS_HEADLESS=1 python3 {shlex.quote(args.script)}'
+    with SSHPool.from_config(max_connections=1) as pool:
+        result, stream = run_streaming(pool, command, stop_after=args.stop_after,
+                                       max_stage_seconds=args.max_stage_seconds)
+    if args.results_file:
+        with open(args.results_file, 'w') as file:
+            for event in stream.events:
+                file.write(json.dumps(event) + '\n')
+    if stream.aborted:
+        print(f"Run aborted ({stream.aborted}) after {len(stream.results('stage'))} stages")
+    else:
+        print(f"Run finished with exit status {result['exit_status']}, {len(stream.results())} results received")
@@ -0,0 +1,235 @@
+#Resumable parallel SFTP transfers for the datasets and results.
+#
+#    python sftp_transfer.py put train.bin /home/DatacraftHacker/summer_hackathon/train.bin
+#    python sftp_transfer.py get /home/DatacraftHacker/summer_hackathon/Task2RunResults.txt Task2RunResults.txt
+#
+#Files are split into ranges that are transferred concurrently, each over its own SFTP
+#channel with a large window, into a '.part' file that is renamed once complete. Finished
+#ranges and their SHA-256 are recorded in a state file next to the local file, so an
+#interrupted transfer resumes where it stopped; the ranges already written are re-hashed
+#before they are trusted (on the VM for uploads). The finished file is verified by comparing a
+#streamed SHA-256 of the local file with sha256sum run on the VM. --compress turns on
+#SSH (zlib) compression for the connection.
+
+import argparse
+import hashlib
+import json
+import os
+import shlex
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ssh_jobs import SSHPool, run_command
+
+RANGE_SIZE = 64 * 1024 * 1024
+BLOCK_SIZE = 1024 * 1024
+WINDOW_SIZE = 64 * 1024 * 1024
+MAX_PACKET_SIZE = 256 * 1024
+PREFETCH_REQUESTS = 64
+
+
+# SFTP session on a pooled connection with a large flow-control window; it takes one of the
+# connection's channels until it is closed, so concurrent ranges spread over the pool
+def open_sftp(pool):
+    return pool.open_sftp(window_size=WINDOW_SIZE, max_packet_size=MAX_PACKET_SIZE)
+
+
+# (index, offset, length) of the ranges a file of `size` bytes is transferred in
+def file_ranges(size, range_size=RANGE_SIZE):
+    return [(index, offset, min(range_size, size - offset))
+            for index, offset in enumerate(range(0, size, range_size))]
+
+
+def sha256_file(path, start=0, length=None):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        file.seek(start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            block = file.read(BLOCK_SIZE if remaining is None else min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            digest.update(block)
+            if remaining is not None:
+                remaining -= len(block)
+    return digest.hexdigest()
+
+
+# SHA-256 of a file on the VM, streamed there by sha256sum
+def remote_sha256(pool, remote_path):
+    result = run_command(pool, f'sha256sum {shlex.quote(remote_path)}')
+    if result['exit_status'] != 0:
+        raise IOError(f"sha256sum {remote_path} failed: {result['stderr'].decode('utf-8', 'replace')}")
+    return result['stdout'].split()[0].decode('ascii')
+
+
+# SHA-256 of each (offset, length) range of a file on the VM, in order, from one dd and
+# sha256sum pipeline per range
+def remote_range_sha256s(pool, remote_path, ranges):
+    if not ranges:
+        return []
+    command = '; '.join(f'dd if={shlex.quote(remote_path)} bs={BLOCK_SIZE} skip={offset} count={length} '
+                        f'iflag=skip_bytes,count_bytes 2>/dev/null | sha256sum'
+                        for offset, length in ranges)
+    result = run_command(pool, command)
+    digests = [line.split()[0].decode('ascii') for line in result['stdout'].splitlines() if line.strip()]
+    if result['exit_status'] != 0 or len(digests) != len(ranges):
+        raise IOError(f"hashing the ranges of {remote_path} failed: {result['stderr'].decode('utf-8', 'replace')}")
+    return digests
+
+
+def load_state(state_path, expected):
+    try:
+        with open(state_path) as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        return None
+    return state if all(state.get(key) == value for key, value in expected.items()) else None
+
+
+def save_state(state_path, state):
+    with open(state_path + '.tmp', 'w') as file:
+        json.dump(state, file)
+    os.replace(state_path + '.tmp', state_path)
+
+
+# Transfer the ranges not yet done in state with `workers` concurrent channels;
+# transfer_range(sftp, offset, length) returns the SHA-256 of the range
+def transfer_ranges(pool, ranges, state, state_path, transfer_range, workers):
+    lock = threading.Lock()
+    todo = [item for item in ranges if str(item[0]) not in state['done']]
+
+    def run(item):
+        index, offset, length = item
+        sftp = open_sftp(pool)
+        try:
+            digest = transfer_range(sftp, offset, length)
+        finally:
+            sftp.close()
+        with lock:
+            state['done'][str(index)] = digest
+            save_state(state_path, state)
+
+    with ThreadPoolExecutor(workers) as executor:
+        list(executor.map(run, todo))
+    return len(todo)
+
+
+# Upload local_path to remote_path; returns the transfer statistics
+def upload(pool, local_path, remote_path, workers=4, range_size=RANGE_SIZE, verify=True):
+    started = time.perf_counter()
+    stat = os.stat(local_path)
+    part_path = remote_path + '.part'
+    state_path = local_path + '.upload.json'
+    expected = {'remote_path': remote_path, 'size': stat.st_size, 'mtime': stat.st_mtime, 'range_size': range_size}
+    state = load_state(state_path, expected)
+    ranges = file_ranges(stat.st_size, range_size)
+
+    sftp = open_sftp(pool)
+    try:
+        # Resume only from a remote part file of the full size. It is created at that size,
+        # so the ranges recorded as done are re-hashed on the VM and only those that still
+        # match are kept
+        try:
+            if state is not None and sftp.stat(part_path).st_size != stat.st_size:
+                state = None
+        except IOError:
+            state = None
+        if state is not None:
+            indices = list(state['done'])
+            digests = remote_range_sha256s(pool, part_path, [ranges[int(index)][1:] for index in indices])
+            state['done'] = {index: digest for index, digest in zip(indices, digests) if digest == state['done'][index]}
+        else:
+            state = dict(expected, done={})
+            with sftp.open(part_path, 'w') as remote_file:
+                remote_file.truncate(stat.st_size)
+        save_state(state_path, state)
+
+        def upload_range(range_sftp, offset, length):
+            digest = hashlib.sha256()
+            with open(local_path, 'rb') as local_file, range_sftp.open(part_path, 'r+') as remote_file:
+                remote_file.set_pipelined(True)
+                local_file.seek(offset)
+                remote_file.seek(offset)
+                remaining = length
+                while remaining > 0:
+                    block = local_file.read(min(BLOCK_SIZE, remaining))
+                    digest.update(block)
+                    remote_file.write(block)
+                    remaining -= len(block)
+            return digest.hexdigest()
+
+        transferred = transfer_ranges(pool, ranges, state, state_path, upload_range, workers)
+        if verify and sha256_file(local_path) != remote_sha256(pool, part_path):
+            os.remove(state_path)
+            raise IOError(f'SHA-256 mismatch after uploading {local_path}; the transfer will restart')
+        sftp.posix_rename(part_path, remote_path)
+    finally:
+        sftp.close()
+    os.remove(state_path)
+    return {'bytes': stat.st_size, 'ranges_transferred': transferred,
+            'ranges_resumed': len(state['done']) - transferred, 'seconds': time.perf_counter() - started}
+
+
+# Download remote_path to local_path; returns the transfer statistics
+def download(pool, remote_path, local_path, workers=4, range_size=RANGE_SIZE, verify=True):
+    started = time.perf_counter()
+    part_path = local_path + '.part'
+    state_path = local_path + '.download.json'
+    sftp = open_sftp(pool)
+    try:
+        stat = sftp.stat(remote_path)
+    finally:
+        sftp.close()
+    expected = {'remote_path': remote_path, 'size': stat.st_size, 'mtime': stat.st_mtime, 'range_size': range_size}
+    state = load_state(state_path, expected)
+    ranges = file_ranges(stat.st_size, range_size)
+
+    if state is None or not os.path.exists(part_path) or os.path.getsize(part_path) != stat.st_size:
+        state = dict(expected, done={})
+        with open(part_path, 'wb') as local_file:
+            local_file.truncate(stat.st_size)
+    else:
+        # Keep only the ranges whose data on disk still matches the recorded checksum
+        state['done'] = {index: digest for index, digest in state['done'].items()
+                         if sha256_file(part_path, *ranges[int(index)][1:]) == digest}
+    save_state(state_path, state)
+
+    def download_range(range_sftp, offset, length):
+        digest = hashlib.sha256()
+        blocks = [(start, min(BLOCK_SIZE, offset + length - start)) for start in range(offset, offset + length, BLOCK_SIZE)]
+        with range_sftp.open(remote_path, 'r') as remote_file, open(part_path, 'r+b') as local_file:
+            local_file.seek(offset)
+            for block in remote_file.readv(blocks, PREFETCH_REQUESTS):
+                digest.update(block)
+                local_file.write(block)
+        return digest.hexdigest()
+
+    transferred = transfer_ranges(pool, ranges, state, state_path, download_range, workers)
+    if verify and sha256_file(part_path) != remote_sha256(pool, remote_path):
+        os.remove(state_path)
+        raise IOError(f'SHA-256 mismatch after downloading {remote_path}; the transfer will restart')
+    os.replace(part_path, local_path)
+    os.remove(state_path)
+    return {'bytes': stat.st_size, 'ranges_transferred': transferred,
+            'ranges_resumed': len(state['done']) - transferred, 'seconds': time.perf_counter() - started}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Resumable parallel SFTP transfer to or from the VM.')
+    parser.add_argument('command', choices=['put', 'get'])
+    parser.add_argument('source')
+    parser.add_argument('destination')
+    parser.add_argument('--workers', type=int, default=4, help='ranges transferred at the same time')
+    parser.add_argument('--range-size', type=int, default=RANGE_SIZE)
+    parser.add_argument('--compress', action='store_true', help='zlib compression on the SSH connection')
+    parser.add_argument('--no-verify', action='store_true', help='skip the SHA-256 comparison')
+    args = parser.parse_args()
+
+    with SSHPool.from_config(compress=args.compress, max_connections=1, max_channels=args.workers + 1) as pool:
+        transfer = upload if args.command == 'put' else download
+        stats = transfer(pool, args.source, args.destination, args.workers, args.range_size, not args.no_verify)
+    print(f"{stats['bytes']} bytes in {stats['seconds']:.1f}s "
+          f"({stats['bytes'] / max(stats['seconds'], 1e-9) / 2 ** 20:.1f} MB/s), "
+          f"{stats['ranges_resumed']} ranges resumed")
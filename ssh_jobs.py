@@ -0,0 +1,274 @@
+#Run commands on the VM over pooled SSH connections.
+#
+#    python ssh_jobs.py 'python3 decrypt.py' 'nproc' 'df -h'
+#
+#Connections come from ssh_connect in paramikodatapuller.py and are kept open between
+#commands; every command gets its own channel, so several commands run at once on one
+#connection (up to max_channels, sshd's MaxSessions defaults to 10) and more connections
+#are opened when needed. stdout/stderr are handed to a callback as they arrive instead of
+#being read after the command exits, and each result records the command's latency.
+
+import argparse
+import select
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import paramiko
+
+from paramikodatapuller import hostname, port, username, ssh_key_path, ssh_connect
+
+READ_SIZE = 32768
+
+
+# Raised by an output callback to stop reading a command's output and close its channel
+class StopCommand(Exception):
+    pass
+
+
+# SFTP client holding a channel slot of its pooled connection until it is closed
+class PooledSFTPClient(paramiko.SFTPClient):
+    release = None
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            release, self.release = self.release, None
+            if release is not None:
+                release()
+
+
+class SSHPool:
+    # connect is a function returning a connected paramiko.SSHClient
+    def __init__(self, connect, max_connections=2, max_channels=8):
+        self.connect = connect
+        self.max_connections = max_connections
+        self.max_channels = max_channels
+        self.clients = []  # [client, open channels]
+        self.connecting = 0  # Connections being opened, counted against max_connections
+        self.lock = threading.Condition()
+
+    # Pool of connections to the VM configured in paramikodatapuller.py
+    @classmethod
+    def from_config(cls, compress=False, **kwargs):
+        return cls(partial(ssh_connect, hostname, port, username, ssh_key_path, compress), **kwargs)
+
+    # An idle connection, else a new one while below max_connections, else the least busy
+    # connection with a free channel
+    def acquire(self):
+        with self.lock:
+            while True:
+                self.drop_dead()
+                idle = [entry for entry in self.clients if entry[1] == 0]
+                free = [entry for entry in self.clients if entry[1] < self.max_channels]
+                if idle:
+                    entry = idle[0]
+                elif len(self.clients) + self.connecting < self.max_connections:
+                    self.connecting += 1
+                    break
+                elif free:
+                    entry = min(free, key=lambda entry: entry[1])
+                else:
+                    self.lock.wait()
+                    continue
+                entry[1] += 1
+                return entry
+        # Connect without holding the lock, so a slow or hanging connect does not hold up
+        # the threads that can use the open connections
+        try:
+            client = self.connect()
+        except BaseException:
+            with self.lock:
+                self.connecting -= 1
+                self.lock.notify()
+            raise
+        with self.lock:
+            self.connecting -= 1
+            entry = [client, 1]
+            self.clients.append(entry)
+            self.lock.notify_all()  # Waiting threads can share its free channels
+            return entry
+
+    # Forget unused connections whose transport has gone away so they are reopened
+    def drop_dead(self):
+        alive = []
+        for entry in self.clients:
+            transport = entry[0].get_transport()
+            if entry[1] == 0 and (transport is None or not transport.is_active()):
+                entry[0].close()
+            else:
+                alive.append(entry)
+        self.clients = alive
+
+    def release(self, entry):
+        with self.lock:
+            entry[1] -= 1
+            self.lock.notify()
+
+    # SFTP session on a pooled connection; it counts as one of the connection's channels
+    # until the caller closes it (or leaves its with block). kwargs go to from_transport.
+    def open_sftp(self, **kwargs):
+        entry = self.acquire()
+        try:
+            sftp = PooledSFTPClient.from_transport(entry[0].get_transport(), **kwargs)
+        except BaseException:
+            self.release(entry)
+            raise
+        if sftp is None:
+            self.release(entry)
+            raise paramiko.SSHException('could not open an SFTP session')
+        sftp.release = partial(self.release, entry)
+        return sftp
+
+    def close(self):
+        with self.lock:
+            for client, _ in self.clients:
+                client.close()
+            self.clients = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Output callback printing complete lines as "[name] line", on stderr for the command's stderr
+class LinePrinter:
+    def __init__(self, name):
+        self.name = name
+        self.partial = {'stdout': b'', 'stderr': b''}
+
+    def __call__(self, stream, data):
+        lines = (self.partial[stream] + data).split(b'\n')
+        self.partial[stream] = lines.pop()
+        out = sys.stderr if stream == 'stderr' else sys.stdout
+        for line in lines:
+            print(f"[{self.name}] {line.decode('utf-8', 'replace')}", file=out, flush=True)
+
+    def flush(self):
+        for stream, data in self.partial.items():
+            if data:
+                self(stream, b'\n')
+
+
+# Send the chunks to the command's stdin, then close it
+def feed_stdin(channel, chunks, errors):
+    try:
+        for chunk in chunks:
+            channel.sendall(chunk)
+        channel.shutdown_write()
+    except Exception as error:
+        errors.append(error)
+        channel.close()
+
+
+# Run command on a pooled connection. on_output(stream, data) is called with every piece
+# of stdout/stderr as it arrives ('stdout' or 'stderr') and may raise StopCommand to
+# abandon the command; input_chunks (an iterable of bytes) is streamed to the command's
+# stdin while its output is read. Returns the exit status, the collected output and the
+# latency (total and to the first output byte); 'input_error' is set when a command that
+# failed stopped reading its input early.
+def run_command(pool, command, on_output=None, timeout=None, input_chunks=None):
+    entry = pool.acquire()
+    started = time.perf_counter()
+    result = {'command': command, 'exit_status': None, 'stdout': b'', 'stderr': b'',
+              'first_output_seconds': None}
+    output = {'stdout': [], 'stderr': []}
+    feeder = None
+    feed_errors = []
+    try:
+        channel = entry[0].get_transport().open_session()
+        channel.exec_command(command)
+        if input_chunks is not None:
+            feeder = threading.Thread(target=feed_stdin, args=(channel, input_chunks, feed_errors), daemon=True)
+            feeder.start()
+        while True:
+            got_data = False
+            for stream, ready, recv in (('stdout', channel.recv_ready, channel.recv),
+                                        ('stderr', channel.recv_stderr_ready, channel.recv_stderr)):
+                if result.get('aborted'):
+                    break
+                while ready():
+                    data = recv(READ_SIZE)
+                    if not data:
+                        break
+                    got_data = True
+                    if result['first_output_seconds'] is None:
+                        result['first_output_seconds'] = time.perf_counter() - started
+                    output[stream].append(data)
+                    if on_output is not None:
+                        try:
+                            on_output(stream, data)
+                        except StopCommand:
+                            result['aborted'] = True
+                            break
+            if result.get('aborted'):
+                channel.close()
+                break
+            if not got_data and channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                break
+            if timeout is not None and time.perf_counter() - started > timeout:
+                channel.close()
+                raise TimeoutError(f'{command!r} did not finish within {timeout} s')
+            if not got_data:
+                # The channel is readable (via its pipe) when data or the exit status arrives
+                select.select([channel], [], [], 0.5)
+        if not result.get('aborted'):
+            result['exit_status'] = channel.recv_exit_status()
+            channel.close()
+        if feeder is not None:
+            feeder.join()
+            # A command that exits before reading all of its input (e.g. decrypt.py rejecting
+            # a bad stream) makes the send fail; its exit status and stderr say why, so the
+            # send error is only raised when the command reports success
+            if feed_errors and not result.get('aborted'):
+                result['input_error'] = str(feed_errors[0])
+                if result['exit_status'] == 0:
+                    raise feed_errors[0]
+    finally:
+        pool.release(entry)
+    result['stdout'] = b''.join(output['stdout'])
+    result['stderr'] = b''.join(output['stderr'])
+    result['latency_seconds'] = time.perf_counter() - started
+    return result
+
+
+# Run commands concurrently (at most max_parallel at a time); results are in command order.
+# With stream=True each command's output is printed line by line as it arrives.
+def run_commands(pool, commands, max_parallel=4, stream=True, timeout=None):
+    def run(job):
+        index, command = job
+        printer = LinePrinter(f'job {index}') if stream else None
+        try:
+            return run_command(pool, command, printer, timeout)
+        finally:
+            if printer is not None:
+                printer.flush()
+
+    with ThreadPoolExecutor(max_parallel) as executor:
+        return list(executor.map(run, enumerate(commands)))
+
+
+def print_latencies(results):
+    for index, result in enumerate(results):
+        first = result['first_output_seconds']
+        print(f"job {index}  {result['latency_seconds']:8.3f}s  first output {'-' if first is None else f'{first:.3f}s':>8}  "
+              f"exit {result['exit_status']}  {result['command']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run commands concurrently on the VM over pooled SSH connections.')
+    parser.add_argument('commands', nargs='+')
+    parser.add_argument('--parallel', type=int, default=4, help='commands running at the same time')
+    parser.add_argument('--connections', type=int, default=2, help='SSH connections in the pool')
+    parser.add_argument('--timeout', type=float, default=None, help='seconds before a command is abandoned')
+    args = parser.parse_args()
+
+    with SSHPool.from_config(max_connections=args.connections) as pool:
+        results = run_commands(pool, args.commands, args.parallel, timeout=args.timeout)
+    print_latencies(results)
+    sys.exit(max(result['exit_status'] or 0 for result in results))
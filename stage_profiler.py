@@ -0,0 +1,129 @@
+#Per-stage instrumentation for Data_analysis.py.
+#Records wall time, CPU time, peak RSS and row counts for every pipeline stage and writes
+#them as JSON next to Task2RunResults.txt. Set PROFILE_CPROFILE=1 to also dump cProfile
+#stats per stage and PROFILE_TRACEMALLOC=1 to record the top allocations per stage.
+#With STREAM_RESULTS=1 every stage start/stop and every result passed to emit() is also
+#printed as a JSON line starting with STREAM_PREFIX, which result_stream.py picks out of
+#the output of a remote run as it arrives.
+
+import cProfile
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+REPORT_FILE = 'Task2RunProfile.json'
+DUMP_DIR = 'profiles'
+STREAM_PREFIX = '@@analysis '
+
+
+# Peak resident set size of this process so far, in MB
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class StageProfiler:
+    def __init__(self, report_path=REPORT_FILE, cprofile=False, trace_memory=False, dump_dir=DUMP_DIR, stream=None):
+        self.report_path = report_path
+        self.cprofile = cprofile
+        self.trace_memory = trace_memory
+        self.dump_dir = dump_dir
+        self.stream = stream
+        self.stages = []
+        self.started = time.time()
+        self._current = None
+
+    # Profiler configured from the PROFILE_* environment variables
+    @classmethod
+    def from_env(cls, report_path=REPORT_FILE):
+        return cls(report_path,
+                   cprofile=os.environ.get('PROFILE_CPROFILE') == '1',
+                   trace_memory=os.environ.get('PROFILE_TRACEMALLOC') == '1',
+                   dump_dir=os.environ.get('PROFILE_DUMP_DIR', DUMP_DIR),
+                   stream=sys.stdout if os.environ.get('STREAM_RESULTS') == '1' else None)
+
+    # Print a JSON line for result_stream.py when streaming is on; kind is 'start',
+    # 'stage' (a finished stage's record), 'progress', 'result' or 'done'
+    def emit(self, kind, **data):
+        if self.stream is None:
+            return
+        line = json.dumps(dict(data, kind=kind, time=time.time()), default=str)
+        print(STREAM_PREFIX + line, file=self.stream, flush=True)
+
+    # Start timing a stage; an unfinished previous stage is stopped first
+    def start(self, name):
+        if self._current is not None:
+            self.stop()
+        stage = {'name': name, 'wall': time.perf_counter(), 'cpu': time.process_time(), 'rss': peak_rss_mb()}
+        if self.cprofile:
+            stage['profile'] = cProfile.Profile()
+            stage['profile'].enable()
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        self._current = stage
+        self.emit('start', stage=name)
+
+    # Finish the current stage; rows is the number of rows the stage produced or consumed
+    def stop(self, rows=None):
+        stage = self._current
+        if stage is None:
+            return None
+        self._current = None
+        record = {
+            'name': stage['name'],
+            'wall_seconds': time.perf_counter() - stage['wall'],
+            'cpu_seconds': time.process_time() - stage['cpu'],
+            'peak_rss_mb': peak_rss_mb(),
+            'rows': rows,
+        }
+        if stage['rss'] is not None:
+            record['rss_growth_mb'] = record['peak_rss_mb'] - stage['rss']
+        if 'profile' in stage:
+            stage['profile'].disable()
+            os.makedirs(self.dump_dir, exist_ok=True)
+            record['cprofile_dump'] = os.path.join(self.dump_dir, f"{stage['name']}.prof")
+            stage['profile'].dump_stats(record['cprofile_dump'])
+        if self.trace_memory:
+            record['tracemalloc_peak_mb'] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+            record['tracemalloc_top'] = [{'location': str(stat.traceback), 'size_mb': stat.size / (1024 * 1024), 'count': stat.count} for stat in top]
+        self.stages.append(record)
+        # Rewritten after every stage so an interrupted run still leaves a report
+        self.write_report()
+        self.emit('stage', **{key: value for key, value in record.items() if key != 'tracemalloc_top'})
+        return record
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(rows)
+
+    def report(self):
+        return {
+            'started': self.started,
+            'total_wall_seconds': sum(stage['wall_seconds'] for stage in self.stages),
+            'total_cpu_seconds': sum(stage['cpu_seconds'] for stage in self.stages),
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': self.stages,
+        }
+
+    def write_report(self):
+        with open(self.report_path + '.tmp', 'w') as file:
+            json.dump(self.report(), file, indent=2)
+        os.replace(self.report_path + '.tmp', self.report_path)
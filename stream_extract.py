@@ -0,0 +1,209 @@
+#Extract a zip archive from a stream of byte chunks, e.g. straight out of the decryptor,
+#without writing the archive to disk first. Members are read in order from their local
+#headers (the central directory at the end is not needed), so only stored and deflated
+#members are supported; every member's CRC-32 and size are checked.
+
+import argparse
+import os
+import struct
+import sys
+import zlib
+
+LOCAL_HEADER = b'PK\x03\x04'
+DATA_DESCRIPTOR = b'PK\x07\x08'
+# Records after the last member: central directory, zip64 end records, end of central directory
+END_SIGNATURES = (b'PK\x01\x02', b'PK\x06\x06', b'PK\x06\x07', b'PK\x05\x06')
+
+STORED = 0
+DEFLATED = 8
+READ_SIZE = 1024 * 1024
+
+
+# Byte reader over an iterator of chunks that can push back what it read too far
+class ChunkReader:
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = bytearray()
+
+    def _fill(self, n):
+        while len(self.buffer) < n:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return False
+            self.buffer += chunk
+        return True
+
+    # Exactly n bytes, or ValueError if the stream ends first
+    def read(self, n):
+        if not self._fill(n):
+            raise ValueError('zip stream ended unexpectedly')
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    # Up to n bytes; b'' once the stream is exhausted
+    def read_some(self, n=READ_SIZE):
+        self._fill(1)
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    def at_end(self):
+        return not self._fill(1)
+
+    def unread(self, data):
+        self.buffer[:0] = data
+
+
+# Sizes from the zip64 extended information extra field, for the 32-bit fields set to 0xFFFFFFFF
+def zip64_sizes(extra, usize, csize):
+    offset = 0
+    while offset + 4 <= len(extra):
+        field_id, field_size = struct.unpack('<HH', extra[offset:offset + 4])
+        data = extra[offset + 4:offset + 4 + field_size]
+        offset += 4 + field_size
+        if field_id != 0x0001:
+            continue
+        position = 0
+        if usize == 0xFFFFFFFF:
+            usize = struct.unpack('<Q', data[position:position + 8])[0]
+            position += 8
+        if csize == 0xFFFFFFFF:
+            csize = struct.unpack('<Q', data[position:position + 8])[0]
+        return usize, csize, True
+    return usize, csize, False
+
+
+# Member name as a relative path inside out_dir; absolute paths and '..' are rejected
+def member_path(out_dir, name):
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts or name.startswith('/') or '..' in parts or ':' in parts[0]:
+        raise ValueError(f'unsafe path in zip archive: {name!r}')
+    return os.path.join(out_dir, *parts)
+
+
+# Decompressed data chunks of the member at the reader's position
+def iter_member_data(reader, method, flags, csize):
+    if method == DEFLATED:
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        while not decompressor.eof:
+            data = reader.read_some()
+            if not data:
+                raise ValueError('zip stream ended inside a deflated member')
+            out = decompressor.decompress(data)
+            if out:
+                yield out
+        # The decompressor stops at the end of the member; the rest belongs to the next record
+        reader.unread(decompressor.unused_data)
+    elif method == STORED:
+        if flags & 0x08 and csize == 0:
+            raise ValueError('stored members with a data descriptor cannot be streamed')
+        remaining = csize
+        while remaining:
+            data = reader.read(min(remaining, READ_SIZE))
+            remaining -= len(data)
+            yield data
+    else:
+        raise ValueError(f'unsupported zip compression method {method}')
+
+
+# Data chunks of a member; its CRC-32 and size are checked after the last chunk
+def iter_checked_member_data(reader, name, flags, method, crc, csize, usize, is_zip64):
+    actual_crc = 0
+    actual_size = 0
+    for data in iter_member_data(reader, method, flags, csize):
+        actual_crc = zlib.crc32(data, actual_crc)
+        actual_size += len(data)
+        yield data
+
+    if flags & 0x08:
+        descriptor = reader.read(4)
+        if descriptor == DATA_DESCRIPTOR:
+            descriptor = reader.read(4)
+        crc = struct.unpack('<I', descriptor)[0]
+        size_format = '<QQ' if is_zip64 else '<II'
+        csize, usize = struct.unpack(size_format, reader.read(struct.calcsize(size_format)))
+
+    if actual_crc != crc or actual_size != usize:
+        raise ValueError(f'CRC or size mismatch for {name} in zip archive')
+
+
+# Members of the archive in `chunks` as (name, data chunks). A member's data is read to the
+# end (and checked) before the next member is returned, whether the caller used it or not.
+def iter_zip_members(chunks):
+    reader = ChunkReader(chunks)
+    while not reader.at_end():
+        signature = reader.read(4)
+        if signature in END_SIGNATURES:
+            break
+        if signature != LOCAL_HEADER:
+            raise ValueError('not a zip stream or corrupt member header')
+        (_, flags, method, _, _, crc, csize, usize,
+         name_length, extra_length) = struct.unpack('<HHHHHIIIHH', reader.read(26))
+        name = reader.read(name_length).decode('utf-8' if flags & 0x800 else 'cp437')
+        usize, csize, is_zip64 = zip64_sizes(reader.read(extra_length), usize, csize)
+        if flags & 0x01:
+            raise ValueError(f'{name} is encrypted inside the zip archive')
+
+        data = iter_checked_member_data(reader, name, flags, method, crc, csize, usize, is_zip64)
+        yield name, data
+        for _ in data:
+            pass
+
+
+# Extract the archive in `chunks` into out_dir; members limits extraction to those names.
+# Returns the paths of the extracted files.
+def extract_zip_stream(chunks, out_dir, members=None):
+    written = []
+    for name, data in iter_zip_members(chunks):
+        path = member_path(out_dir, name)
+        if name.endswith('/'):
+            os.makedirs(path, exist_ok=True)
+            continue
+        if members is not None and name not in members:
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Written to a temporary file and renamed once the CRC checks out
+        try:
+            with open(path + '.part', 'wb') as out:
+                for block in data:
+                    out.write(block)
+        except BaseException:
+            os.remove(path + '.part')
+            raise
+        os.replace(path + '.part', path)
+        written.append(path)
+    return written
+
+
+# Extract the archive in `chunks` into anonymous in-memory files (memfd_create, Linux)
+# instead of a directory; returns {member name: file descriptor}. Readers open them as
+# /proc/self/fd/N, or /dev/fd/N in a child process the descriptors are passed to.
+def extract_zip_memfds(chunks, members=None):
+    fds = {}
+    try:
+        for name, data in iter_zip_members(chunks):
+            if name.endswith('/') or (members is not None and name not in members):
+                continue
+            fds[name] = os.memfd_create(os.path.basename(name))
+            with open(fds[name], 'wb', closefd=False) as out:
+                for block in data:
+                    out.write(block)
+    except BaseException:
+        for fd in fds.values():
+            os.close(fd)
+        raise
+    return fds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Extract a zip archive read from a file or stdin in one pass.')
+    parser.add_argument('archive', help="zip file, or '-' for stdin")
+    parser.add_argument('--out-dir', default='train')
+    args = parser.parse_args()
+
+    source = sys.stdin.buffer if args.archive == '-' else open(args.archive, 'rb')
+    with source:
+        paths = extract_zip_stream(iter(lambda: source.read(READ_SIZE), b''), args.out_dir)
+    print('Extracted ' + ', '.join(paths))
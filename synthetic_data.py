@@ -0,0 +1,120 @@
+#Synthetic ads/feeds CSVs with the same schema as train_data_ads.csv / train_data_feeds.csv,
+#for benchmarks and for trying the pipeline without the real (LFS) datasets.
+#
+#    python synthetic_data.py --out-dir bench_data --ads-rows 200000 --feeds-rows 300000 --users 50000 --overlap 0.4
+#
+#User attributes (age, city, device_size, interests) are fixed per user, interest lists are
+#'^' separated category ids and pt_d / e_et are YYYYMMDDHHMM timestamps.
+
+import argparse
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+N_CATEGORIES = 220
+
+
+# '^' joined interest lists, mostly five categories long like the real data
+def interest_lists(rng, n, max_len=7):
+    lengths = rng.choice(np.arange(1, max_len + 1), size=n, p=[0.04, 0.05, 0.06, 0.08, 0.55, 0.12, 0.10])
+    return ['^'.join(map(str, rng.choice(N_CATEGORIES, size=k, replace=False))) for k in lengths]
+
+
+# YYYYMMDDHHMM timestamps spread over `days` days starting at start_date
+def timestamps(rng, n, start_date, days):
+    start = np.datetime64(datetime.strptime(start_date, '%Y%m%d'), 'm')
+    minutes = rng.integers(0, days * 24 * 60, size=n)
+    stamps = pd.to_datetime(start + minutes.astype('timedelta64[m]'))
+    return stamps.strftime('%Y%m%d%H%M').astype(np.int64)
+
+
+# User ids of both datasets: `overlap` is the fraction of ads users that also appear in feeds
+def user_ids(rng, n_users, overlap):
+    ids = rng.choice(np.arange(100000, 100000 + 4 * n_users), size=2 * n_users, replace=False)
+    ads_users = ids[:n_users]
+    n_shared = int(round(overlap * n_users))
+    feeds_users = np.concatenate([ads_users[:n_shared], ids[n_users:2 * n_users - n_shared]])
+    return ads_users, feeds_users
+
+
+def generate_ads(rng, users, n_rows, start_date='20220603', days=7):
+    n_users = len(users)
+    profile = pd.DataFrame({
+        'user_id': users,
+        'age': rng.integers(2, 10, size=n_users),
+        'gender': rng.integers(2, 5, size=n_users),
+        'residence': rng.integers(10, 46, size=n_users),
+        'city': rng.integers(100, 500, size=n_users),
+        'city_rank': rng.integers(2, 6, size=n_users),
+        'device_size': rng.integers(1000, 3500, size=n_users),
+        'u_newsCatInterestsST': interest_lists(rng, n_users),
+        'u_refreshTimes': rng.integers(0, 10, size=n_users),
+        'u_feedLifeCycle': rng.integers(10, 18, size=n_users),
+    })
+    # Skewed activity: a few users produce most of the rows
+    rows = rng.zipf(1.6, size=n_rows) % n_users
+    df = profile.iloc[rows].reset_index(drop=True)
+    df.insert(0, 'label', rng.choice([0, 1], size=n_rows, p=[0.97, 0.03]))
+    df['net_type'] = rng.integers(2, 8, size=n_rows)
+    df['task_id'] = rng.integers(10000, 40000, size=n_rows)
+    df['adv_id'] = rng.integers(10000, 25000, size=n_rows)
+    df['slot_id'] = rng.integers(10, 70, size=n_rows)
+    df['ad_click_list_v001'] = interest_lists(rng, n_rows)
+    df['pt_d'] = timestamps(rng, n_rows, start_date, days)
+    df['log_id'] = np.arange(n_rows) + 300000
+    return df
+
+
+def generate_feeds(rng, users, n_rows, start_date='20220603', days=7):
+    n_users = len(users)
+    profile = pd.DataFrame({
+        'u_userId': users,
+        'u_phonePrice': rng.integers(10, 17, size=n_users),
+        'u_browserLifeCycle': rng.integers(10, 18, size=n_users),
+        'u_refreshTimes': rng.integers(0, 10, size=n_users),
+        'u_newsCatInterests': interest_lists(rng, n_users),
+        'u_newsCatDislike': interest_lists(rng, n_users, max_len=7),
+        'u_newsCatInterestsST': interest_lists(rng, n_users),
+    })
+    rows = rng.zipf(1.6, size=n_rows) % n_users
+    df = profile.iloc[rows].reset_index(drop=True)
+    df['i_docId'] = rng.integers(0, 10 ** 9, size=n_rows).astype(str)
+    df['i_cat'] = rng.integers(0, N_CATEGORIES, size=n_rows)
+    df['e_ch'] = rng.integers(1, 20, size=n_rows)
+    df['e_et'] = timestamps(rng, n_rows, start_date, days)
+    df['label'] = rng.choice([-1, 1], size=n_rows, p=[0.9, 0.1])
+    df['cillabel'] = rng.choice([-1, 1], size=n_rows, p=[0.95, 0.05])
+    df['pro'] = rng.integers(0, 100, size=n_rows)
+    return df
+
+
+# Write train_data_ads.csv and train_data_feeds.csv into out_dir; returns their paths
+def write_synthetic_dataset(out_dir, ads_rows=100000, feeds_rows=100000, n_users=20000, overlap=0.3,
+                            start_date='20220603', days=7, seed=42):
+    rng = np.random.default_rng(seed)
+    ads_users, feeds_users = user_ids(rng, n_users, overlap)
+    os.makedirs(out_dir, exist_ok=True)
+    ads_file_path = os.path.join(out_dir, 'train_data_ads.csv')
+    feeds_file_path = os.path.join(out_dir, 'train_data_feeds.csv')
+    generate_ads(rng, ads_users, ads_rows, start_date, days).to_csv(ads_file_path, index=False)
+    generate_feeds(rng, feeds_users, feeds_rows, start_date, days).to_csv(feeds_file_path, index=False)
+    return ads_file_path, feeds_file_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate synthetic ads/feeds CSVs.')
+    parser.add_argument('--out-dir', default='synthetic_data', help='output directory')
+    parser.add_argument('--ads-rows', type=int, default=100000)
+    parser.add_argument('--feeds-rows', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=20000, help='users per dataset')
+    parser.add_argument('--overlap', type=float, default=0.3, help='fraction of ads users that are also in feeds')
+    parser.add_argument('--start-date', default='20220603', help='first pt_d date (YYYYMMDD)')
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    paths = write_synthetic_dataset(args.out_dir, args.ads_rows, args.feeds_rows, args.users, args.overlap,
+                                    args.start_date, args.days, args.seed)
+    print('Wrote ' + ', '.join(paths))
@@ -0,0 +1,20 @@
+#Shared fixtures for the tests: a local SSH server (ssh_stub.py) standing in for the VM,
+#started once per session.
+#
+#    python -m pytest tests
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+@pytest.fixture(scope='session')
+def sshd(tmp_path_factory):
+    from ssh_stub import StubSSHD
+
+    server = StubSSHD(str(tmp_path_factory.mktemp('sshd')))
+    yield server
+    server.close()
@@ -0,0 +1,116 @@
+#Local SSH server for testing and benchmarking ssh_jobs.py without the VM.
+#
+#A paramiko ServerInterface that accepts any password and runs every exec request as a
+#local shell command in its own process, with stdin, stdout and stderr passed through the
+#channel as they come. Each connection is a separate paramiko Transport, so pooled
+#connections and concurrent channels behave as they do against sshd. SFTP sessions can be
+#opened, but the server supports no file operations on them.
+
+import os
+import socket
+import subprocess
+import threading
+from functools import partial
+
+import paramiko
+
+READ_SIZE = 4096
+
+
+class StubServer(paramiko.ServerInterface):
+    def __init__(self, cwd=None):
+        self.cwd = cwd
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED if kind == 'session' else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=run_exec, args=(channel, command, self.cwd), daemon=True).start()
+        return True
+
+
+# Copy a pipe of the process to the channel until the process closes it
+def pump(pipe, send):
+    for data in iter(lambda: os.read(pipe.fileno(), READ_SIZE), b''):
+        send(data)
+
+
+# Copy the channel's input to the process until the client closes its side
+def feed(channel, stdin):
+    try:
+        for data in iter(lambda: channel.recv(65536), b''):
+            stdin.write(data)
+            stdin.flush()
+    except (OSError, ValueError):
+        pass  # The process exited without reading all of its input
+    finally:
+        try:
+            stdin.close()
+        except OSError:
+            pass
+
+
+def run_exec(channel, command, cwd):
+    process = subprocess.Popen(command, shell=True, cwd=cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, start_new_session=True)
+    threading.Thread(target=feed, args=(channel, process.stdin), daemon=True).start()
+    stderr = threading.Thread(target=pump, args=(process.stderr, channel.sendall_stderr))
+    stderr.start()
+    try:
+        pump(process.stdout, channel.sendall)
+        stderr.join()
+        status = process.wait()
+        channel.send_exit_status(status if status >= 0 else 128 - status)  # Killed: 128 + signal, as sh reports
+    except OSError:
+        process.kill()  # The client closed the channel
+    finally:
+        channel.close()
+
+
+class StubSSHD:
+    def __init__(self, cwd=None):
+        self.cwd = cwd
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(64)
+        self.port = self.sock.getsockname()[1]
+        self.transports = []
+        self.connections = 0
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, paramiko.SFTPServerInterface)
+            transport.start_server(server=StubServer(self.cwd))
+            self.transports.append(transport)
+            self.connections += 1
+
+    # Function returning a new connected paramiko.SSHClient, as SSHPool takes it
+    def connector(self):
+        return partial(connect, self.port)
+
+    def close(self):
+        self.sock.close()
+        for transport in self.transports:
+            transport.close()
+
+
+def connect(port):
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    client.connect('127.0.0.1', port, 'bench', password='bench', look_for_keys=False, allow_agent=False)
+    return client
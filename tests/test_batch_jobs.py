@@ -0,0 +1,20 @@
+#Job spec checks of batch_jobs.py.
+
+import pytest
+
+from batch_jobs import expand_jobs
+
+
+# Names become directories on the VM and under --results-dir, so they cannot leave them
+@pytest.mark.parametrize('name', ['../x', 'a/b', 'a\\b', '.', '..', '', 5])
+def test_job_name_rejected(tmp_path, name):
+    data = tmp_path / 'data.bin'
+    data.touch()
+    with pytest.raises(ValueError, match='plain file name'):
+        expand_jobs({'jobs': [{'name': name, 'data': str(data)}]})
+
+
+def test_job_name_from_data(tmp_path):
+    data = tmp_path / '0601.bin'
+    data.touch()
+    assert [job['name'] for job in expand_jobs({'jobs': [{'data': str(data)}]})] == ['0601']
@@ -0,0 +1,45 @@
+#Delta computed by delta_sync.py and applied by delta_helper.py, both run locally.
+
+import io
+import os
+
+import pytest
+
+from delta_helper import apply_patch, write_signature
+from delta_sync import compute_delta, iter_delta_records, parse_signatures, sha256_file
+
+BLOCK_SIZE = 1024
+
+
+# Sync new over old as delta_upload does; returns the patch statistics
+def sync(tmp_path, old, new):
+    basis, local = tmp_path / 'basis', tmp_path / 'local'
+    basis.write_bytes(old)
+    local.write_bytes(new)
+    output = io.BytesIO()
+    write_signature(str(basis), BLOCK_SIZE, output)
+    signatures, tail = parse_signatures(output.getvalue(), BLOCK_SIZE)
+    ops = compute_delta(str(local), signatures, BLOCK_SIZE, tail)
+    delta = io.BytesIO(b''.join(iter_delta_records(str(local), ops)))
+    stats = apply_patch(str(basis), str(basis), sha256_file(str(local)), BLOCK_SIZE, delta)
+    assert basis.read_bytes() == new
+    return stats
+
+
+@pytest.mark.parametrize('size', [BLOCK_SIZE * 10 + 300, 300, BLOCK_SIZE * 4])
+def test_unchanged_file_sends_nothing(tmp_path, size):
+    data = os.urandom(size)
+    assert sync(tmp_path, data, data) == {'copied_bytes': size, 'literal_bytes': 0}
+
+
+# Only the edit is sent; the short last block is reused
+def test_edit_at_start(tmp_path):
+    data = os.urandom(BLOCK_SIZE * 10 + 300)
+    stats = sync(tmp_path, data, b'new' + data[10:])
+    assert stats['literal_bytes'] < BLOCK_SIZE and stats['copied_bytes'] >= len(data) - BLOCK_SIZE - 10
+
+
+def test_append(tmp_path):
+    data = os.urandom(BLOCK_SIZE * 10 + 300)
+    stats = sync(tmp_path, data, data + b'appended')
+    assert stats['copied_bytes'] == BLOCK_SIZE * 10 and stats['literal_bytes'] == 300 + len('appended')
@@ -0,0 +1,43 @@
+#How sftp_transfer.py spreads its SFTP channels over the pooled connections.
+
+import threading
+
+from sftp_transfer import open_sftp, transfer_ranges
+from ssh_jobs import SSHPool
+
+CONNECTIONS = 4
+CHANNELS = 3
+
+
+# Open sessions fill every connection up to max_channels and give their channels back on close
+def test_open_sftp_spreads_channels(sshd):
+    with SSHPool(sshd.connector(), max_connections=CONNECTIONS, max_channels=CHANNELS) as pool:
+        sessions = [open_sftp(pool) for _ in range(CONNECTIONS * CHANNELS)]
+        assert [channels for _, channels in pool.clients] == [CHANNELS] * CONNECTIONS
+        for sftp in sessions:
+            sftp.close()
+        assert [channels for _, channels in pool.clients] == [0] * CONNECTIONS
+
+
+# Ranges transferred at the same time use separate connections when the pool allows one
+# channel per connection
+def test_transfer_ranges_use_separate_connections(sshd, tmp_path):
+    transports = set()
+    counts = []
+    # Runs once all ranges are open, before any of them finishes
+    all_open = threading.Barrier(CONNECTIONS, lambda: counts.extend(channels for _, channels in pool.clients),
+                                 timeout=10)
+
+    def transfer_range(sftp, offset, length):
+        transports.add(sftp.get_channel().get_transport())
+        all_open.wait()
+        return str(offset)
+
+    ranges = [(index, index * 10, 10) for index in range(CONNECTIONS)]
+    state = {'done': {}}
+    with SSHPool(sshd.connector(), max_connections=CONNECTIONS, max_channels=1) as pool:
+        transferred = transfer_ranges(pool, ranges, state, str(tmp_path / 'state.json'), transfer_range, CONNECTIONS)
+        assert [channels for _, channels in pool.clients] == [0] * CONNECTIONS
+    assert transferred == CONNECTIONS and len(transports) == CONNECTIONS
+    assert counts == [1] * CONNECTIONS
+    assert state['done'] == {str(index): str(offset) for index, offset, _ in ranges}
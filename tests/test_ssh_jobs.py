@@ -0,0 +1,88 @@
+#SSHPool, run_command and run_streaming against the local stub server (ssh_stub.py).
+
+import subprocess
+import threading
+import time
+
+import pytest
+
+from result_stream import run_streaming
+from ssh_jobs import SSHPool, StopCommand, run_command
+
+SLEEP_SECONDS = 0.3
+CONNECT_DELAY = 1.0
+
+
+# A slow connect does not hold up commands on the connection that is already open
+def test_acquire_during_connect(sshd):
+    connect = sshd.connector()
+    connecting = threading.Event()
+
+    def slow_connect():
+        if pool.clients:  # The second connection
+            connecting.set()
+            time.sleep(CONNECT_DELAY)
+        return connect()
+
+    with SSHPool(slow_connect, max_connections=2, max_channels=1) as pool:
+        busy = pool.acquire()
+        second = threading.Thread(target=lambda: pool.release(pool.acquire()))
+        second.start()
+        connecting.wait()
+        started = time.perf_counter()
+        pool.release(busy)
+        result = run_command(pool, 'true')
+        seconds = time.perf_counter() - started
+        second.join()
+    assert result['exit_status'] == 0
+    assert seconds < CONNECT_DELAY
+
+
+# Once the callback raises StopCommand no more output is handed to it, not even stderr
+def test_stop_command(sshd):
+    streams = []
+
+    def stop_on_stdout(stream, data):
+        streams.append(stream)
+        if stream == 'stdout':
+            time.sleep(SLEEP_SECONDS)  # stderr has arrived by now
+            raise StopCommand()
+
+    with SSHPool(sshd.connector(), max_connections=1) as pool:
+        result = run_command(pool, f'echo out; sleep 0.05; echo err >&2; sleep {SLEEP_SECONDS}', on_output=stop_on_stdout)
+    assert result['aborted'] and streams == ['stdout']
+
+
+# An open SFTP session counts as a channel of its connection until it is closed
+def test_open_sftp_holds_channel(sshd):
+    with SSHPool(sshd.connector(), max_connections=1, max_channels=2) as pool:
+        with pool.open_sftp():
+            assert [channels for _, channels in pool.clients] == [1]
+            sftp = pool.open_sftp()
+            assert [channels for _, channels in pool.clients] == [2]
+            sftp.close()
+            sftp.close()  # A second close does not give the slot back again
+            assert [channels for _, channels in pool.clients] == [1]
+        assert [channels for _, channels in pool.clients] == [0]
+
+
+# A command that exits before reading all of its input (decrypt.py rejecting a bad stream)
+# reports its own exit status and stderr instead of the failed send
+def test_input_rejected(sshd):
+    chunks = (bytes(1024 * 1024) for _ in range(256))
+    with SSHPool(sshd.connector(), max_connections=1) as pool:
+        result = run_command(pool, 'head -c 10 >/dev/null; echo bad stream >&2; exit 3', input_chunks=chunks)
+    assert result['exit_status'] == 3 and result['stderr'] == b'bad stream\n'
+    assert 'input_error' in result
+
+
+# A streamed command that times out is killed on the server with its whole process group,
+# not just abandoned (batch_jobs.py relies on this for job timeouts)
+def test_streaming_timeout(sshd):
+    marker = f'sleep {SLEEP_SECONDS * 100:.1f}'
+    with SSHPool(sshd.connector(), max_connections=1) as pool:
+        with pytest.raises(TimeoutError):
+            run_streaming(pool, f'{marker} & {marker}', timeout=SLEEP_SECONDS, name='timeout')
+    time.sleep(SLEEP_SECONDS)
+    processes = subprocess.run(['ps', '-eo', 'args'], stdout=subprocess.PIPE, text=True).stdout.splitlines()
+    assert marker not in processes
@@ -0,0 +1,49 @@
+#model_frame of user_features.py against the ads/feeds merge it replaces.
+
+import pandas as pd
+import pytest
+
+from pipeline_stages import load_and_optimize_csv
+from synthetic_data import write_synthetic_dataset
+from user_features import MODEL_COLUMNS, build_user_feature_table, update_user_feature_table
+
+
+@pytest.fixture(scope='module')
+def frames(tmp_path_factory):
+    paths = write_synthetic_dataset(str(tmp_path_factory.mktemp('data')), ads_rows=5000, feeds_rows=5000,
+                                    n_users=1000, overlap=0.3)
+    return tuple(load_and_optimize_csv(path) for path in paths)
+
+
+# The model frame as Data_analysis.py built it before the feature table: deduplicated ads
+# merged with deduplicated feeds, then ads-only and feeds-only users, incomplete rows dropped
+def merged_model_frame(df_ads, df_feeds):
+    ads = df_ads.astype({'user_id': 'int64'}).drop_duplicates(subset=['user_id'])
+    feeds = df_feeds.astype({'u_userId': 'int64'}).drop_duplicates(subset=['u_userId'])
+    both = pd.merge(ads, feeds, left_on='user_id', right_on='u_userId', how='inner').assign(target=1)
+    for column in ('u_newsCatInterestsST_y', 'u_newsCatInterests'):
+        expanded = both[column].str.split('^', expand=True)
+        both = both.join(expanded.rename(columns=lambda i: f'{column}_{i + 1}'))
+    ads_only = ads[~ads['user_id'].isin(both['user_id'])].assign(target=0)
+    feeds_only = feeds[~feeds['u_userId'].isin(both['user_id'])].assign(target=0)
+    for side in (ads_only, feeds_only):
+        for column in MODEL_COLUMNS:
+            side[column] = side[column].astype(object).fillna('unknown') if column in side else 'unknown'
+    final = pd.concat([both, ads_only, feeds_only], ignore_index=True).dropna(subset=MODEL_COLUMNS)
+    return final[MODEL_COLUMNS + ['target']].reset_index(drop=True)
+
+
+# Same rows in the same order, so train_test_split picks the same rows as before
+def test_model_frame_keeps_merge_order(frames, tmp_path):
+    table = build_user_feature_table(*frames, str(tmp_path / 'table'))
+    expected = merged_model_frame(*frames)
+    assert (table.model_frame().astype(str).values == expected.astype(str).values).all()
+
+
+# A table built in two updates orders its rows as one built from all rows at once
+def test_updated_table_keeps_merge_order(frames, tmp_path):
+    df_ads, df_feeds = frames
+    full = build_user_feature_table(df_ads, df_feeds, str(tmp_path / 'full'))
+    update_user_feature_table(str(tmp_path / 'updated'), df_ads[:2000], df_feeds[:3000])
+    updated = update_user_feature_table(str(tmp_path / 'updated'), df_ads[2000:], df_feeds[3000:])
+    assert updated.model_frame().equals(full.model_frame())
@@ -0,0 +1,318 @@
+#Per-user feature table shared by the analysis cells and the models.
+#Built once from the ads (advertiser) and feeds (publisher) data and stored as one
+#.npy file per column, so it can be memory mapped instead of re-reading the CSVs.
+#Rows are sorted by user_id which gives O(log n) lookups and cheap range slices. The rank of
+#each user's first ads and feeds row is kept as well, so model_frame can return its rows in
+#the order the original merge produced them.
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+ADS_FEATURE_COLUMNS = ['age', 'city', 'device_size']
+INTEREST_COLUMNS = ['u_newsCatInterestsST', 'u_newsCatInterests']
+INTEREST_SLOTS = 5
+
+# Names the model cells use for the expanded interest columns (the ST column comes
+# from the feeds side of the ads/feeds merge, hence the _y suffix)
+MODEL_INTEREST_NAMES = {'u_newsCatInterestsST': 'u_newsCatInterestsST_y', 'u_newsCatInterests': 'u_newsCatInterests'}
+MODEL_COLUMNS = ADS_FEATURE_COLUMNS + [f"{MODEL_INTEREST_NAMES[col]}_{i+1}" for col in INTEREST_COLUMNS for i in range(INTEREST_SLOTS)]
+
+# Columns that are summed when two tables are merged; the remaining feature columns keep
+# the first value seen for a user
+COUNT_COLUMNS = ['ads_rows', 'feeds_rows', 'ads_hour_counts', 'ads_day_counts']
+# Rank of the user's first row in the ads and feeds data, -1 when the user is not there
+ORDER_COLUMNS = ['ads_order', 'feeds_order']
+
+META_FILE = 'meta.json'
+
+
+def interest_slot_columns(column_name):
+    return [f"{column_name}_{i+1}" for i in range(INTEREST_SLOTS)]
+
+
+# Size and modification time of the source files, used to detect a stale table
+def source_fingerprint(sources):
+    fingerprint = []
+    for source in sources or []:
+        stat = os.stat(source)
+        fingerprint.append({'path': os.path.abspath(source), 'size': stat.st_size, 'mtime': stat.st_mtime})
+    return fingerprint
+
+
+# Map interest strings to integer codes; the vocabulary only ever grows so codes stay stable
+def encode_interests(values, vocab):
+    values = pd.Series(values, dtype=object)
+    present = values.dropna().unique()
+    known = set(vocab)
+    vocab.extend(sorted(v for v in present if v not in known))
+    return pd.Index(vocab).get_indexer(values).astype(np.int32)
+
+
+# First row per user (same row drop_duplicates keeps) plus the number of rows per user
+def first_rows_per_user(df, id_column):
+    ids = df[id_column].astype('int64')
+    first = df.loc[~ids.duplicated()].copy()
+    first[id_column] = first[id_column].astype('int64')
+    first = first.set_index(id_column)
+    row_counts = ids.value_counts()
+    return first, row_counts
+
+
+# Split 'a^b^c' interest lists into INTEREST_SLOTS columns of codes plus the list length
+def expand_interests(series, vocab):
+    series = series.astype(str)
+    counts = (series.str.count(r'\^') + 1).to_numpy(dtype=np.int16)
+    parts = series.str.split('^', n=INTEREST_SLOTS, expand=True)
+    slots = {}
+    for i in range(INTEREST_SLOTS):
+        values = parts[i] if i in parts.columns else pd.Series(None, index=series.index, dtype=object)
+        slots[i] = encode_interests(values.to_numpy(dtype=object), vocab)
+    return slots, counts
+
+
+# Build the per-user columns from raw ads/feeds rows
+def user_feature_columns(df_ads, df_feeds, vocab):
+    ads_first, ads_rows = first_rows_per_user(df_ads, 'user_id')
+    feeds_first, feeds_rows = first_rows_per_user(df_feeds, 'u_userId')
+
+    user_id = np.union1d(ads_first.index.to_numpy(dtype=np.int64), feeds_first.index.to_numpy(dtype=np.int64))
+    n = len(user_id)
+    ads_pos = np.searchsorted(user_id, ads_first.index.to_numpy(dtype=np.int64))
+    feeds_pos = np.searchsorted(user_id, feeds_first.index.to_numpy(dtype=np.int64))
+
+    columns = {'user_id': user_id}
+    columns['in_ads'] = np.zeros(n, dtype=bool)
+    columns['in_ads'][ads_pos] = True
+    columns['in_feeds'] = np.zeros(n, dtype=bool)
+    columns['in_feeds'][feeds_pos] = True
+
+    columns['ads_rows'] = np.zeros(n, dtype=np.int32)
+    columns['ads_rows'][np.searchsorted(user_id, ads_rows.index.to_numpy(dtype=np.int64))] = ads_rows.to_numpy()
+    columns['feeds_rows'] = np.zeros(n, dtype=np.int32)
+    columns['feeds_rows'][np.searchsorted(user_id, feeds_rows.index.to_numpy(dtype=np.int64))] = feeds_rows.to_numpy()
+
+    # first_rows_per_user keeps the users in the order of their first row
+    columns['ads_order'] = np.full(n, -1, dtype=np.int64)
+    columns['ads_order'][ads_pos] = np.arange(len(ads_pos))
+    columns['feeds_order'] = np.full(n, -1, dtype=np.int64)
+    columns['feeds_order'][feeds_pos] = np.arange(len(feeds_pos))
+
+    # Ad rows per user by hour of day and day of week, so click patterns among common
+    # users can be counted without the raw rows
+    timestamps = pd.to_datetime(df_ads['pt_d'].astype(str), format='%Y%m%d%H%M')
+    row_pos = np.searchsorted(user_id, df_ads['user_id'].to_numpy(dtype=np.int64))
+    columns['ads_hour_counts'] = np.bincount(row_pos * 24 + timestamps.dt.hour.to_numpy(), minlength=n * 24).reshape(n, 24).astype(np.int32)
+    columns['ads_day_counts'] = np.bincount(row_pos * 7 + timestamps.dt.dayofweek.to_numpy(), minlength=n * 7).reshape(n, 7).astype(np.int32)
+
+    for col in ADS_FEATURE_COLUMNS:
+        columns[col] = np.full(n, -1, dtype=np.int64)
+        columns[col][ads_pos] = ads_first[col].to_numpy(dtype=np.int64)
+
+    for col in INTEREST_COLUMNS:
+        slots, counts = expand_interests(feeds_first[col], vocab)
+        for i, name in enumerate(interest_slot_columns(col)):
+            columns[name] = np.full(n, -1, dtype=np.int32)
+            columns[name][feeds_pos] = slots[i]
+        columns[f"n_{col}"] = np.zeros(n, dtype=np.int16)
+        columns[f"n_{col}"][feeds_pos] = counts
+
+    return columns
+
+
+# Merge the columns of two tables; counts are added, flags are or-ed and attributes keep the
+# value from the older table (the first row seen for that user). Users new to a side are
+# ranked after the users of the older table.
+def merge_user_feature_columns(old, new):
+    user_id = np.union1d(old['user_id'], new['user_id'])
+    old_pos = np.searchsorted(user_id, old['user_id'])
+    new_pos = np.searchsorted(user_id, new['user_id'])
+    merged = {'user_id': user_id}
+    for name in old:
+        if name == 'user_id':
+            continue
+        values = np.zeros((len(user_id),) + old[name].shape[1:], dtype=old[name].dtype)
+        if name in COUNT_COLUMNS:
+            values[old_pos] += old[name]
+            values[new_pos] += new[name]
+        elif name in ('in_ads', 'in_feeds'):
+            values[old_pos] |= old[name]
+            values[new_pos] |= new[name]
+        elif name in ORDER_COLUMNS:
+            present = old[name] >= 0
+            values[:] = -1
+            values[new_pos] = np.where(new[name] >= 0, new[name] + old[name].max(initial=-1) + 1, -1)
+            values[old_pos[present]] = old[name][present]
+        else:
+            side = 'in_ads' if name in ADS_FEATURE_COLUMNS else 'in_feeds'
+            values[:] = 0 if name.startswith('n_') else -1
+            values[new_pos[new[side]]] = new[name][new[side]]
+            values[old_pos[old[side]]] = old[name][old[side]]
+        merged[name] = values
+    return merged
+
+
+def save_user_feature_table(columns, vocab, path, sources=None):
+    os.makedirs(path, exist_ok=True)
+    meta_path = os.path.join(path, META_FILE)
+    # Drop the meta file first so a half-written table is never picked up as valid
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    for name, values in columns.items():
+        tmp_path = os.path.join(path, f"{name}.tmp.npy")
+        np.save(tmp_path, np.ascontiguousarray(values))
+        os.replace(tmp_path, os.path.join(path, f"{name}.npy"))
+    meta = {'columns': list(columns), 'rows': int(len(columns['user_id'])), 'vocab': vocab, 'sources': source_fingerprint(sources)}
+    with open(meta_path, 'w') as file:
+        json.dump(meta, file)
+
+
+def build_user_feature_table(df_ads, df_feeds, path, sources=None):
+    vocab = []
+    columns = user_feature_columns(df_ads, df_feeds, vocab)
+    save_user_feature_table(columns, vocab, path, sources)
+    return open_user_feature_table(path)
+
+
+# Add new ads/feeds rows to a saved table (or create it); only the new rows are parsed,
+# the existing table is merged column by column
+def update_user_feature_table(path, df_ads, df_feeds, sources=None):
+    table = open_user_feature_table(path)
+    if table is None:
+        return build_user_feature_table(df_ads, df_feeds, path, sources)
+    vocab = list(table.vocab)
+    new_columns = user_feature_columns(df_ads, df_feeds, vocab)
+    old_columns = {name: np.asarray(values) for name, values in table.columns.items()}
+    columns = merge_user_feature_columns(old_columns, new_columns)
+    del table, old_columns
+    save_user_feature_table(columns, vocab, path, sources)
+    return open_user_feature_table(path)
+
+
+# Frequency of every news category across all feeds rows (both interest columns combined)
+def count_interests(df_feeds):
+    combined_interests = df_feeds['u_newsCatInterestsST'].astype(str) + '^' + df_feeds['u_newsCatInterests'].astype(str)
+    combined_interests = combined_interests.str.strip('^')
+    return combined_interests.str.split('^').explode().value_counts()
+
+
+# Open a saved table with memory mapped columns; returns None if it is missing or
+# was built from different source files. A table cached for given sources is also rebuilt
+# when it has no ORDER_COLUMNS (saved before they were added).
+def open_user_feature_table(path, sources=None):
+    meta_path = os.path.join(path, META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as file:
+        meta = json.load(file)
+    if sources is not None:
+        current = source_fingerprint(sources)
+        if [s['path'] for s in current] != [s['path'] for s in meta['sources']]:
+            return None
+        if any(a['size'] != b['size'] or a['mtime'] != b['mtime'] for a, b in zip(current, meta['sources'])):
+            return None
+        if not set(ORDER_COLUMNS) <= set(meta['columns']):
+            return None
+    columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name in meta['columns']}
+    return UserFeatureTable(path, columns, meta['vocab'], meta['sources'])
+
+
+class UserFeatureTable:
+    def __init__(self, path, columns, vocab, sources=None):
+        self.path = path
+        self.columns = columns
+        self.vocab = vocab
+        self.sources = sources or []
+        self.user_id = columns['user_id']
+
+    def __len__(self):
+        return len(self.user_id)
+
+    # Row positions of the given user ids (binary search), -1 where the user is unknown
+    def positions(self, user_ids):
+        user_ids = np.atleast_1d(np.asarray(user_ids, dtype=np.int64))
+        if len(self.user_id) == 0:
+            return np.full(len(user_ids), -1, dtype=np.int64)
+        pos = np.searchsorted(self.user_id, user_ids)
+        clipped = np.minimum(pos, len(self.user_id) - 1)
+        found = (pos < len(self.user_id)) & (self.user_id[clipped] == user_ids)
+        return np.where(found, pos, -1)
+
+    def frame(self, rows, columns=None):
+        columns = columns or [name for name in self.columns if self.columns[name].ndim == 1]
+        return pd.DataFrame({name: np.asarray(self.columns[name][rows]) for name in columns})
+
+    # Batch lookup; unknown ids are skipped
+    def lookup(self, user_ids, columns=None):
+        pos = self.positions(user_ids)
+        return self.frame(pos[pos >= 0], columns)
+
+    # All users with low <= user_id < high; a contiguous slice of the memory map
+    def select_range(self, low, high, columns=None):
+        start, stop = np.searchsorted(self.user_id, [low, high])
+        return self.frame(slice(start, stop), columns)
+
+    def common_user_ids(self):
+        both = np.asarray(self.columns['in_ads']) & np.asarray(self.columns['in_feeds'])
+        return np.asarray(self.user_id[both])
+
+    # Ad rows of users in both datasets grouped by one of their ads attributes
+    # (age, city, device_size are user-level, so the first row's value is used)
+    def common_ads_counts(self, column):
+        both = np.asarray(self.columns['in_ads']) & np.asarray(self.columns['in_feeds'])
+        rows = pd.Series(np.asarray(self.columns['ads_rows'])[both])
+        return rows.groupby(np.asarray(self.columns[column])[both]).sum()
+
+    # Ad rows of users in both datasets per hour of day (0-23) or day of week (0=Monday);
+    # hours/days without any rows are left out, like a groupby on the raw rows
+    def common_hour_counts(self):
+        return self._common_histogram('ads_hour_counts')
+
+    def common_day_counts(self):
+        return self._common_histogram('ads_day_counts')
+
+    def _common_histogram(self, name):
+        both = np.asarray(self.columns['in_ads']) & np.asarray(self.columns['in_feeds'])
+        counts = pd.Series(np.asarray(self.columns[name])[both].sum(axis=0))
+        return counts[counts > 0]
+
+    # Interest strings for one slot column; missing slots become None
+    def interest_strings(self, name):
+        vocab = np.array(list(self.vocab) + [None], dtype=object)
+        return vocab[np.asarray(self.columns[name])]
+
+    # Same frame the model cells used to build by merging the deduplicated ads and feeds
+    # rows: users in both get target 1 with their expanded interests, users on one side
+    # only get target 0 and 'unknown' for the features their side does not have.
+    # drop_incomplete drops users in both whose interest lists are shorter than
+    # INTEREST_SLOTS (what dropna on the expanded columns did). Rows come in the merge's
+    # order, which train_test_split depends on: users in both and then ads-only users by
+    # their first ads row, then feeds-only users by their first feeds row (user_id order
+    # for a table without ORDER_COLUMNS).
+    def model_frame(self, drop_incomplete=True):
+        in_ads = np.asarray(self.columns['in_ads'])
+        both = in_ads & np.asarray(self.columns['in_feeds'])
+
+        final = pd.DataFrame(index=pd.RangeIndex(len(self)))
+        for col in ADS_FEATURE_COLUMNS:
+            final[col] = pd.Series(np.asarray(self.columns[col]), dtype=object).where(in_ads, 'unknown')
+
+        keep = np.ones(len(self), dtype=bool)
+        for col in INTEREST_COLUMNS:
+            counts = np.asarray(self.columns[f"n_{col}"])
+            for i, name in enumerate(interest_slot_columns(col)):
+                values = pd.Series(self.interest_strings(name), dtype=object)
+                values = values.where(~both | (counts > i), pd.NA).where(both, 'unknown')
+                final[f"{MODEL_INTEREST_NAMES[col]}_{i+1}"] = values
+            keep &= ~both | (counts >= INTEREST_SLOTS)
+
+        final['target'] = both.astype(int)
+        if set(ORDER_COLUMNS) <= set(self.columns):
+            first_row = np.where(in_ads, np.asarray(self.columns['ads_order']), np.asarray(self.columns['feeds_order']))
+            order = np.lexsort((first_row, np.where(both, 0, np.where(in_ads, 1, 2))))
+            final, keep = final.iloc[order], keep[order]
+        if drop_incomplete:
+            final = final[keep]
+        return final.reset_index(drop=True)